@@ -17,6 +17,9 @@ import ssl
 import json
 import types
 import ast
+from argparse import Namespace
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from urllib.request import ProxyHandler, HTTPSHandler, getproxies
 from urllib.parse import urlparse
 
@@ -25,21 +28,45 @@ logger = logging.getLogger('YKDL')
 
 from ykdl.common import url_to_module
 from ykdl.util.http import add_default_handler, install_default_handlers
-from ykdl.util.external import launch_player, launch_ffmpeg, launch_ffmpeg_download
-from ykdl.util.m3u8 import live_m3u8, load_m3u8
-from ykdl.util.download import save_urls
+from ykdl.util.external import launch_player, launch_ffmpeg, \
+                               launch_ffmpeg_download, launch_native_merge, \
+                               native_merge_exts, StreamMerger, \
+                               launch_ffmpeg_mux, mux_pipe_exts
+from ykdl.util.m3u8 import live_m3u8, load_m3u8, load_m3u8_mirrors
+from ykdl.util.download import save_urls, multi_hook, quiet_hook
+from ykdl.util.graph import TaskGraph
+from ykdl.util.pipe import pipe_urls
+from ykdl.util.container import Container
+from ykdl.util.progress import get_renderer, JSONLinesRenderer
+import ykdl.util.download
+from ykdl.util.journal import Journal
+from ykdl.util.archive import DownloadArchive
+from ykdl.util.scheduler import scheduler
+from ykdl.util.human import parse_size, parse_time
+from ykdl.util import checksum
+from ykdl.util import writer
+from ykdl.util import estimator
+from ykdl.util import cluster
 from ykdl.version import __version__
+from cykdl import daemon
 
 m3u8_internal = True
 args = None
 
+# the options of a job of daemon, the others follow the daemon
+_job_options = ('video_urls', 'playlist', 'info', 'json', 'format',
+                'output_dir', 'output_name', 'fail_retry_eta', 'no_merge',
+                'stream_merge', 'assemble', 'merger', 'ts_drop_psi', 'no_sub',
+                'start', 'jobs', 'engine', 'audio_only', 'start_time',
+                'end_time')
+
 def arg_parser():
     parser = ArgumentParser(description='YouKuDownLoader(ykdl {}), a video downloader. Forked from you-get 0.3.34@soimort'.format(__version__))
     parser.add_argument('-l', '--playlist', action='store_true', default=False, help='Download as a playlist')
     parser.add_argument('-i', '--info', action='store_true', default=False, help='Display the information of videos without downloading')
     parser.add_argument('-J', '--json', action='store_true', default=False, help='Display info in json format')
     parser.add_argument('-F', '--format',  help='Video format code, or resolution level 0, 1, ...')
-    parser.add_argument('-o', '--output-dir', default='.', help='Set the output directory for downloaded videos')
+    parser.add_argument('-o', '--output-dir', default='.', help="Set the output directory for downloaded videos, '-' means write the video into stdout, without temporary files")
     parser.add_argument('-O', '--output-name', default='', help='Downloaded videos with the NAME you want')
     parser.add_argument('-p', '--player', help='Directly play the video with PLAYER like mpv')
     parser.add_argument('-k', '--insecure', action='store_true', default=False, help='Allow insecure server connections when using SSL')
@@ -49,20 +76,83 @@ def arg_parser():
     parser.add_argument('--fail-retry-eta', type=int, default=3600, metavar='SECONDS', help='If the number is bigger than ETA, a fail downloading will be auto retry, default 3600s, set 0 to void it')
     parser.add_argument('--no-fail-confirm', action='store_true', default=False, help='Do not wait confirm when downloading failed, for run as tasks (non-blocking)')
     parser.add_argument('--no-merge', action='store_true', default=False, help='Do not merge video slides')
+    parser.add_argument('--stream-merge', action='store_true', default=False, help='Merge video slides (ts, mpg) while downloading, each slide is deleted once merged')
+    parser.add_argument('--assemble', action='store_true', default=False, help='Assemble video slides (ts, mpg) in one file while downloading, there are no slide files, the output is not remuxed')
+    parser.add_argument('--merger', default='ffmpeg', choices=['ffmpeg', 'native'], help='Merge video slides with FFmpeg, or natively without FFmpeg ({}, output is not remuxed), default ffmpeg'.format(', '.join(native_merge_exts)))
+    parser.add_argument('--ts-drop-psi', action='store_true', default=False, help='Drop the repeated PAT/PMT at the head of the slides when merge natively')
     parser.add_argument('--no-sub', action='store_true', default=False, help='Do not download subtitles')
     parser.add_argument('-s', '--start', type=int, default=0, metavar='INDEX_NUM', help='Start from INDEX to play/download playlist')
     parser.add_argument('-j', '--jobs', type=int, default=8, metavar='NUM', help='Number of jobs for multiprocess download')
+    parser.add_argument('--adaptive-jobs', action='store_true', default=False, help='Start from half of --jobs parts at the same time, raise it while it raises the throughput, default always --jobs')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'asyncio'], help='Download engine of multi-part videos, asyncio is suited for thousands of segments, default thread')
+    parser.add_argument('--limit-rate', type=parse_size, default=0, metavar='RATE', help='Limit the total download rate of all jobs, e.g. 500K, 2M, default unlimited')
+    parser.add_argument('--max-connections', type=int, default=0, metavar='NUM', help='Limit the total connections of all jobs, default unlimited')
+    parser.add_argument('--max-host-connections', type=int, default=0, metavar='NUM', help='Limit the connections per host, default unlimited')
+    parser.add_argument('--pipe-buffer', type=parse_size, default='64M', metavar='SIZE', help='Memory limit of the reorder buffer when write into stdout, default 64M')
+    parser.add_argument('--checksum', type=lambda s: s.lower().split(','), default=[], metavar='ALGO[,ALGO]', help='Always compute the checksums ({}) of downloading parts, which are recorded in journal'.format(', '.join(checksum.algorithms)))
+    parser.add_argument('--fsync', default='none', choices=writer.fsync_policies, help='When to flush the written parts into disk, close: when a part is closed, interval: every second and close, default none')
+    parser.add_argument('--progress', default='bar', choices=['bar', 'jsonl'], help='Show progress bar, or write the events and progress as JSON lines into --progress-fd, default bar')
+    parser.add_argument('--progress-fd', type=int, default=2, metavar='FD', help='The file descriptor which the JSON lines progress is written into, default 2 (stderr)')
+    parser.add_argument('--audio-only', action='store_true', default=False, help='Only download audio, the audio rendition or audio-only stream if there is one, otherwise the lowest quality stream')
+    parser.add_argument('--start-time', type=parse_time, metavar='TIME', help='Only download from TIME, [[HH:]MM:]SS[.ms], the segments or parts which cover the time range are downloaded')
+    parser.add_argument('--end-time', type=parse_time, metavar='TIME', help='Only download until TIME, [[HH:]MM:]SS[.ms]')
+    parser.add_argument('--download-archive', type=os.path.abspath, metavar='FILE', help='Skip the videos which have been recorded in FILE, the playlist items are skipped without extracting them if possible, record the downloaded videos in FILE')
+    parser.add_argument('--daemon', nargs='?', const=daemon.default_address, metavar='ADDRESS', help='Run as a daemon which runs the jobs from --remote, listen at a Unix socket path or HOST:PORT (requires --authkey), default {}'.format(daemon.default_address))
+    parser.add_argument('--remote', nargs='?', const=daemon.default_address, metavar='ADDRESS', help='Submit the download as a job to the daemon at ADDRESS, and show its status. The network options follow the daemon')
+    parser.add_argument('--daemon-queue', default=daemon.default_queue, metavar='FILE', help='The file which persists the job queue of daemon, default {}'.format(daemon.default_queue))
+    parser.add_argument('--workers', type=int, default=0, metavar='NUM', help='Download the slides by NUM worker processes, every worker runs --jobs connections')
+    parser.add_argument('--listen', type=cluster.parse_address, metavar='[HOST]:PORT', help='Listen at HOST:PORT for the remote workers which download the slides, requires --authkey')
+    parser.add_argument('--worker', type=cluster.parse_address, metavar='HOST:PORT', help='Run as a worker of the coordinator (--listen) at HOST:PORT, requires --authkey')
+    parser.add_argument('--authkey', default=os.environ.get('YKDL_AUTHKEY'), help='The shared key of the coordinator and workers, and the token of the daemon on TCP, default $YKDL_AUTHKEY')
     parser.add_argument('--debug', default=False, action='store_true', help='Print debug messages from ykdl')
-    parser.add_argument('video_urls', type=str, nargs='+', help='video urls')
+    parser.add_argument('video_urls', type=str, nargs='*', help='video urls')
     global args
     args = parser.parse_args()
+    if not args.video_urls and not args.daemon and not args.worker:
+        parser.error('the following arguments are required: video_urls')
+    if args.start_time is not None and args.end_time is not None and \
+            args.end_time <= args.start_time:
+        parser.error('--end-time must be after --start-time')
+    if (args.listen or args.worker) and not args.authkey:
+        parser.error('--listen and --worker require --authkey')
+    if args.daemon and not args.authkey and \
+            daemon.parse_address(args.daemon)[0] != socket.AF_UNIX:
+        parser.error('--daemon at HOST:PORT requires --authkey')
+    if args.remote and args.output_dir == '-':
+        parser.error("the job of daemon can not write into stdout, '-o -'")
+    if args.progress == 'jsonl' and (args.progress_fd == 1 or
+            args.progress_fd == 2 and args.output_dir == '-'):
+        parser.error('--progress-fd {} is used by the messages or the '
+                     'video, use another'.format(args.progress_fd))
 
 def clean_slices(name, ext, lenth):
     for i in range(lenth):
         file_name = '%s_%d.%s' % (name, i, ext)
         os.remove(file_name)
+    Journal(name, ext).remove()
+
+def merge_slices(name, ext, lenth):
+    if args.merger == 'native' and ext in native_merge_exts:
+        launch_native_merge(name, ext, lenth, args.ts_drop_psi)
+    else:
+        launch_ffmpeg(name, ext, lenth)
+    clean_slices(name, ext, lenth)
+
+def clip_parts(durations, start=None, end=None):
+    '''Return the indexes of the parts which cover the time range.'''
+    parts = []
+    t = 0
+    for no, duration in enumerate(durations):
+        if end is not None and t >= end:
+            break
+        if not start or t + duration > start:
+            parts.append(no)
+        t += duration
+    return parts
 
-def download(urls, name, ext, live=False):
+def download(urls, name, ext, live=False, mirrors=None, checksums=None,
+             subtitles=(), durations=None, refresh=None, expires=None):
+    # returns whether the video has been downloaded
     # ffmpeg can't handle local m3u8.
     # only use ffmpeg to hanle m3u8.
     global m3u8_internal
@@ -71,15 +161,52 @@ def download(urls, name, ext, live=False):
         live = live_m3u8(urls[0])
     if live:
         m3u8_internal = False
+    # only download the segments, parts or bytes which cover the time range
+    start, end = args.start_time, args.end_time
+    clip_by_ffmpeg = False
+    parts = None
+    if start is None and end is None:
+        pass
+    elif live:
+        logger.warning('{}> time range is not supported by live, download '
+                       'all'.format(name))
+        start = end = None
+    elif ext == 'm3u8':
+        pass  # the segments are selected by load_m3u8
+    elif len(urls) == 1:
+        # FFmpeg seeks by the index (e.g. moov) and HTTP Range
+        clip_by_ffmpeg = True
+    elif durations:
+        parts = clip_parts(durations, start, end)
+        if not parts:
+            logger.critical('{}> time range is out of the video'.format(name))
+            return False
+        urls = [urls[no] for no in parts]
+        mirrors = mirrors and [mirrors[no] for no in parts]
+        checksums = checksums and [checksums[no] for no in parts]
+    else:
+        logger.warning('{}> the durations of parts are unknown, download '
+                       'all'.format(name))
     # rebuild m3u8 urls when use internal downloader,
     # change the ext to segment's ext, default is 'ts',
     # otherwise change the ext to 'flv' or 'mp4'.
     audio = subtitle = None
+    playlist = ext == 'm3u8' and m3u8_internal
     if ext == 'm3u8':
         if m3u8_internal:
-            urls, audio, subtitle = load_m3u8(urls[0])
+            checksums = None
+            if mirrors:
+                urls, audio, subtitle, mirrors = load_m3u8_mirrors(
+                        mirrors[0], start, end, args.audio_only)
+            else:
+                urls, audio, subtitle = load_m3u8(urls[0], start, end,
+                                                  args.audio_only)
+            if not urls:
+                logger.critical('{}> time range is out of the video'
+                                .format(name))
+                return False
             ext = urlparse(urls[0])[2].split('.')[-1]
-            if ext not in ['ts', 'm4s', 'mp4', 'm4a']:
+            if ext not in ['ts', 'm4s', 'mp4', 'm4a', 'aac', 'mp3']:
                 ext = 'ts'
         elif live:
             ext = 'flv'
@@ -87,47 +214,220 @@ def download(urls, name, ext, live=False):
             ext = 'mp4'
 
     # OK check m3u8_internal
-    if not m3u8_internal:
-        launch_ffmpeg_download(urls[0], name + '.' + ext)
-    else:
-        if save_urls(urls, name, ext, jobs=args.jobs,
-                     fail_confirm=not args.no_fail_confirm,
-                     fail_retry_eta=args.fail_retry_eta):
-            lenth = len(urls)
-            if lenth > 1 and not args.no_merge:
-                launch_ffmpeg(name, ext, lenth)
-                clean_slices(name, ext, lenth)
-        else:
+    if not m3u8_internal or clip_by_ffmpeg:
+        output = name + '.' + ext
+        if args.output:
+            # the written data can not be taken back, no mirrors
+            return launch_ffmpeg_download(urls[0], output, args.output,
+                                          start, end) == 0
+        succeed = False
+        for url in mirrors and mirrors[0] or urls[:1]:
+            if launch_ffmpeg_download(url, output, None, start, end) == 0 or \
+                    os.path.exists(output) and os.path.getsize(output):
+                succeed = True
+                break
+            logger.warning('{}> failed, try next mirror'.format(name))
+        download_subtitles(subtitles, name)
+        return succeed
+    elif args.output:
+        if len(urls) > 1 and ext not in StreamMerger.exts:
+            logger.warning('{}> {!r} parts are written as bytes, the output '
+                           'may be unplayable'.format(name, ext))
+        if audio or subtitle:
+            logger.warning('{}> HLS audio and subtitle are not written into '
+                           'stdout'.format(name))
+        if not pipe_urls(urls, name, args.output, jobs=args.jobs,
+                         mirrors=mirrors, buffer_size=args.pipe_buffer):
             logger.critical('{}> donwload failed'.format(name))
+            return False
+        return True
+    else:
+        lenth = len(urls)
+        merger = None
+        reporthook = multi_hook
+        assemble = lenth > 1 and args.assemble and not args.no_merge
+        if assemble and ext not in Container.exts:
+            logger.warning('assemble does not support %r, merge after '
+                           'downloaded', ext)
+            assemble = False
+        if lenth > 1 and args.stream_merge and not args.no_merge and \
+                not assemble:
+            native = args.merger == 'native' and ext == 'ts'
+            if ext in StreamMerger.exts:
+                merger = StreamMerger(name, ext, lenth, native,
+                                      args.ts_drop_psi)
+                reporthook = merger.reporthook(reporthook)
+            else:
+                logger.warning('stream merge does not support %r, merge '
+                               'after downloaded', ext)
+
+        def fresh_urls(track=0):
+            # re-run the extractor, select the parts or segments as above,
+            # returns the urls of track, 0: video, 1: audio
+            urls, mirrors, expires = refresh()
+            if parts is not None:
+                urls = [urls[no] for no in parts]
+                mirrors = mirrors and [mirrors[no] for no in parts]
+            if playlist:
+                if mirrors:
+                    tracks = load_m3u8_mirrors(mirrors[0], start, end,
+                                               args.audio_only)
+                    mirrors = tracks[3]
+                else:
+                    tracks = load_m3u8(urls[0], start, end, args.audio_only)
+                    mirrors = None
+                urls = tracks[track]
+                if track:
+                    mirrors = None
+            return urls, mirrors, expires
+
+        # the tracks run concurrently and share the workers, only the
+        # progress of video is rendered
+        executor = ThreadPoolExecutor(max_workers=max(args.jobs, 1))
+
+        def download_video():
+            if args.workers or args.listen:
+                succeed = cluster.coordinate(urls, name, ext,
+                                             address=args.listen,
+                                             authkey=args.authkey,
+                                             processes=args.workers,
+                                             jobs=args.jobs,
+                                             reporthook=reporthook,
+                                             mirrors=mirrors,
+                                             checksums=checksums,
+                                             assemble=assemble)
+            else:
+                succeed = save_urls(urls, name, ext, jobs=args.jobs,
+                                    fail_confirm=not args.no_fail_confirm
+                                                 and graph.input,
+                                    fail_retry_eta=args.fail_retry_eta,
+                                    reporthook=reporthook,
+                                    engine=args.engine, mirrors=mirrors,
+                                    checksums=checksums, assemble=assemble,
+                                    executor=executor,
+                                    refresh=refresh and fresh_urls,
+                                    expires=expires)
+            if not succeed:
+                if merger:
+                    merger.abort()
+                logger.critical('{}> donwload failed'.format(name))
+            return succeed
+
+        def merge_video():
+            if merger:
+                if not merger.close():
+                    logger.critical('{}> stream merge failed'.format(name))
+                    return False
+                Journal(name, ext).remove()
+            elif lenth > 1 and not args.no_merge and not assemble:
+                merge_slices(name, ext, lenth)
+            else:
+                # the parts are the output
+                Journal(name, ext).remove()
+            return True
+
+        def download_track(urls, ext, track, refresh=None):
+            if save_urls(urls, name, ext, jobs=args.jobs, fail_confirm=False,
+                         fail_retry_eta=args.fail_retry_eta,
+                         reporthook=quiet_hook(), engine=args.engine,
+                         executor=executor, refresh=refresh):
+                if args.no_merge:
+                    Journal(name, ext).remove()
+                return True
+            logger.critical('{}> HLS {} donwload failed'.format(name, track))
+            return False
+
+        def track_parts(ext, lenth, assemble=False):
+            if lenth == 1 or assemble:
+                return ['%s.%s' % (name, ext)]
+            return ['%s_%d.%s' % (name, i, ext) for i in range(lenth)]
+
+        def mux_tracks():
+            # mux the parts of video and audio in one pass, without the
+            # merged files of the tracks
+            if not graph.results['audio']:
+                return merge_video()
+            video_parts = track_parts(ext, lenth, assemble)
+            audio_parts = track_parts('m4a', len(audio))
+            audio_ext = urlparse(audio[0])[2].split('.')[-1]
+            outputfile = name + '.muxing.mp4'
+            if not launch_ffmpeg_mux(outputfile, video_parts, audio_parts,
+                                     ext in StreamMerger.exts,
+                                     audio_ext in mux_pipe_exts, audio_ext):
+                logger.critical('{}> mux failed'.format(name))
+                if os.path.exists(outputfile):
+                    os.remove(outputfile)
+                return False
+            for part in video_parts + audio_parts:
+                os.remove(part)
+            os.replace(outputfile, name + '.mp4')
+            Journal(name, ext).remove()
+            Journal(name, 'm4a').remove()
+            return True
+
+        graph = TaskGraph()
+        graph.add('video', download_video)
         if audio:
-            ext = 'm4a'
-            lenth = len(audio)
-            if save_urls(audio, name, ext, jobs=args.jobs,
-                         fail_confirm=not args.no_fail_confirm,
-                         fail_retry_eta=args.fail_retry_eta):
-                if lenth > 1 and not args.no_merge:
-                    launch_ffmpeg(name, ext, lenth)
-                    clean_slices(name, ext, lenth)
+            graph.add('audio', download_track, audio, 'm4a', 'audio',
+                      refresh and partial(fresh_urls, 1))
+            if not args.no_merge and not merger:
+                graph.add('video merge', mux_tracks, deps=['video'],
+                          after=['audio'])
             else:
-                logger.critical('{}> HLS audio donwload failed'.format(name))
+                graph.add('video merge', merge_video, deps=['video'])
+                if len(audio) > 1 and not args.no_merge:
+                    graph.add('audio merge', merge_slices, name, 'm4a',
+                              len(audio), deps=['audio'])
+        else:
+            graph.add('video merge', merge_video, deps=['video'])
         if subtitle:
-            ext = 'srt'
-            if not save_urls(subtitle[:1], name, ext, jobs=args.jobs,
-                         fail_confirm=not args.no_fail_confirm,
-                         fail_retry_eta=args.fail_retry_eta):
-                logger.critical('{}> HLS subtitle donwload failed'.format(name))
+            graph.add('subtitle', download_track, subtitle[:1], 'srt',
+                      'subtitle')
+        langs = [sub['lang'] for sub in subtitles]
+        for i, sub in enumerate(subtitles):
+            lang = sub['lang']
+            if langs.count(lang) > 1:
+                # e.g. CC and AI subtitles of the same language
+                lang = '%s_%d' % (lang, i)
+            graph.add('subtitle ' + lang, download_subtitle, sub, name,
+                      quiet_hook(), fail_confirm=False, lang=lang)
+        try:
+            results = graph.run()
+        except KeyboardInterrupt:
+            # do not wait the workers at exit
+            from concurrent.futures.thread import _threads_queues
+            _threads_queues.clear()
+            raise
+        finally:
+            executor.shutdown(wait=False)
+        return bool(results['video merge'])
+
+def download_subtitle(sub, name, reporthook=multi_hook, fail_confirm=True,
+                      lang=None):
+    _name = name + '_' + (lang or sub['lang'])
+    if save_urls([sub['src']], _name, sub['format'],
+                 fail_confirm=fail_confirm and not args.no_fail_confirm,
+                 fail_retry_eta=args.fail_retry_eta, reporthook=reporthook):
+        return True
+    logger.critical('{}> donwload failed'.format(_name))
+    return False
 
 def download_subtitles(subtitles, name):
     for sub in subtitles:
-        _name = name + '_' + sub['lang']
-        if not save_urls([sub['src']], _name, sub['format'],
-                         fail_confirm=not args.no_fail_confirm,
-                         fail_retry_eta=args.fail_retry_eta):
-            logger.critical('{}> donwload failed'.format(_name))
+        download_subtitle(sub, name)
+
+def audio_stream(info):
+    '''Return the best audio-only stream, or the lowest quality stream.'''
+    for stream_id in info.stream_types:
+        if info.streams[stream_id].get('audio_only'):
+            return stream_id
+    return info.stream_types[-1]
 
-def handle_videoinfo(info, index=0):
+def handle_videoinfo(info, index=0, archive=None):
     i = args.format or '0'
-    if i.isdigit():
+    if args.audio_only and not args.format:
+        stream_id = audio_stream(info)
+    elif i.isdigit():
         i = int(i)
         if i > len(info.stream_types):
              i =  len(info.stream_types) -1
@@ -168,9 +468,16 @@ def handle_videoinfo(info, index=0):
         player_args['subs'] = args.no_sub or [sub['src'] for sub in info.subtitles]
         launch_player(args.player, urls, ext, **player_args)
     else:
-        download(urls, name, ext, live)
-        if not args.no_sub:
-            download_subtitles(info.subtitles, name)
+        stream = info.streams[stream_id]
+        subtitles = not args.no_sub and not args.output and \
+                    info.subtitles or []
+        refresh = info.reparse and partial(info.refresh_stream, stream_id)
+        if download(urls, name, ext, live, stream.get('mirrors'),
+                    stream.get('checksums'), subtitles,
+                    stream.get('durations'), refresh,
+                    stream.get('expires')) and \
+                info.archive_key and archive is not None:
+            archive.add(*info.archive_key)
 
 def main():
     arg_parser()
@@ -179,9 +486,21 @@ def main():
     else:
         logging.root.setLevel(logging.DEBUG)
 
+    if args.remote:
+        job_args = {k: getattr(args, k) for k in _job_options}
+        sys.exit(daemon.remote(args.remote, job_args, token=args.authkey))
+
     if args.timeout:
         socket.setdefaulttimeout(args.timeout)
 
+    for algorithm in args.checksum:
+        if algorithm not in checksum.algorithms:
+            logger.error('unsupported checksum algorithm: ' + algorithm)
+            sys.exit(1)
+        checksum.default_algorithms.add(algorithm)
+    writer.fsync_policy = args.fsync
+    estimator.adaptive_concurrency = args.adaptive_jobs
+
     if args.insecure:
         ssl._create_default_https_context = ssl._create_unverified_context
         args.certs = ssl.CERT_NONE
@@ -228,10 +547,68 @@ def main():
             'https': args.proxy
         }
     proxy_handler = ProxyHandler(proxies)
+    if proxies and args.engine == 'asyncio':
+        logger.warning('asyncio engine does not support proxy, use thread engine')
+        args.engine = 'thread'
 
     add_default_handler(proxy_handler)
     install_default_handlers()
 
+    scheduler.configure(args.limit_rate, args.max_connections,
+                        args.max_host_connections)
+
+    args.output = None
+    if args.output_dir == '-':
+        # write the video into stdout, print the messages into stderr
+        args.output = sys.stdout.buffer
+        args.output_dir = '.'
+        sys.stdout = sys.stderr
+        ykdl.util.download.renderer = get_renderer(sys.stderr)
+
+    if args.progress == 'jsonl':
+        try:
+            stream = os.fdopen(args.progress_fd, 'w', encoding='utf-8',
+                               closefd=False)
+        except OSError as e:
+            logger.error('can not open --progress-fd %d: %s',
+                         args.progress_fd, e)
+            sys.exit(1)
+        ykdl.util.download.renderer = JSONLinesRenderer(stream)
+
+    if args.worker:
+        cluster.work(args.worker, args.authkey, args.jobs, forever=True)
+        return
+
+    if args.daemon:
+        try:
+            daemon.serve(args.daemon, daemon.JobQueue(args.daemon_queue),
+                         run_job, _job_options, args.authkey)
+        finally:
+            close_archives()
+        return
+
+    chdir_output()
+    exit = 0
+    try:
+        exit = run_urls(args.video_urls)
+    except KeyboardInterrupt:
+        logger.info('Interrupted by Ctrl-C')
+    finally:
+        close_archives()
+    sys.exit(exit)
+
+_archives = {}  # path: DownloadArchive, opened once per process
+
+def open_archive(path):
+    if path not in _archives:
+        _archives[path] = DownloadArchive(path)
+    return _archives[path]
+
+def close_archives():
+    while _archives:
+        _archives.popitem()[1].close()
+
+def chdir_output():
     #mkdir and cd to output dir
     if not args.output_dir == '.':
         try:
@@ -244,34 +621,34 @@ def main():
     if os.path.exists(args.output_dir):
         os.chdir(args.output_dir)
 
+def run_urls(video_urls):
     exit = 0
+    archive = args.download_archive and open_archive(args.download_archive)
     try:
-        for url in args.video_urls:
+        for url in video_urls:
             try:
                 m, u = url_to_module(url)
                 if args.playlist:
                     parser = m.parser_list
                 else:
                     parser = m.parser
-                info = parser(u)
+                info = parser(u, archive)
                 if type(info) is types.GeneratorType or type(info) is list:
                     ind = 0
                     for i in info:
                         if ind < args.start:
                             ind += 1
                             continue
-                        handle_videoinfo(i, index=ind)
+                        handle_videoinfo(i, index=ind, archive=archive)
                         ind += 1
-                else:
-                    handle_videoinfo(info)
+                elif not m.archived(info.archive_key, archive):
+                    handle_videoinfo(info, archive=archive)
             except AssertionError as e:
                 logger.critical(str(e))
                 exit = 1
             except (RuntimeError, NotImplementedError, SyntaxError) as e:
                 logger.error(str(e))
                 exit = 1
-    except KeyboardInterrupt:
-        logger.info('Interrupted by Ctrl-C')
     except Exception as e:
         errmsg = str(e)
         logger.debug(errmsg, exc_info=True)
@@ -279,7 +656,25 @@ def main():
             logger.warning('Please install or update Certifi, and try again:\n'
                            'pip3 install certifi --upgrade')
         exit = 1
-    sys.exit(exit)
+    return exit
+
+def run_job(job_args, cwd):
+    '''Run a job of daemon, with the daemon's network options.'''
+    global args, m3u8_internal
+    m3u8_internal = True
+    daemon_args = args
+    args = Namespace(**vars(daemon_args))
+    for k, v in job_args.items():
+        if k in _job_options:
+            setattr(args, k, v)
+    args.no_fail_confirm = True
+    args.output = None
+    try:
+        os.chdir(cwd)
+        chdir_output()
+        return run_urls(args.video_urls)
+    finally:
+        args = daemon_args
 
 if __name__ == '__main__':
     main()
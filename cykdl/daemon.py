@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+
+'''Daemon mode of ykdl.
+
+A long-running process runs the download jobs one by one, the extractors,
+JS contexts, connection pools and caches stay warm between jobs. Jobs are
+submitted over a local Unix socket, or HTTP on TCP, the queue is persisted
+into a JSON file, the unfinished jobs continue after restart (the parts
+are resumed by their journals).
+
+API, all bodies are JSON:
+
+    POST   /jobs              {"args": {...}, "cwd": "..."} => job
+    GET    /jobs              => [job, ...]
+    GET    /jobs/<id>         => job
+    GET    /jobs/<id>/events  => streams job per line until it has finished
+    DELETE /jobs/<id>         cancel a queued job
+
+The args of a job are limited to the allowed options, the others follow
+the daemon. On TCP, the requests must carry the token of the daemon:
+
+    Authorization: Bearer <token>
+'''
+
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.client import HTTPConnection
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from ykdl.util import download
+from ykdl.util.human import human_size
+
+
+__all__ = ['default_address', 'default_queue', 'JobQueue', 'serve',
+           'remote']
+
+logger = logging.getLogger('YKDL')
+
+_home = os.path.join(os.path.expanduser('~'), '.ykdl')
+if hasattr(socket, 'AF_UNIX'):
+    default_address = os.path.join(_home, 'daemon.sock')
+else:
+    default_address = '127.0.0.1:8686'
+default_queue = os.path.join(_home, 'daemon.json')
+
+_events_interval = 0.5
+_finished = 'done', 'failed', 'cancelled'
+
+
+def parse_address(address):
+    '''Return (family, address) of a Unix socket path or HOST:PORT.'''
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+class Job:
+    def __init__(self, id, args, cwd, state='queued', exit=None,
+                 submitted=None):
+        self.id = id
+        self.args = args
+        self.cwd = cwd
+        self.state = state
+        self.exit = exit
+        self.submitted = submitted or time.time()
+        self.messages = []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'args': self.args,
+            'cwd': self.cwd,
+            'state': self.state,
+            'exit': self.exit,
+            'submitted': self.submitted
+        }
+
+    def status(self):
+        '''The job with the messages and the progress of the running.'''
+        status = self.to_dict()
+        status['messages'] = self.messages[:]
+        progress = download.progress
+        if self.state == 'running' and progress.status:
+            speed, _ = progress.speed()
+            status['progress'] = {
+                'parts': [sum(progress.status), len(progress.status)],
+                'current': progress.current,
+                'speed': speed
+            }
+        return status
+
+
+class JobQueue:
+    '''FIFO queue of jobs, it is saved after every change.'''
+
+    keep = 100  # number of the finished jobs which are kept
+
+    def __init__(self, path=default_queue):
+        self.path = os.path.abspath(path)  # the jobs change the cwd
+        self.jobs = {}
+        self.next_id = 1
+        self.cond = threading.Condition()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning('drop broken queue %r: %s', self.path, e)
+            return
+        for job in data['jobs']:
+            job = Job(**job)
+            if job.state == 'running':
+                # interrupted, run it again
+                job.state = 'queued'
+            self.jobs[job.id] = job
+        self.next_id = data['next_id']
+
+    def save(self):
+        data = json.dumps({
+            'next_id': self.next_id,
+            'jobs': [job.to_dict() for job in self.jobs.values()]
+        }, ensure_ascii=False)
+        tmp_path = self.path + '.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+
+    def submit(self, args, cwd):
+        with self.cond:
+            job = Job(self.next_id, args, cwd)
+            self.jobs[job.id] = job
+            self.next_id += 1
+            self.save()
+            self.cond.notify_all()
+        return job
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+    def list(self):
+        return list(self.jobs.values())
+
+    def next(self):
+        '''Wait and return the first queued job, which is marked running.'''
+        with self.cond:
+            while True:
+                for job in self.jobs.values():
+                    if job.state == 'queued':
+                        job.state = 'running'
+                        self.save()
+                        return job
+                self.cond.wait()
+
+    def finish(self, job, state, exit=None):
+        with self.cond:
+            job.state = state
+            job.exit = exit
+            finished = [j for j in self.jobs.values() if j.state in _finished]
+            for j in finished[:-self.keep]:
+                del self.jobs[j.id]
+            self.save()
+            self.cond.notify_all()
+
+    def cancel(self, job):
+        with self.cond:
+            if job.state != 'queued':
+                return False
+        self.finish(job, 'cancelled')
+        return True
+
+
+class _MessageHandler(logging.Handler):
+    '''Keep the log messages of the running job.'''
+
+    def __init__(self, job):
+        super().__init__(logging.WARNING)
+        self.job = job
+
+    def emit(self, record):
+        try:
+            self.job.messages.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return self.client_address and self.client_address[0] or 'local'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def authorized(self):
+        token = self.server.token
+        if token is None:
+            return True
+        auth = self.headers.get('Authorization') or ''
+        if hmac.compare_digest(auth.encode('utf-8'),
+                               ('Bearer %s' % token).encode('utf-8')):
+            return True
+        self.send_json({'error': 'unauthorized'}, 401)
+        return False
+
+    def check_job(self, data):
+        args, cwd = data['args'], data['cwd']
+        if not isinstance(args, dict) or not args.get('video_urls'):
+            raise ValueError('no video_urls')
+        options = self.server.options
+        if options is not None:
+            denied = [k for k in args if k not in options]
+            if denied:
+                raise ValueError('options are not allowed: %s'
+                                 % ', '.join(denied))
+        if not isinstance(cwd, str) or not os.path.isabs(cwd) or \
+                not os.path.isdir(cwd):
+            raise ValueError('cwd must be an existing absolute directory')
+        return args, cwd
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_job(self):
+        # /jobs/<id>[/events]
+        try:
+            job = self.server.queue.get(int(self.path.split('/')[2]))
+        except (IndexError, ValueError):
+            job = None
+        if job is None:
+            self.send_json({'error': 'job not found'}, 404)
+        return job
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == '/jobs':
+            self.send_json([job.to_dict() for job in self.server.queue.list()])
+        elif self.path.startswith('/jobs/'):
+            job = self.get_job()
+            if job is None:
+                return
+            if self.path.endswith('/events'):
+                self.send_events(job)
+            else:
+                self.send_json(job.status())
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path != '/jobs':
+            self.send_json({'error': 'not found'}, 404)
+            return
+        try:
+            data = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+            job = self.server.queue.submit(*self.check_job(data))
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json({'error': 'bad job: %s' % e}, 400)
+            return
+        self.send_json(job.to_dict(), 201)
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        job = self.get_job()
+        if job is None:
+            return
+        if self.server.queue.cancel(job):
+            self.send_json(job.to_dict())
+        else:
+            self.send_json({'error': 'job is %s' % job.state}, 409)
+
+    def send_events(self, job):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        last = None
+        while True:
+            status = job.status()
+            line = json.dumps(status, ensure_ascii=False)
+            if line != last:
+                self.wfile.write(line.encode('utf-8') + b'\n')
+                self.wfile.flush()
+                last = line
+            if status['state'] in _finished:
+                return
+            time.sleep(_events_interval)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # remove the socket which is left by a dead daemon
+        if os.path.exists(self.server_address):
+            sock = socket.socket(socket.AF_UNIX)
+            try:
+                sock.connect(self.server_address)
+            except OSError:
+                os.remove(self.server_address)
+            else:
+                raise OSError('daemon is running at %r' % self.server_address)
+            finally:
+                sock.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.server_address)),
+                    exist_ok=True)
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+
+def serve(address, queue, run_job, options=None, token=None):
+    '''Serve the API at address, run the queued jobs in current thread by
+    `run_job(args, cwd)`, which returns an exit code.
+
+    `options`, the names of args which are allowed in a job.
+    `token`, the token of requests, it is required on TCP.
+    '''
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        server = _UnixHTTPServer(address, _Handler)
+    else:
+        if not token:
+            raise ValueError('daemon on TCP requires a token')
+        server = ThreadingHTTPServer(address, _Handler)
+        server.daemon_threads = True
+    server.queue = queue
+    server.options = options
+    server.token = token or None
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name='DaemonServer').start()
+    print('Daemon is listening at %s, queue %s' % (address, queue.path))
+    try:
+        while True:
+            job = queue.next()
+            print('Run job %d: %s' % (job.id, ' '.join(job.args['video_urls'])))
+            handler = _MessageHandler(job)
+            logging.root.addHandler(handler)
+            download.progress.init()
+            try:
+                exit = run_job(job.args, job.cwd)
+            except KeyboardInterrupt:
+                # run it again after restart
+                with queue.cond:
+                    job.state = 'queued'
+                    queue.save()
+                raise
+            except Exception as e:
+                logger.error('job %d: %r', job.id, e)
+                exit = 1
+            finally:
+                logging.root.removeHandler(handler)
+            queue.finish(job, exit and 'failed' or 'done', exit)
+    except KeyboardInterrupt:
+        print('Daemon has been stopped')
+    finally:
+        server.shutdown()
+        server.server_close()
+        if family == socket.AF_UNIX:
+            os.remove(address)
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _connect(address):
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        return _UnixHTTPConnection(address)
+    return HTTPConnection(*address)
+
+def _headers(token):
+    return token and {'Authorization': 'Bearer %s' % token} or {}
+
+def _request(address, method, path, obj=None, token=None):
+    conn = _connect(address)
+    body = obj and json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    headers = _headers(token)
+    if body:
+        headers['Content-Type'] = 'application/json'
+    conn.request(method, path, body, headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+def _format_status(status):
+    line = 'Job %d: %s' % (status['id'], status['state'])
+    progress = status.get('progress')
+    if progress:
+        line += ' [%d/%d]' % tuple(progress['parts'])
+        size, total = progress['current'] or (None, None)
+        if size is not None and total and total > 0:
+            line += ' %d%%' % min(size * 100 // total, 100)
+        if progress['speed'] is not None:
+            line += ' %s/s' % human_size(int(progress['speed']))
+    return line
+
+def remote(address, args, cwd=None, token=None):
+    '''Submit the job to the daemon at address, print the status until it
+    has been finished, returns the exit code of the job.
+    '''
+    try:
+        code, job = _request(address, 'POST', '/jobs',
+                             {'args': args, 'cwd': cwd or os.getcwd()},
+                             token)
+    except OSError as e:
+        logger.error('can not connect daemon at %s: %s', address, e)
+        return 1
+    if code != 201:
+        logger.error('submit job failed: %s', job['error'])
+        return 1
+    print('Submitted job %d' % job['id'])
+    tty = sys.stdout.isatty()
+    conn = _connect(address)
+    conn.request('GET', '/jobs/%d/events' % job['id'],
+                 headers=_headers(token))
+    response = conn.getresponse()
+    messages = 0
+    status = job
+    try:
+        for line in response:
+            status = json.loads(line)
+            for message in status['messages'][messages:]:
+                print(tty and '\r' or '', message, sep='', file=sys.stderr)
+            messages = len(status['messages'])
+            print(_format_status(status), end=tty and '\r' or '\n',
+                  flush=True)
+    except KeyboardInterrupt:
+        # the job is kept running in the daemon
+        print('\nStop watching job %d' % job['id'])
+        return 0
+    print()
+    return status.get('exit') or (status['state'] != 'done' and 1 or 0)
@@ -1,4 +1,6 @@
+import threading
 from logging import getLogger
+from functools import partial
 from importlib import import_module
 from urllib.request import HTTPCookieProcessor
 
@@ -20,23 +22,38 @@ class VideoExtractor:
         self.logger = getLogger(self.name)
         self.url = None
         self.vid = None
+        self.reparse_lock = threading.Lock()
 
-    def parser(self, url):
+    def parser(self, url, archive=None):
         self.url = None
         self.vid = None
         if isinstance(url, str) and url.startswith('http'):
             self.url = url
             if self.list_only():
-                return self.parser_list(url)
+                return self.parser_list(url, archive)
         else:
             self.vid= url
 
         info = self.prepare()
         if info:
             info.sort()
+            info.reparse = partial(self.reparse, url)
+            info.archive_key = self.archive_key(self.vid) or \
+                               self.archive_key(url)
         return info
 
-    def parser_list(self, url):
+    def reparse(self, url):
+        '''Re-run the parser for the fresh urls, it is called by the download
+        threads of the tracks, the calls are serialized, the extractor is not
+        thread-safe.
+        '''
+        with self.reparse_lock:
+            return self.parser(url)
+
+    def parser_list(self, url, archive=None):
+        '''Yield the infos of playlist items, the items which have been in
+        `archive` (see ykdl.util.archive) are skipped.
+        '''
         self.url = url
         self._is_list = True
         video_list = self.prepare_list()
@@ -45,12 +62,17 @@ class VideoExtractor:
                     'playlist not support for {self.name} with url: {self.url}'
                     .format(**vars()))
         for video in video_list:
+            if self.archived(self.archive_key(video), archive):
+                continue
             if isinstance(video, VideoInfo):
                 info = video
             else:
                 info = self.parser(video)
             if info:
                 info.sort()
+                # check again by the vid, the item may be an URL
+                if self.archived(info.archive_key, archive):
+                    continue
                 yield info
 
     def prepare(self):
@@ -61,6 +83,25 @@ class VideoExtractor:
         '''
         pass
 
+    def archive_key(self, video):
+        '''Return the (site, vid) of a video, or None. The site is the
+        extractor module, so a video has the same key whatever the route,
+        the URL is the vid only if the extractor has no vid.
+        '''
+        if not isinstance(video, (str, int)):
+            return
+        site = type(self).__module__
+        if site.startswith('ykdl.extractors.'):
+            site = site[len('ykdl.extractors.'):]
+        return site, video
+
+    def archived(self, key, archive):
+        '''Check if the video has been in the archive.'''
+        if key and archive is not None and key in archive:
+            self.logger.info('%s %s has been downloaded, skipped', *key)
+            return True
+        return False
+
     def prepare_list(self):
         '''
         this API is to do real job to get source URL, or site and VID
@@ -259,10 +300,10 @@ class EmbedExtractor(VideoExtractor):
 
         return info
 
-    def parser(self, url):
+    def parser(self, url, archive=None):
         self.url = url
         if self.is_list:
-            return self.parser_list(url)
+            return self.parser_list(url, archive)
 
         self.video_info = self.new_video_info()
         self.prepare()
@@ -272,12 +313,16 @@ class EmbedExtractor(VideoExtractor):
 
         info = self._parser(self.video_info)
         if info:
+            if info.archive_key is None:
+                info.archive_key = super().archive_key(url)
             if self.name != info.site:
                 info.site = '{self.name} / {info.site}'.format(**vars())
             info.sort()
+            if info.reparse is None:
+                info.reparse = partial(self.reparse, url)
         return info
 
-    def parser_list(self, url):
+    def parser_list(self, url, archive=None):
         self.url = url
         self.video_info_list = []
         self.prepare_playlist()
@@ -288,11 +333,26 @@ class EmbedExtractor(VideoExtractor):
                 .format(**vars()))
 
         for video in self.video_info_list:
+            if self.archived(self.archive_key(video), archive):
+                continue
             if isinstance(video, VideoInfo):
                 info = video
             else:
                 info = self._parser(video)
             if info:
                 info.sort()
+                # the key of the extractor which has parsed it
+                if self.archived(info.archive_key, archive):
+                    continue
                 yield info
 
+    def archive_key(self, video_info):
+        # the key of the extractor of the site, the others are known
+        # after parsed
+        if isinstance(video_info, VideoInfo) or 'site' not in video_info:
+            return
+        site = video_info['site']
+        site = alias.get(site, site)
+        s = import_module('.'.join(['ykdl','extractors',site])).site
+        return s.archive_key(video_info['vid'])
+
@@ -21,7 +21,8 @@ class AcBase(VideoExtractor):
 
         m3u8Info = json.loads(m3u8Info)['adaptationSet'][0]['representation']
         self.logger.debug('m3u8Info:\n%s', m3u8Info)
-        url = random.choice(['url', 'backupUrl'])
+        keys = ['url', 'backupUrl']
+        random.shuffle(keys)
         for q in m3u8Info:
             if q['frameRate'] > 30:
                 # drop 60 FPS
@@ -29,9 +30,12 @@ class AcBase(VideoExtractor):
             quality = int(match1(q['qualityType'], '(\d+)'))
             stream_type = self.quality_2_id[quality]
             stream_profile = q['qualityLabel']
-            urls = q[url]
-            if not isinstance(urls, list):
-                urls = [urls]
+            mirrors = []
+            for key in keys:
+                urls = q.get(key) or []
+                if not isinstance(urls, list):
+                    urls = [urls]
+                mirrors.extend(url for url in urls if url not in mirrors)
             if stream_type not in info.streams:
                 info.stream_types.append(stream_type)
             else:
@@ -39,7 +43,8 @@ class AcBase(VideoExtractor):
             info.streams[stream_type] = {
                 'container': 'm3u8',
                 'video_profile': stream_profile,
-                'src': urls,
+                'src': mirrors[:1],
+                'mirrors': [mirrors],
                 'size': 0
             }
 
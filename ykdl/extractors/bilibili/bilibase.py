@@ -41,10 +41,21 @@ class BiliBase(VideoExtractor):
 
             durl = data['durl']
             urls = []
+            mirrors = []
+            durations = []
             size = 0
             for d in durl:
                 urls.append(d['url'])
                 size += d['size']
+                durations.append(int(d.get('length') or 0) / 1000)  # ms
+                # <backup_url><url>...</url>...</backup_url>
+                backup_url = d.get('backup_url') or []
+                if isinstance(backup_url, list):
+                    backup_url = backup_url and backup_url[0]
+                backup_url = backup_url and backup_url['url'] or []
+                if not isinstance(backup_url, list):
+                    backup_url = [backup_url]
+                mirrors.append([d['url']] + backup_url)
             fmt = data['format']
             if 'mp4' in fmt:
                 ext = 'mp4'
@@ -57,6 +68,8 @@ class BiliBase(VideoExtractor):
                     'container': ext,
                     'video_profile': prf,
                     'src' : urls,
+                    'mirrors': mirrors,
+                    'durations': all(durations) and durations or None,
                     'size': size
                 }
 
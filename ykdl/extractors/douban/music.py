@@ -33,7 +33,7 @@ class DoubanMusic(VideoExtractor):
             'size': 0
         }
 
-    def parser_list(self, url):
+    def parser_list(self, url, archive=None):
 
         sids = match1(url, 'sid=([0-9,]+)')
         assert sids, 'No sid has been found!'
@@ -48,8 +48,12 @@ class DoubanMusic(VideoExtractor):
 
         info_list = []
         for s in data['songs']:
+            key = self.archive_key(s.get('sid'))
+            if self.archived(key, archive):
+                continue
             info = VideoInfo(self.name)
             self.extract_song(info, s)
+            info.archive_key = key
             info_list.append(info)
         return info_list
 
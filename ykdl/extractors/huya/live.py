@@ -17,38 +17,14 @@ class HuyaLive(VideoExtractor):
                 '流畅': 'SD'
             }[profile]
 
-    def prepare(self):
-        info = VideoInfo(self.name, True)
-
-        html  = get_content(self.url)
-
-        json_stream = match1(html, '"stream": "([a-zA-Z0-9+=/]+)"')
-        assert json_stream, 'live video is offline'
-        data = json.loads(base64.b64decode(json_stream).decode())
-        self.logger.debug('data:\n%s', data)
-        assert data['status'] == 200, data['msg']
-
-        room_info = data['data'][0]['gameLiveInfo']
-        info.title = '{}「{} - {}」'.format(
-            room_info['roomName'], room_info['nick'], room_info['introduction'])
-        info.artist = room_info['nick']
-        screenType = room_info['screenType']
-        liveSourceType = room_info['liveSourceType']
-
-        stream_info_list = data['data'][0]['gameStreamInfoList']
-        random.shuffle(stream_info_list)
-        random.shuffle(stream_info_list)
-        while stream_info_list:
-            stream_info = stream_info_list.pop()
-            sUrl = stream_info['sFlvUrl']
-            if sUrl:
-                break
+    def get_cdn_params(self, stream_info, reSecret):
+        sUrl = stream_info['sFlvUrl']
         sStreamName = stream_info['sStreamName']
         sUrlSuffix = stream_info['sFlvUrlSuffix']
         _url = '{sUrl}/{sStreamName}.{sUrlSuffix}?'.format(**vars())
 
-        reSecret = not screenType and liveSourceType in (8, 13)
         params = dict(parse_qsl(unescape(stream_info['sFlvAntiCode'])))
+        fm = ss = None
         if reSecret:
             params.setdefault('t', '100')  # 102
             ct = int(params['wsTime'], 16) + random.random()
@@ -68,24 +44,56 @@ class HuyaLive(VideoExtractor):
              })
             fm = base64.b64decode(params['fm']).decode().split('_', 1)[0]
             ss = hash.md5('|'.join([params['seqid'], params['ctype'], params['t']]))
+        return _url, params, sStreamName, fm, ss
+
+    def prepare(self):
+        info = VideoInfo(self.name, True)
+
+        html  = get_content(self.url)
+
+        json_stream = match1(html, '"stream": "([a-zA-Z0-9+=/]+)"')
+        assert json_stream, 'live video is offline'
+        data = json.loads(base64.b64decode(json_stream).decode())
+        self.logger.debug('data:\n%s', data)
+        assert data['status'] == 200, data['msg']
+
+        room_info = data['data'][0]['gameLiveInfo']
+        info.title = '{}「{} - {}」'.format(
+            room_info['roomName'], room_info['nick'], room_info['introduction'])
+        info.artist = room_info['nick']
+        screenType = room_info['screenType']
+        liveSourceType = room_info['liveSourceType']
+
+        # every CDN is a mirror, in random order
+        stream_info_list = [stream_info for stream_info
+                            in data['data'][0]['gameStreamInfoList']
+                            if stream_info['sFlvUrl']]
+        assert stream_info_list, 'no stream is available'
+        random.shuffle(stream_info_list)
+        reSecret = not screenType and liveSourceType in (8, 13)
+        cdns = [self.get_cdn_params(stream_info, reSecret)
+                for stream_info in stream_info_list]
 
         for si in data['vMultiStreamInfo']:
             video_profile = si['sDisplayName']
             stream = self.profile_2_id(video_profile)
             rate = si['iBitRate']
-            if rate:
-                params['ratio'] = rate
-            else:
-                params.pop('ratio', None)
-            if reSecret:
-                params['wsSecret'] = hash.md5('_'.join(
+            mirrors = []
+            for _url, params, sStreamName, fm, ss in cdns:
+                if rate:
+                    params['ratio'] = rate
+                else:
+                    params.pop('ratio', None)
+                if reSecret:
+                    params['wsSecret'] = hash.md5('_'.join(
                             [fm, params['u'], sStreamName, ss, params['wsTime']]))
-            url = _url + urlencode(params, safe='*')
+                mirrors.append(_url + urlencode(params, safe='*'))
             info.stream_types.append(stream)
             info.streams[stream] = {
                 'container': 'flv',
                 'video_profile': video_profile,
-                'src': [url],
+                'src': mirrors[:1],
+                'mirrors': [mirrors],
                 'size' : float('inf')
             }
         fake_headers.update({
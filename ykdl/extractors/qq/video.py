@@ -7,7 +7,7 @@ PLAYER_PLATFORMS = [11, 2, 1]
 PLAYER_VERSION = '3.2.19.333'
 
 
-def qq_get_final_url(url, vid, fmt_id, filename, fvkey, platform):
+def qq_get_final_url(cdn_urls, vid, fmt_id, filename, fvkey, platform):
     params = {
         'appver': PLAYER_VERSION,
         'otype': 'json',
@@ -20,12 +20,13 @@ def qq_get_final_url(url, vid, fmt_id, filename, fvkey, platform):
     data = get_response('https://vv.video.qq.com/getkey', params=params).json()
     vkey = data.get('key', fvkey)
     if vkey:
-        url = '{url}{filename}?vkey={vkey}'.format(**vars())
+        urls = ['{}{}?vkey={}'.format(url, filename, vkey)
+                for url in cdn_urls]
     else:
-        url = None
+        urls = None
     vip = data.get('msg') == 'not pay'
 
-    return url, vip
+    return urls, vip
 
 class QQ(VideoExtractor):
 
@@ -85,26 +86,25 @@ class QQ(VideoExtractor):
         #self.limit = bool(iflag or pl)
         self.vip = video['drm']
 
-        # Priority for range fetch.
-        cdn_url_1 = cdn_url_2 = cdn_url_3 = None
+        # Priority for range fetch, all CDNs are kept as mirrors.
+        cdn_urls_1, cdn_urls_2, cdn_urls_3 = [], [], []
         for cdn in video['ul']['ui']:
             cdn_url = cdn['url']
             if 'vip' in cdn_url:
                 continue
             # 'video.dispatch.tc.qq.com' supported keep-alive link.
             if cdn_url.startswith('http://video.dispatch.tc.qq.com/'):
-                cdn_url_3 = cdn_url
+                cdn_urls_3.append(cdn_url)
             # IP host.
             elif match1(cdn_url, '(^http://[0-9\.]+/)'):
-                if not cdn_url_2:
-                    cdn_url_2 = cdn_url
-            elif not cdn_url_1:
-                cdn_url_1 = cdn_url
+                cdn_urls_2.append(cdn_url)
+            else:
+                cdn_urls_1.append(cdn_url)
         #if self.limit:
-        #    cdn_url = cdn_url_3 or cdn_url_1 or cdn_url_2
+        #    cdn_urls = cdn_urls_3 + cdn_urls_1 + cdn_urls_2
         #else:
-        #    cdn_url = cdn_url_1 or cdn_url_2 or cdn_url_3
-        cdn_url = cdn_url_1 or cdn_url_2 or cdn_url_3
+        #    cdn_urls = cdn_urls_1 + cdn_urls_2 + cdn_urls_3
+        cdn_urls = cdn_urls_1 + cdn_urls_2 + cdn_urls_3
 
         dt = cdn['dt']
         if dt == 1:
@@ -159,30 +159,30 @@ class QQ(VideoExtractor):
             elif fns[1][0] in ('p', 'm') and not fns[1].startswith('mp'):
                 del fns[1]
 
-            urls =[]
+            mirrors =[]
 
             if num_clips == 0:
                 filename = '.'.join(fns)
-                url, vip = qq_get_final_url(cdn_url, self.vid, fmt_id,
-                                            filename, fvkey, PLAYER_PLATFORM)
+                urls, vip = qq_get_final_url(cdn_urls, self.vid, fmt_id,
+                                             filename, fvkey, PLAYER_PLATFORM)
                 if vip:
                     self.vip = vip
-                elif url:
-                    urls.append(url)
+                elif urls:
+                    mirrors.append(urls)
             else:
                 fns.insert(-1, '1')
                 for idx in range(1, num_clips + 1):
                     fns[-2] = str(idx)
                     filename = '.'.join(fns)
-                    url, vip = qq_get_final_url(cdn_url, self.vid, fmt_id,
+                    urls, vip = qq_get_final_url(cdn_urls, self.vid, fmt_id,
                                             filename, fvkey, PLAYER_PLATFORM)
                     if vip:
                         self.vip = vip
                         break
-                    elif url:
-                        urls.append(url)
+                    elif urls:
+                        mirrors.append(urls)
 
-            yield title, fmt_name, fmt_cname, type_name, urls, size, rate
+            yield title, fmt_name, fmt_cname, type_name, mirrors, size, rate
 
     def prepare(self):
         info = VideoInfo(self.name)
@@ -211,14 +211,15 @@ class QQ(VideoExtractor):
         for _ in range(2):
             try:
                 for (title, fmt_name, stream_profile, type_name,
-                            urls, size, rate) in self.get_streams_info():
+                            mirrors, size, rate) in self.get_streams_info():
                     stream_id = self.stream_2_id[fmt_name]
-                    if urls and stream_id not in info.stream_types:
+                    if mirrors and stream_id not in info.stream_types:
                         info.stream_types.append(stream_id)
                         info.streams[stream_id] = {
                             'container': type_name,
                             'video_profile': stream_profile,
-                            'src' : urls,
+                            'src' : [urls[0] for urls in mirrors],
+                            'mirrors': mirrors,
                             'size': size
                         }
                         video_rate[stream_id] = rate
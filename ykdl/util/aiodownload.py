@@ -0,0 +1,646 @@
+'''The asyncio download engine.
+
+All parts are downloaded in one event loop, N workers keep N requests in
+flight over a pool of persistent HTTP/1.1 connections. There is no thread
+per part and no delay between submissions, that is suited for HLS streams
+with thousands of short segments.
+
+The reporthook events and the resume semantics (include the journal) are
+the same as the thread engine, see ykdl.util.download.
+'''
+
+import os
+import ssl
+import zlib
+import socket
+import asyncio
+from logging import getLogger
+from functools import partial
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+from urllib.request import HTTPSHandler
+from email.parser import BytesHeaderParser
+
+from . import http
+from .http import fake_headers
+from .journal import Journal
+from .expiry import is_expired_error
+from .checksum import Hasher, expected_checksums, etag_checksums
+from .container import PartFiles
+
+
+__all__ = ['save_parts']
+
+logger = getLogger(__name__)
+
+_redirect_codes = 301, 302, 303, 307, 308
+_max_redirections = 5
+_block_size = 1024 * 256  # 256KB
+_acquire_interval = 0.05
+_hedge_check_interval = 0.1
+
+
+def _get_ssl_context():
+    for handler in http._default_handlers:
+        if isinstance(handler, HTTPSHandler):
+            return handler._context
+    return ssl._create_default_https_context()
+
+
+class Response:
+    def __init__(self, conn, url, status, reason, headers):
+        self.conn = conn
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self.length = int(headers.get('Content-Length', -1))
+        self.chunk_left = 0
+        self.will_close = headers.get('Connection', '').lower() == 'close' \
+                          or self.length < 0 and not self.chunked
+        self.eof = self.length == 0
+
+    async def read(self, n):
+        '''Read up to n bytes of the body, return b'' on EOF.'''
+        if self.eof:
+            return b''
+        reader = self.conn.reader
+        timeout = self.conn.timeout
+        if self.chunked:
+            if not self.chunk_left:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                self.chunk_left = int(line.split(b';', 1)[0], 16)
+                if not self.chunk_left:
+                    # skip trailers
+                    while await asyncio.wait_for(reader.readline(), timeout) \
+                            not in (b'\r\n', b'\n', b''):
+                        pass
+                    self.eof = True
+                    return b''
+            n = min(n, self.chunk_left)
+        elif self.length > 0:
+            n = min(n, self.length)
+        data = await asyncio.wait_for(reader.read(n), timeout)
+        if not data:
+            if self.length > 0 or self.chunked:
+                raise IOError('incomplete read')
+            self.eof = True
+            return data
+        if self.chunked:
+            self.chunk_left -= len(data)
+            if not self.chunk_left:
+                await asyncio.wait_for(reader.readexactly(2), timeout)
+        elif self.length > 0:
+            self.length -= len(data)
+            self.eof = not self.length
+        return data
+
+    def release(self):
+        '''Return the connection to the pool if the body has been read.'''
+        if self.eof and not self.will_close:
+            self.conn.pool.put(self.conn)
+        else:
+            self.conn.close()
+
+
+class Connection:
+    def __init__(self, pool, key, reader, writer, timeout):
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.reused = False
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    '''Persistent HTTP/1.1 connections, grouped by scheme, host and port.'''
+
+    def __init__(self, timeout_q, timeout_r):
+        self.idle = {}
+        self.timeout_q = timeout_q
+        self.timeout_r = timeout_r
+        self.ssl_context = None
+
+    async def get(self, scheme, host, port, fresh=False):
+        key = scheme, host, port
+        idle = not fresh and self.idle.get(key)
+        while idle:
+            conn = idle.pop()
+            if not conn.reader.at_eof():
+                conn.reused = True
+                return conn
+            conn.close()
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = _get_ssl_context()
+            context = self.ssl_context
+        else:
+            context = None
+        reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=context,
+                                        server_hostname=context and host),
+                self.timeout_q)
+        try:
+            sock = writer.get_extra_info('socket')
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        except Exception as e:
+            logger.debug('error occurred during set_rcvbuf: %s', e)
+        return Connection(self, key, reader, writer, self.timeout_r)
+
+    def put(self, conn):
+        self.idle.setdefault(conn.key, []).append(conn)
+
+    def close(self):
+        for idle in self.idle.values():
+            for conn in idle:
+                conn.close()
+        self.idle.clear()
+
+    async def request(self, url, headers):
+        for _ in range(_max_redirections + 1):
+            u = urlsplit(url)
+            scheme = u.scheme.lower()
+            port = u.port or (scheme == 'https' and 443 or 80)
+            conn = await self.get(scheme, u.hostname, port)
+            try:
+                try:
+                    response = await self._request(conn, url, u, headers)
+                except (IOError, asyncio.IncompleteReadError):
+                    if not conn.reused:
+                        raise
+                    # the idle connection has been closed by server
+                    conn.close()
+                    conn = await self.get(scheme, u.hostname, port, True)
+                    response = await self._request(conn, url, u, headers)
+            except:
+                conn.close()
+                raise
+            if response.status in _redirect_codes and \
+                    'Location' in response.headers:
+                url = urljoin(url, response.headers['Location'])
+                response.will_close = True
+                response.release()
+                logger.debug('Redirect to URL: ' + url)
+                continue
+            if response.status >= 400:
+                response.will_close = True
+                response.release()
+                raise HTTPError(url, response.status, response.reason,
+                                response.headers, None)
+            return response
+        raise HTTPError(url, response.status, 'too many redirections',
+                        response.headers, None)
+
+    async def _request(self, conn, url, u, headers):
+        selector = u.path or '/'
+        if u.query:
+            selector += '?' + u.query
+        host = u.netloc.rpartition('@')[2]
+        lines = ['GET %s HTTP/1.1' % selector, 'Host: ' + host]
+        lines.extend('%s: %s' % kv for kv in headers.items())
+        lines.extend(['Connection: keep-alive', '', ''])
+        conn.writer.write('\r\n'.join(lines).encode('latin-1'))
+        reader = conn.reader
+        line = await asyncio.wait_for(reader.readline(), self.timeout_r)
+        if not line:
+            raise IOError('remote end closed connection without response')
+        _, status, *reason = line.decode('latin-1').split(None, 2)
+        header_lines = []
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout_r)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line)
+        headers = BytesHeaderParser().parsebytes(b''.join(header_lines))
+        return Response(conn, url, int(status), reason and reason[0].strip(),
+                        headers)
+
+
+async def _acquire(job, host):
+    # the scheduler is shared with threads, poll it, and keep the job as
+    # waiting, then it gets the fair share of connections
+    if job.try_acquire(host):
+        return
+    with job.scheduler.cond:
+        job.waiting += 1
+    try:
+        while not job.try_acquire(host):
+            await asyncio.sleep(_acquire_interval)
+    finally:
+        with job.scheduler.cond:
+            job.waiting -= 1
+
+async def _save_part(pool, mirror, name, ext, status, part, reporthook,
+                     journal, job, url, checksums=None, store=None):
+
+    def print(*args, **kwargs):
+        reporthook(['print', args, kwargs])
+
+    def record(done=False, **kwargs):
+        if journal is not None:
+            journal.update(part, url, size, filesize, crc, done, **kwargs)
+
+    def recorder():
+        # record current state after the block has been written
+        if journal is not None:
+            return partial(journal.update, part, url, size, filesize, crc)
+
+    def checksum(n):
+        crc = 0
+        with store.read(part) as fp:
+            while n > 0:
+                data = fp.read(min(n, _block_size))
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                hasher.update(data)
+                n -= len(data)
+        return crc
+
+    def expect(response):
+        etag.update(etag_checksums(response.headers))
+        expected.update(expected_checksums(response.headers,
+                                           response.status == 200))
+        expected.update(checksums or {})
+        for algorithm in list(expected) + list(etag):
+            hasher.add(algorithm)
+
+    def verify():
+        mismatched = hasher.verify(expected)
+        if mismatched:
+            logger.error('file part %d is corrupted, mismatched %s',
+                         part, ', '.join(mismatched))
+        elif hasher.verify(etag):
+            logger.warning('file part %d does not match the ETag', part)
+        return not mismatched
+
+    async def request(headers):
+        t = loop.time()
+        try:
+            response = await pool.request(mirror, headers)
+        except (IOError, asyncio.TimeoutError) as e:
+            if job is not None:
+                job.estimator.error(host, e)
+            raise
+        if job is not None:
+            job.estimator.latency(host, loop.time() - t)
+        return response
+
+    async def skip(n):
+        while n > 0:
+            data = await response.read(min(n, _block_size))
+            if not data:
+                return False
+            n -= len(data)
+        return True
+
+    if store is None:
+        store = PartFiles(name, ext)
+    headers = {k: v for k, v in fake_headers.items()
+               if k.lower() not in ('accept-encoding', 'connection')}
+    size = -1
+    filesize = 0
+    downloaded = 0
+    crc = 0
+    hasher = Hasher()
+    expected = {}
+    etag = {}
+    open_mode = 'wb'
+    response = None
+    state = journal and journal.get(part, url)
+    host = urlsplit(mirror).hostname
+    loop = asyncio.get_running_loop()
+    if job is not None:
+        await _acquire(job, host)
+    start_time = loop.time()
+    try:
+        reporthook(['part'], part=part)
+        existing = store.getsize(part)
+        if existing is not None:
+            filesize = existing
+            offset = Journal.offset(state)
+            if state and state['done'] and filesize == state['size']:
+                size = filesize
+                print('Skipped: file part %d has already been downloaded'
+                      % part)
+                status[part] = 1
+                return True
+            if 0 < offset <= filesize:
+                filesize = start = offset
+            elif filesize:
+                start = filesize - 1  # get +1, avoid 416
+            else:
+                start = None
+            if start is not None:
+                _headers = headers.copy()
+                _headers['Range'] = 'bytes=%d-' % start
+                response = await request(_headers)
+                if response.status == 206:
+                    size = int(response.headers['Content-Range'].split('/')[-1])
+                    needless_size = filesize - start
+                elif response.status == 200:
+                    size = response.length
+                    needless_size = filesize
+                expect(response)
+                if state and size != state['size']:
+                    response.release()
+                    response = None
+                elif filesize == size:
+                    response.release()
+                    response = None
+                    crc = checksum(filesize) if hasher else None
+                    if verify():
+                        print('Skipped: file part %d has already been '
+                              'downloaded' % part)
+                        status[part] = 1
+                        record(True, hashes=hasher.hexdigests())
+                        return True
+                elif filesize < size:
+                    crc = checksum(filesize)
+                    if state and crc != state['crc32']:
+                        logger.warning('file part %d: partial data is '
+                                       'corrupted, download again', part)
+                        response.release()
+                        response = None
+                    else:
+                        percent = int(filesize * 100 / size)
+                        open_mode = 'r+b'
+                        print('Restored: file part %d is incomplete at %d%%'
+                              % (part, percent))
+                        reporthook(['part'], filesize, size, part)
+                        if not await skip(needless_size):
+                            return
+        if open_mode == 'wb':
+            filesize = 0
+            crc = 0
+            hasher = Hasher(hasher.hashes)
+        if response is None:
+            response = await request(headers)
+            size = -1
+            expect(response)
+        if size < 0:
+            size = response.length
+        with store.open(part, open_mode, filesize, size) as tfp:
+            try:
+                while size < 0 or filesize < size:
+                    block = await response.read(_block_size)
+                    if not block:
+                        break
+                    crc = zlib.crc32(block, crc)
+                    if hasher:
+                        hasher.update(block)
+                    n = len(block)
+                    downloaded += n
+                    filesize += n
+                    # the loop only waits the disk when the queue is full
+                    tfp.write(block, recorder())
+                    reporthook(['part'], filesize, size, part)
+                    if job is not None:
+                        delay = job.reserve(n, part, host)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+            finally:
+                tfp.truncate(filesize)
+        response.release()
+        response = None
+        if filesize and (size < 0 or filesize == size):
+            if not verify():
+                store.remove(part)
+                if journal is not None:
+                    journal.discard(part)
+                return
+            status[part] = 1
+            record(True, hashes=hasher.hexdigests())
+            return True
+    finally:
+        if response is not None:
+            response.will_close = True
+            response.release()
+        if job is not None:
+            job.release(host)
+            job.estimator.finish_part(part, downloaded and filesize == size
+                                            and loop.time() - start_time)
+        reporthook(['part end', status, downloaded], filesize, size, part)
+
+class _HedgeJournal:
+    '''Keep the last record of the hedge, it is recorded into the journal
+    if the hedge wins.
+    '''
+
+    def __init__(self):
+        self.record = None
+
+    def get(self, part, url):
+        return None
+
+    def update(self, *args, **kwargs):
+        self.record = args, kwargs
+
+    def discard(self, part):
+        self.record = None
+
+async def _cancel(task):
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+async def _save_part_hedged(pool, mirrors, mirror, name, ext, status, part,
+                            reporthook, journal, job, url, checksums=None,
+                            store=None):
+    '''Download the part, hedge it with a duplicate request on another
+    connection (or the next mirror) once its time to response, or its
+    duration is past the observed p95. The duplicate is downloaded into
+    another file, the first completed wins, the loser is cancelled
+    without reporting. There is no hedge with a container store, it has no
+    other file.
+    '''
+    reporting = True
+
+    def primary_hook(*args, **kwargs):
+        # the cancelled primary does not report its end
+        if reporting:
+            reporthook(*args, **kwargs)
+
+    def hedge_hook(action, *args, **kwargs):
+        if action[0] == 'part end':
+            hedge_downloaded.append(action[2])
+
+    primary = asyncio.ensure_future(
+            _save_part(pool, mirrors[mirror], name, ext, status, part,
+                       primary_hook, journal, job, url, checksums, store))
+    if job is None or store is not None:
+        return await primary
+    estimator = job.estimator
+    host = urlsplit(mirrors[mirror]).hostname
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    hedge_name = name + '.hedge'
+    hedge_file = '%s_%d.%s' % (hedge_name, part, ext)
+    tasks = {primary}
+    try:
+        while True:
+            await asyncio.wait(tasks, timeout=_hedge_check_interval)
+            if primary.done():
+                return primary.result()
+            elapsed = loop.time() - start_time
+            if part in estimator.parts:
+                delay = estimator.hedge_delay()
+            else:
+                # no response yet
+                delay = estimator.hedge_delay(host)
+            if delay and elapsed > delay and estimator.try_hedge():
+                break
+
+        hedge_mirror = mirrors[(mirror + 1) % len(mirrors)]
+        logger.debug('part %d: hedge after %.1fs, to %s', part, elapsed,
+                     urlsplit(hedge_mirror).hostname)
+        hedge_journal = _HedgeJournal()
+        hedge_downloaded = []
+        hedge = asyncio.ensure_future(
+                _save_part(pool, hedge_mirror, hedge_name, ext, {}, part,
+                           hedge_hook, hedge_journal, job, url, checksums))
+        tasks.add(hedge)
+        winner = None
+        while tasks and winner is None:
+            done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.exception() and task.result():
+                    winner = task
+        if winner is hedge:
+            reporting = False
+        for task in tasks:
+            await _cancel(task)
+        if winner is hedge:
+            logger.debug('part %d: hedge won', part)
+            size = os.path.getsize(hedge_file)
+            os.replace(hedge_file, '%s_%d.%s' % (name, part, ext))
+            if journal is not None and hedge_journal.record:
+                args, kwargs = hedge_journal.record
+                journal.update(*args, **kwargs)
+            status[part] = 1
+            reporthook(['part end', status, sum(hedge_downloaded)],
+                       size, size, part)
+            return True
+        if winner is None:
+            return primary.result()  # raise its error
+        return True
+    finally:
+        for task in tasks:
+            task.cancel()
+        try:
+            os.remove(hedge_file)
+        except OSError:
+            pass
+
+async def _refresh(refresher, part, url):
+    # the extractor blocks, the other parts keep going
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, refresher.refresh, part, url)
+
+async def _save_part_retry(pool, url, *args, tries=3, mirrors=None,
+                           checksums=None, store=None, refresher=None):
+    '''There are two retries for every failed downloading, and one more
+    for every mirror. The retries rotate the mirrors, the downloaded data
+    is kept. The urls are refreshed by `refresher` before they expire, or
+    they get 403/410, see ykdl.util.expiry.
+    '''
+    part = args[3]
+    if refresher is not None:
+        if refresher.expiring(part):
+            await _refresh(refresher, part, refresher.get(part)[0])
+        url, mirrors = refresher.get(part)
+    mirrors = [url] + [m for m in mirrors or () if m != url]
+    tries += len(mirrors) - 1
+    mirror = 0
+    while tries:
+        tries -= 1
+        try:
+            if await _save_part_hedged(pool, mirrors, mirror, *args,
+                                       url=url, checksums=checksums,
+                                       store=store):
+                break
+        except (IOError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.debug('part %d failed at mirror %d: %r', part, mirror, e)
+            if refresher is not None and is_expired_error(e) and \
+                    await _refresh(refresher, part, url):
+                # does not count as a retry
+                url, _mirrors = refresher.get(part)
+                mirrors = [url] + [m for m in _mirrors or () if m != url]
+                mirror = 0
+                tries += 1
+                continue
+            if len(mirrors) > 1:
+                mirror = (mirror + 1) % len(mirrors)
+            elif not tries or getattr(e, 'code', 0) >= 400:
+                return
+        except Exception as e:
+            logger.debug('part %d failed: %r', args[3], e, exc_info=True)
+            return
+
+async def _save_parts(urls, name, ext, status, jobs, reporthook, journal,
+                      job, mirrors, checksums, store, refresher):
+    timeout_q = min(socket.getdefaulttimeout() or 30, 30)
+    timeout_r = max(socket.getdefaulttimeout() or 0, 60)
+    pool = ConnectionPool(timeout_q, timeout_r)
+    queue = asyncio.Queue()
+    for no, url in enumerate(urls):
+        if status[no] == 0:
+            queue.put_nowait((no, url))
+
+    active = 0
+
+    async def worker():
+        nonlocal active
+        while not queue.empty():
+            # the concurrency is raised while it raises throughput
+            if job is not None and active >= job.estimator.concurrency(jobs):
+                await asyncio.sleep(_acquire_interval)
+                continue
+            no, url = queue.get_nowait()
+            active += 1
+            try:
+                await _save_part_retry(pool, url, name, ext, status, no,
+                                       reporthook, journal, job,
+                                       mirrors=mirrors and mirrors[no],
+                                       checksums=checksums and checksums[no],
+                                       store=store, refresher=refresher)
+            finally:
+                active -= 1
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(min(jobs, queue.qsize()))])
+    finally:
+        pool.close()
+
+def save_parts(urls, name, ext, status, jobs=8, reporthook=None, journal=None,
+               job=None, mirrors=None, checksums=None, store=None,
+               refresher=None):
+    '''Download all unfinished parts in an event loop, the results will be
+    set into `status`, the transfers are scheduled as `job`, the failed
+    parts fail over to `mirrors`. The parts are stored into `store`, the
+    default is the part files, see ykdl.util.container. The urls and
+    mirrors of `refresher` are used instead if it is given.
+    '''
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(_save_parts(urls, name, ext, status, jobs,
+                                        reporthook, journal, job, mirrors,
+                                        checksums, store, refresher))
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+        raise
+    finally:
+        loop.close()
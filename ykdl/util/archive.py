@@ -0,0 +1,58 @@
+'''The archive of downloaded videos, keyed by (site, vid).
+
+The key is given by the extractor of the video (see
+VideoExtractor.archive_key), so a video is the same whatever the route, a
+single URL or a playlist, the URL is only used if there is no vid. The
+items of a playlist are checked before they are extracted if their vids
+are known, so the downloaded items are skipped without any requests, the
+others are checked after extracted. The archive is a SQLite database, it
+can be shared by the concurrent processes (WAL, and waits the lock of the
+other writers).
+'''
+
+import time
+import sqlite3
+import threading
+from logging import getLogger
+
+
+__all__ = ['DownloadArchive']
+
+logger = getLogger(__name__)
+
+_timeout = 30  # seconds to wait the other writers
+
+
+class DownloadArchive:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=_timeout,
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError as e:
+            logger.debug('can not use WAL for %r: %s', path, e)
+        self.db.execute('CREATE TABLE IF NOT EXISTS archive ('
+                        'site TEXT NOT NULL, vid TEXT NOT NULL, '
+                        'time REAL NOT NULL, PRIMARY KEY (site, vid)) '
+                        'WITHOUT ROWID')
+
+    def __contains__(self, key):
+        site, vid = key
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM archive WHERE site=? AND '
+                                  'vid=?', (site, str(vid))).fetchone()
+        return row is not None
+
+    def add(self, site, vid):
+        '''Record a downloaded video.'''
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO archive VALUES (?, ?, ?)',
+                            (site, str(vid), time.time()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
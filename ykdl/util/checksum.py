@@ -0,0 +1,127 @@
+'''Incremental checksums of downloads.
+
+The hashes are updated with the blocks which are written, the data is not
+read again, except resuming a part from its partial file. The expected
+values come from:
+
+  - the extractor, a dict {algorithm: hex digest} per part;
+  - Content-MD5 of a complete response;
+  - x-goog-hash (crc32c and md5);
+  - a strong ETag which looks like an MD5 or SHA-1 hex digest, it is not
+    reliable, a mismatch is only warned.
+
+Algorithms are 'crc32', 'crc32c', 'md5' and 'sha1', CRC32C uses the
+package crc32c if it has been installed, otherwise a slow fallback.
+'''
+
+import zlib
+import base64
+import hashlib
+import binascii
+from logging import getLogger
+
+
+__all__ = ['Hasher', 'expected_checksums', 'etag_checksums', 'algorithms',
+           'default_algorithms']
+
+logger = getLogger(__name__)
+
+algorithms = 'crc32', 'crc32c', 'md5', 'sha1'
+
+# the algorithms which are always computed, and recorded in the journal
+default_algorithms = set()
+
+try:
+    from crc32c import crc32c as _crc32c
+except ImportError:
+    _crc32c_table = []
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = c >> 1 ^ 0x82f63b78 if c & 1 else c >> 1
+        _crc32c_table.append(c)
+
+    def _crc32c(data, crc=0):
+        crc ^= 0xffffffff
+        table = _crc32c_table
+        for b in bytes(data):
+            crc = table[(crc ^ b) & 0xff] ^ crc >> 8
+        return crc ^ 0xffffffff
+
+
+class _CRC:
+    def __init__(self, func, value=0):
+        self.func = func
+        self.value = value
+
+    def update(self, data):
+        self.value = self.func(data, self.value)
+
+    def hexdigest(self):
+        return '%08x' % self.value
+
+
+class Hasher:
+    '''Compute the checksums of some algorithms at the same time.'''
+
+    def __init__(self, names=default_algorithms):
+        self.hashes = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        if name in self.hashes:
+            return
+        if name == 'crc32':
+            self.hashes[name] = _CRC(zlib.crc32)
+        elif name == 'crc32c':
+            self.hashes[name] = _CRC(_crc32c)
+        else:
+            self.hashes[name] = hashlib.new(name)
+
+    def __bool__(self):
+        return bool(self.hashes)
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def hexdigests(self):
+        return {name: h.hexdigest() for name, h in self.hashes.items()}
+
+    def verify(self, expected):
+        '''Returns a list of the mismatched algorithms.'''
+        return [name for name, h in self.hashes.items()
+                if name in expected and h.hexdigest() != expected[name]]
+
+
+def _b64hex(value):
+    try:
+        return binascii.hexlify(base64.b64decode(value)).decode()
+    except (binascii.Error, ValueError):
+        logger.debug('bad base64 checksum: %r', value)
+
+def etag_checksums(headers):
+    '''Return the checksum {algorithm: hex digest} which looks like the
+    strong ETag, or an empty dict.
+    '''
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        etag = etag.strip('"').lower()
+        if len(etag) in (32, 40) and \
+                all(c in '0123456789abcdef' for c in etag):
+            return {len(etag) == 32 and 'md5' or 'sha1': etag}
+    return {}
+
+def expected_checksums(headers, complete=True):
+    '''Return the expected checksums {algorithm: hex digest} of the entity
+    from the response headers, `complete` is False with a 206 response.
+    '''
+    expected = {}
+    for kv in (headers.get('x-goog-hash') or '').split(','):
+        name, _, value = kv.strip().partition('=')
+        if name in ('crc32c', 'md5') and value:
+            expected[name] = _b64hex(value)
+    if complete and headers.get('Content-MD5'):
+        expected['md5'] = _b64hex(headers['Content-MD5'])
+    return {k: v for k, v in expected.items() if v}
@@ -0,0 +1,569 @@
+'''Download the parts of a stream by worker processes, local or remote.
+
+The coordinator owns the parts, the journal and the output files, workers
+lease ranges of parts from it over authenticated connections (see
+multiprocessing.connection) and download them.
+
+  - the local workers (the processes started by the coordinator) write the
+    parts into the part files directly, they only report the progress and
+    the checksums, so the data does not pass through the coordinator;
+  - the remote workers, and all workers if the parts are assembled in the
+    container (see ykdl.util.container), stream the data back, which is
+    written by the coordinator, the output is assembled in one place. Then
+    the coordinator process bounds the throughput, the workers still take
+    the transfers and the TLS off it.
+
+  - a lease is renewed by every message of its worker, it is lost if the
+    worker has been silent for `lease_time`, or it is disconnected, then
+    the parts return to the pending list and are leased again from start;
+  - a worker runs `jobs` threads, every thread leases its own range;
+  - the coordinator sends the HTTP headers of the extractor to workers.
+
+Messages, worker => coordinator:
+
+    ('hello', id, jobs, local) => ('hello', config)
+    ('lease',)                 => ('lease', [(part, url, mirrors, checksums), ...])
+                                | ('wait', seconds) | ('done',)
+    ('open', part, size)
+    ('data', part, bytes)       # streamed
+    ('progress', part, length)  # written directly
+    ('close', part, ok, url, crc32, hashes)
+'''
+
+import os
+import time
+import socket
+import threading
+from logging import getLogger
+from multiprocessing import get_context, AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from . import http
+from .human import human_size, human_time
+from .journal import Journal
+from .scheduler import scheduler
+from .container import PartFiles, Container
+from .download import save_url, multi_hook
+
+
+__all__ = ['parse_address', 'coordinate', 'work']
+
+logger = getLogger(__name__)
+
+_lease_time = 60
+_batch = 4
+_reconnect_interval = 3
+_wait_interval = 1
+
+
+def parse_address(address):
+    '''Return (host, port) of HOST:PORT, or :PORT.'''
+    host, _, port = address.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+def get_authkey(authkey=None):
+    authkey = authkey or os.environ.get('YKDL_AUTHKEY')
+    return authkey and authkey.encode('utf-8')
+
+
+class _Worker:
+    '''A connected worker in the coordinator.'''
+
+    def __init__(self, conn, id, direct=False):
+        self.conn = conn
+        self.id = id
+        self.direct = direct  # writes the part files itself
+        self.leases = set()
+        self.files = {}  # part: [file, size, filesize, downloaded]
+        self.last_seen = time.monotonic()
+
+
+class _Coordinator:
+
+    def __init__(self, urls, name, ext, reporthook, mirrors, checksums,
+                 store, journal, job, batch, lease_time, tries):
+        self.urls = urls
+        self.name = name
+        self.ext = ext
+        self.reporthook = reporthook
+        self.mirrors = mirrors
+        self.checksums = checksums
+        self.store = store
+        self.journal = journal
+        self.job = job
+        self.batch = batch
+        self.lease_time = lease_time
+        self.tries = tries
+        self.count = len(urls)
+        self.status = [0] * self.count
+        self.failures = [0] * self.count
+        self.pending = []
+        self.leased = set()
+        self.workers = 0
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def skip_done(self):
+        for no, url in enumerate(self.urls):
+            state = self.journal.get(no, url)
+            if state and state['done'] and \
+                    self.store.getsize(no) == state['size']:
+                self.status[no] = 1
+        self.pending = [no for no in range(self.count) if not self.status[no]]
+
+    def lease(self, worker):
+        with self.lock:
+            if not self.pending:
+                if self.leased:
+                    return 'wait', _wait_interval
+                return 'done',
+            # a range of continuous parts
+            parts = [self.pending.pop(0)]
+            while self.pending and len(parts) < self.batch and \
+                    self.pending[0] == parts[-1] + 1:
+                parts.append(self.pending.pop(0))
+            self.leased.update(parts)
+            worker.leases.update(parts)
+        return 'lease', [(no, self.urls[no],
+                          self.mirrors and self.mirrors[no],
+                          self.checksums and self.checksums[no])
+                         for no in parts]
+
+    def release(self, worker, part, ok):
+        with self.lock:
+            worker.leases.discard(part)
+            self.leased.discard(part)
+            if ok:
+                self.status[part] = 1
+            else:
+                self.failures[part] += 1
+                if self.failures[part] < self.tries:
+                    self.pending.append(part)
+                    self.pending.sort()
+            if not self.pending and not self.leased:
+                self.finished.set()
+
+    def abort(self, worker, part):
+        try:
+            tfp = worker.files.pop(part)[0]
+        except KeyError:
+            return
+        if tfp is True:
+            return  # the worker's, it is rewritten from start
+        try:
+            tfp.__exit__(IOError, IOError('lease lost'), None)
+        except Exception as e:
+            logger.debug('error occurred during abort part %d: %r', part, e)
+
+    def handle(self, conn):
+        worker = None
+        try:
+            message = conn.recv()
+            if message[0] != 'hello':
+                return
+            direct = message[3:4] == (True,) and \
+                     isinstance(self.store, PartFiles)
+            worker = _Worker(conn, message[1], direct)
+            conn.send(('hello', {
+                'headers': dict(http.fake_headers),
+                'timeout': socket.getdefaulttimeout(),
+                'store': direct and (os.path.abspath(self.store.name),
+                                     self.store.ext, self.store.single)
+            }))
+            with self.lock:
+                self.workers += 1
+            logger.debug('worker %s has joined', worker.id)
+            while True:
+                if not conn.poll(1):
+                    if worker.leases and time.monotonic() - \
+                            worker.last_seen > self.lease_time:
+                        logger.warning('worker %s lost its leases: %s',
+                                       worker.id, sorted(worker.leases))
+                        return
+                    continue
+                message = conn.recv()
+                worker.last_seen = time.monotonic()
+                self.dispatch(worker, *message)
+        except (EOFError, OSError) as e:
+            logger.debug('worker %s has left: %r', worker and worker.id, e)
+        finally:
+            conn.close()
+            if worker:
+                for part in list(worker.files):
+                    self.abort(worker, part)
+                for part in list(worker.leases):
+                    self.reporthook(['part end', self.status, 0], 0, -1,
+                                    part)
+                    # it is not a failure of the part
+                    self.failures[part] -= 1
+                    self.release(worker, part, False)
+                with self.lock:
+                    self.workers -= 1
+
+    def dispatch(self, worker, action, *args):
+        if action == 'lease':
+            worker.conn.send(self.lease(worker))
+            return
+        part = args[0]
+        if part not in worker.leases:
+            return
+        if action == 'open':
+            self.abort(worker, part)
+            size = args[1]
+            self.journal_of().discard(part)
+            if worker.direct:
+                tfp = True  # opened by the worker
+            else:
+                try:
+                    tfp = self.store.open(part, 'wb', 0, size)
+                except IOError as e:
+                    # the data is dropped, the part fails
+                    logger.warning('part %d: %s', part, e)
+                    tfp = None
+            worker.files[part] = [tfp, size, 0, 0]
+            self.reporthook(['part'], part=part)
+        elif action in ('data', 'progress'):
+            state = worker.files.get(part)
+            if not state or state[0] is None:
+                return
+            if action == 'data':
+                data = args[1]
+                state[0].write(data)
+                n = len(data)
+            else:
+                n = args[1]
+            state[2] += n
+            state[3] += n
+            self.job.estimator.update(part, n, worker.id)
+            self.reporthook(['part'], state[2], state[1], part)
+        elif action == 'close':
+            _, ok, url, crc, hashes = args
+            state = worker.files.pop(part, None)
+            filesize = downloaded = 0
+            size = -1
+            if state:
+                tfp, size, filesize, downloaded = state
+                if tfp is None:
+                    ok = False
+                elif tfp is True:
+                    # check what the worker has written
+                    ok = ok and self.store.getsize(part) == filesize
+                elif ok:
+                    tfp.__exit__(None, None, None)
+                else:
+                    tfp.__exit__(IOError, IOError('part failed'), None)
+            if ok:
+                self.journal_of().update(part, url, filesize, filesize, crc,
+                                         True, hashes=hashes)
+            self.release(worker, part, ok)
+            self.reporthook(['part end', self.status, downloaded], filesize,
+                            size, part)
+
+    def journal_of(self):
+        if isinstance(self.store, Container):
+            return self.store
+        return self.journal
+
+
+def coordinate(urls, name, ext, address=None, authkey=None, processes=0,
+               jobs=1, batch=_batch, lease_time=_lease_time, tries=3,
+               reporthook=multi_hook, mirrors=None, checksums=None,
+               assemble=False, weight=1):
+    '''Download the urls as the parts of one file by workers, like
+    ykdl.util.download.save_urls, returns whether all have been done.
+
+    `address`, listen at (host, port) for remote workers, which are started
+    by `work(address, authkey)`, the default is a local random port.
+    `processes`, the number of local worker processes.
+    `jobs`, the number of download threads of every local worker.
+    `batch`, the number of parts per lease.
+    '''
+    if not isinstance(authkey, bytes):
+        authkey = get_authkey(authkey) or os.urandom(16)
+    if address is None:
+        address = '127.0.0.1', 0
+    count = len(urls)
+    journal = Journal(name, ext)
+    if assemble and count > 1:
+        store = Container(name, ext, count, journal)
+    else:
+        store = PartFiles(name, ext, count == 1)
+    print('Start downloading: ' + name)
+    reporthook(['init'])
+    job = scheduler.register(name, weight)
+    coordinator = _Coordinator(urls, name, ext, reporthook, mirrors,
+                               checksums, store, journal, job, batch,
+                               lease_time, tries)
+    coordinator.skip_done()
+    reporthook(['start', False, coordinator.status, job.estimator])
+    listener = Listener(address, authkey=authkey)
+    address = listener.address
+    procs = []
+    succeed = False
+    closing = []
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                if closing:
+                    return
+                # authentication failed
+                logger.warning('reject a worker: %r', e)
+                continue
+            if closing:
+                conn.close()
+                return
+            threading.Thread(target=coordinator.handle, args=(conn,),
+                             daemon=True, name='Coordinator').start()
+
+    def close_listener():
+        # wake up the blocking accept, then close
+        closing.append(True)
+        host = address[0] not in ('0.0.0.0', '') and address[0] or \
+               '127.0.0.1'
+        try:
+            socket.create_connection((host, address[1]), 1).close()
+        except OSError:
+            pass
+        accepter.join(1)
+        listener.close()
+
+    accepter = threading.Thread(target=accept, daemon=True,
+                                name='CoordinatorListener')
+
+    try:
+        if coordinator.pending:
+            accepter.start()
+            context = get_context('spawn')
+            for i in range(processes):
+                proc = context.Process(target=work, daemon=True,
+                                       args=(address, authkey, jobs),
+                                       kwargs={'local': True})
+                proc.start()
+                procs.append(proc)
+            if not processes:
+                print('Waiting for workers at %s:%d' % address)
+            while not coordinator.finished.wait(1):
+                if processes and not coordinator.workers and \
+                        not any(proc.is_alive() for proc in procs):
+                    logger.error('all worker processes have exited')
+                    break
+        succeed = 0 not in coordinator.status
+    finally:
+        if accepter.is_alive():
+            close_listener()
+        else:
+            listener.close()
+        for proc in procs:
+            proc.join(_reconnect_interval)
+            if proc.is_alive():
+                proc.terminate()
+        if isinstance(store, Container):
+            store.close(succeed)
+        journal.save()
+        job.close()
+        downloaded, size, total, cost = reporthook(['end'])
+        print('\nTotal downloaded %s of %s, cost %s'
+              % (human_size(size), human_size(total), human_time(cost)))
+    if not succeed:
+        logger.error('download failed at parts: ' +
+                     ', '.join([str(no) for no, s in
+                                enumerate(coordinator.status) if s == 0]))
+    elif count == 1:
+        journal.remove()
+    return succeed
+
+
+class _RemoteFile:
+    '''Stream the written data into the coordinator.'''
+
+    def __init__(self, client, part, size):
+        self.client = client
+        self.part = part
+        client.send(('open', part, size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def seek(self, offset):
+        pass
+
+    def write(self, data, callback=None, buffer=None):
+        self.client.send(('data', self.part, bytes(data)))
+        if buffer is not None:
+            self.client.writer.recycle(buffer)
+        return len(data)
+
+    def truncate(self, size):
+        pass
+
+
+class _LocalFile:
+    '''Write the part file directly, report the progress into the
+    coordinator.
+    '''
+
+    def __init__(self, client, part, size, tfp):
+        self.client = client
+        self.part = part
+        self.tfp = tfp
+        client.send(('open', part, size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tfp.__exit__(*exc_info)
+
+    def seek(self, offset):
+        self.tfp.seek(offset)
+
+    def write(self, data, callback=None, buffer=None):
+        n = self.tfp.write(data, callback, buffer)
+        self.client.send(('progress', self.part, n))
+        return n
+
+    def truncate(self, size):
+        self.tfp.truncate(size)
+
+
+class _Client:
+    '''The connection of a worker, the store and the journal of the parts
+    which are downloaded by it.
+    '''
+
+    def __init__(self, conn):
+        from .writer import writer
+        self.conn = conn
+        self.writer = writer
+        self.parts = None  # the part files, if they are written directly
+        self.send_lock = threading.Lock()
+        self.lease_lock = threading.Lock()
+        self.records = {}  # part: (crc32, hashes) of the done
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def lease(self):
+        with self.lease_lock:
+            self.send(('lease',))
+            return self.conn.recv()
+
+    # the store, the parts are always downloaded from start
+
+    def getsize(self, part):
+        return None
+
+    def open(self, part, mode, offset, size):
+        if self.parts:
+            return _LocalFile(self, part, size,
+                              self.parts.open(part, mode, offset, size))
+        return _RemoteFile(self, part, size)
+
+    def remove(self, part):
+        pass
+
+    # the journal
+
+    def get(self, part, url):
+        return None
+
+    def update(self, part, url, size, offset, crc32=None, done=False,
+               **kwargs):
+        if done:
+            self.records[part] = crc32, kwargs.get('hashes')
+
+    def discard(self, part):
+        self.records.pop(part, None)
+
+
+def _null_hook(action, *args, **kwargs):
+    if action[0] == 'end':
+        return 0, 0, 0, 0
+
+def _work_once(conn, id, jobs, local):
+    client = _Client(conn)
+    client.send(('hello', id, jobs, local))
+    _, config = conn.recv()
+    if config.get('store'):
+        client.parts = PartFiles(*config['store'])
+    http.fake_headers.clear()
+    http.fake_headers.update(config['headers'])
+    if config['timeout']:
+        socket.setdefaulttimeout(config['timeout'])
+    job = scheduler.register(id)
+    errors = []
+
+    def run():
+        try:
+            while True:
+                reply = client.lease()
+                if reply[0] == 'done':
+                    return
+                if reply[0] == 'wait':
+                    time.sleep(reply[1])
+                    continue
+                for part, url, mirrors, checksums in reply[1]:
+                    status = {part: 0}
+                    try:
+                        save_url(url, 'worker', 'part', status, part=part,
+                                 reporthook=_null_hook, journal=client,
+                                 job=job, mirrors=mirrors,
+                                 checksums=checksums, store=client)
+                    except (IOError, ValueError) as e:
+                        logger.debug('part %d failed: %r', part, e)
+                    crc, hashes = client.records.pop(part, (None, None))
+                    client.send(('close', part, status[part] == 1, url, crc,
+                                 hashes))
+        except (EOFError, OSError) as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, daemon=True,
+                                name='Worker-%d' % i)
+               for i in range(max(1, jobs))]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    finally:
+        job.close()
+    if errors:
+        raise errors[0]
+
+def work(address, authkey=None, jobs=4, forever=False, local=False):
+    '''Run a worker of the coordinator at address (host, port), returns
+    after the stream has been done, or runs `forever` for the next streams.
+
+    `local`, the worker shares the file system with the coordinator, it
+             writes the part files directly.
+    '''
+    authkey = authkey if isinstance(authkey, bytes) else get_authkey(authkey)
+    id = '%s-%d' % (socket.gethostname(), os.getpid())
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+        except AuthenticationError as e:
+            logger.error('coordinator %s:%d: %s', address[0], address[1], e)
+            return
+        except OSError as e:
+            if not forever:
+                logger.error('can not connect coordinator %s:%d: %s',
+                             address[0], address[1], e)
+                return
+            time.sleep(_reconnect_interval)
+            continue
+        try:
+            _work_once(conn, id, jobs, local)
+        except (EOFError, OSError) as e:
+            logger.warning('coordinator has been disconnected: %r', e)
+        finally:
+            conn.close()
+        if not forever:
+            return
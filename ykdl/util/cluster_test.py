@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import unittest
+
+from ykdl.util.cluster import _Coordinator, _Worker, parse_address
+
+
+def hook(action, *args, **kwargs):
+    pass
+
+
+class CoordinatorTests(unittest.TestCase):
+
+    def coordinator(self, count, batch=4, tries=3):
+        urls = ['http://x/%d.ts' % i for i in range(count)]
+        coordinator = _Coordinator(urls, 'x', 'ts', hook, None, None, None,
+                                   None, None, batch, 60, tries)
+        coordinator.pending = list(range(count))
+        return coordinator
+
+    def leased(self, reply):
+        self.assertEqual(reply[0], 'lease')
+        return [part for part, url, mirrors, checksums in reply[1]]
+
+    def test_lease(self):
+        coordinator = self.coordinator(10)
+        a, b = _Worker(None, 'a'), _Worker(None, 'b')
+        self.assertEqual(self.leased(coordinator.lease(a)), [0, 1, 2, 3])
+        self.assertEqual(self.leased(coordinator.lease(b)), [4, 5, 6, 7])
+        self.assertEqual(self.leased(coordinator.lease(a)), [8, 9])
+        # wait the leased parts
+        self.assertEqual(coordinator.lease(b)[0], 'wait')
+        for part in range(10):
+            coordinator.release(a if part in a.leases else b, part, True)
+        self.assertTrue(coordinator.finished.is_set())
+        self.assertEqual(coordinator.lease(b), ('done',))
+
+    def test_continuous(self):
+        coordinator = self.coordinator(6)
+        coordinator.pending = [0, 1, 3, 4, 5]
+        a = _Worker(None, 'a')
+        self.assertEqual(self.leased(coordinator.lease(a)), [0, 1])
+        self.assertEqual(self.leased(coordinator.lease(a)), [3, 4, 5])
+
+    def test_reassign(self):
+        # a failed part returns to the pending list, until the tries
+        coordinator = self.coordinator(2, tries=2)
+        a, b = _Worker(None, 'a'), _Worker(None, 'b')
+        self.assertEqual(self.leased(coordinator.lease(a)), [0, 1])
+        coordinator.release(a, 0, False)
+        coordinator.release(a, 1, True)
+        self.assertEqual(a.leases, set())
+        self.assertEqual(self.leased(coordinator.lease(b)), [0])
+        coordinator.release(b, 0, False)
+        self.assertEqual(coordinator.status, [0, 1])
+        self.assertTrue(coordinator.finished.is_set())
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('10.0.0.1:8000'), ('10.0.0.1', 8000))
+        self.assertEqual(parse_address(':8000'), ('0.0.0.0', 8000))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
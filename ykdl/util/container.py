@@ -0,0 +1,433 @@
+'''Stores of the downloading parts.
+
+PartFiles is the default, every part is a file `name_N.ext`, they are
+merged after downloaded.
+
+Container stores all parts in one sparse file `name.ext.container`, there
+are no files per part. The parts are placed in order, the region of a part
+starts at the end of the previous, so it is placed once the sizes of all
+previous parts are known (mostly from Content-Length). The index of regions
+is kept in the journal:
+
+  - a placed part is written into its region directly;
+  - a part which can not be placed yet is held in a memory stage, it is
+    flushed into its region after placed, the stages are bounded by
+    `stage_size`, the overflow is spilled into a file;
+  - the journal records of a staged part are deferred until its data has
+    been written into the container.
+
+The container is the concatenated parts after all of them have been done,
+the output is produced by truncate and rename, without copy. It only suits
+the formats which can be concatenated as bytes, e.g. MPEG-TS.
+'''
+
+import os
+import threading
+from logging import getLogger
+
+from .journal import Journal
+from .writer import WriterFile, writer, preallocate
+
+
+__all__ = ['PartFiles', 'Container']
+
+logger = getLogger(__name__)
+
+_stage_size = 1024 * 1024 * 32   # 32MB
+_chunk_size = 1024 * 1024        # 1MB
+
+
+class PartFiles:
+    '''Every part is a file, or the output if `single`.'''
+
+    def __init__(self, name, ext, single=False):
+        self.name = name
+        self.ext = ext
+        self.single = single
+
+    def path(self, part):
+        if self.single:
+            return '%s.%s' % (self.name, self.ext)
+        return '%s_%d.%s' % (self.name, part, self.ext)
+
+    def getsize(self, part):
+        '''Return the size of existing part, or None.'''
+        path = self.path(part)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+
+    def open(self, part, mode, offset, size):
+        tfp = writer.open(self.path(part), mode)
+        tfp.seek(offset)
+        if size > offset:
+            preallocate(tfp, size)
+        return tfp
+
+    def read(self, part):
+        return open(self.path(part), 'rb')
+
+    def remove(self, part):
+        os.remove(self.path(part))
+
+
+class _RegionFile(WriterFile):
+    '''A region of the container, which is written by the writer thread.'''
+
+    def __init__(self, container, part, offset=0):
+        self.writer = writer
+        self.path = container.path
+        self.fp = None
+        self.fd = container.fd
+        self.base = container.bases[part]
+        self.offset = offset
+        self.pending = 0
+        self.error = None
+        self.last_sync = 0
+        self.closed = False
+
+    def truncate(self, size):
+        # the region is fixed
+        self.writer.wait(self)
+
+    def _release(self):
+        # the file is shared
+        pass
+
+
+class _RegionReader:
+
+    def __init__(self, container, part):
+        self.fd = container.fd
+        self.offset = container.bases[part]
+        self.end = self.offset + container.sizes[part]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def read(self, n):
+        data = os.pread(self.fd, min(n, self.end - self.offset), self.offset)
+        self.offset += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class _StageFile:
+    '''A part which has not been placed, it is held in memory, or spilled
+    into a file if the stages are full. It is written into the region
+    directly once it has been placed.
+    '''
+
+    def __init__(self, container, part, size):
+        self.container = container
+        self.part = part
+        self.size = size
+        self.data = bytearray()
+        self.spill = None
+        self.length = 0
+        self.region = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if self.region:
+            self.region.close()
+        else:
+            self.container._close_stage(self, exc_type is None and
+                    (self.size < 0 or self.length == self.size))
+
+    def seek(self, offset):
+        assert offset == self.length
+
+    def write(self, data, callback=None, buffer=None):
+        container = self.container
+        if self.region is None and container.bases[self.part] is not None:
+            # it has been placed
+            self.region = _RegionFile(container, self.part)
+            container._flush_stage(self, self.region)
+        if self.region:
+            return self.region.write(data, callback, buffer)
+        n = len(data)
+        if self.spill is None:
+            if container._reserve(n):
+                self.data += data
+            else:
+                self.spill = open(container.spill_path(self.part), 'w+b')
+                self.spill.write(self.data)
+                container._reserve(-len(self.data))
+                self.data = bytearray()
+        if self.spill:
+            self.spill.write(data)
+        self.length += n
+        if buffer is not None:
+            writer.recycle(buffer)
+        if callback:
+            callback()  # it is deferred by the container
+        return n
+
+    def truncate(self, size):
+        if self.region:
+            self.region.truncate(size)
+
+    def chunks(self):
+        '''Iterate the staged data, then discard it.'''
+        if self.spill is None:
+            data, self.data = self.data, bytearray()
+            self.container._reserve(-len(data))
+            yield data
+            return
+        self.spill.seek(0)
+        while True:
+            data = self.spill.read(_chunk_size)
+            if not data:
+                break
+            yield data
+        self.discard()
+
+    def persist(self):
+        '''Keep the data in the spill file.'''
+        if self.spill is None:
+            self.spill = open(self.container.spill_path(self.part), 'w+b')
+            self.spill.write(self.data)
+            self.container._reserve(-len(self.data))
+            self.data = bytearray()
+        self.spill.close()
+
+    def discard(self):
+        if self.spill:
+            self.spill.close()
+            os.remove(self.spill.name)
+            self.spill = None
+        else:
+            self.container._reserve(-len(self.data))
+            self.data = bytearray()
+
+
+class Container:
+    '''Store the parts in one sparse file, see the module.'''
+
+    exts = 'ts', 'mpg', 'mpeg'
+
+    def __init__(self, name, ext, count, journal, stage_size=_stage_size):
+        self.path = '%s.%s.container' % (name, ext)
+        self.output = '%s.%s' % (name, ext)
+        self.count = count
+        self.journal = journal
+        self.stage_size = stage_size
+        self.lock = threading.Lock()
+        self.sizes = [None] * count
+        self.bases = [None] * count
+        self.placed = 0
+        self.stages = {}    # part: closed stage which waits for placement
+        self.staging = set()  # parts which have data in the stages
+        self.records = {}   # part: deferred journal record, or None
+        self.staged = 0
+        if os.path.exists(self.path):
+            self.fp = open(self.path, 'r+b', buffering=0)
+        else:
+            self.fp = open(self.path, 'w+b', buffering=0)
+            journal.index.clear()
+        self.fd = self.fp.fileno()
+        # restore the continuous regions
+        for part in range(count):
+            region = journal.index.get(str(part))
+            if region is None or region[0] != self._next_base():
+                break
+            self.bases[part], self.sizes[part] = region
+            self.placed += 1
+        for part in list(journal.index):
+            if int(part) >= self.placed:
+                del journal.index[part]
+        # restore the stages which are kept by the last close
+        for part in range(self.placed, count):
+            state = journal.parts.get(str(part))
+            if not state or not state.get('stage'):
+                continue
+            path = self.spill_path(part)
+            if os.path.exists(path) and os.path.getsize(path) == state['size']:
+                stage = _StageFile(self, part, state['size'])
+                stage.spill = open(path, 'r+b')
+                stage.length = self.sizes[part] = state['size']
+                self.stages[part] = stage
+                self.staging.add(part)
+            else:
+                journal.discard(part)
+
+    def spill_path(self, part):
+        return '%s.%d.stage' % (self.path, part)
+
+    def _next_base(self):
+        if self.placed:
+            return self.bases[self.placed - 1] + self.sizes[self.placed - 1]
+        return 0
+
+    def _place(self):
+        # place the parts in order, with the lock, returns the closed
+        # stages which should be flushed
+        flush = []
+        while self.placed < self.count and \
+                self.sizes[self.placed] is not None:
+            part = self.placed
+            self.bases[part] = self._next_base()
+            self.journal.place(part, self.bases[part], self.sizes[part])
+            self.placed += 1
+            if part in self.stages:
+                flush.append(self.stages.pop(part))
+        return flush
+
+    def _reserve(self, n):
+        with self.lock:
+            if n > 0 and self.staged + n > self.stage_size:
+                return False
+            self.staged += n
+            return True
+
+    def _flush_stage(self, stage, region):
+        # write the staged data into its region, then apply the deferred
+        # journal record
+        part = stage.part
+        last = b''
+        for data in stage.chunks():
+            if last:
+                region.write(last)
+            last = data
+        region.write(last, lambda: self._flushed(part))
+
+    def _flushed(self, part):
+        with self.lock:
+            self.staging.discard(part)
+            if part not in self.records:
+                record = self._unstage(part)
+            else:
+                record = self.records.pop(part)
+        if record is False:
+            return
+        if record is None:
+            self.journal.discard(part)
+        else:
+            args, kwargs = record
+            self.journal.update(*args, **kwargs)
+
+    def _unstage(self, part):
+        # the record of a restored stage, without the flag
+        state = dict(self.journal.parts.get(str(part)) or {})
+        if not state.pop('stage', None):
+            return False
+        args = (part, state.pop('url'), state.pop('size'),
+                Journal.offset(state), state.pop('crc32'), state.pop('done'))
+        state.pop('ranges')
+        return args, state
+
+    def _close_stage(self, stage, complete):
+        part = stage.part
+        with self.lock:
+            if not complete:
+                self.staging.discard(part)
+                self.records.pop(part, None)
+                flush = []
+            elif self.bases[part] is not None:
+                # it has been placed after the last write
+                flush = [stage]
+            else:
+                self.sizes[part] = stage.length
+                self.stages[part] = stage
+                flush = self._place()
+        if not complete:
+            stage.discard()
+        for stage in flush:
+            region = _RegionFile(self, stage.part)
+            self._flush_stage(stage, region)
+            region.close()
+
+    # the store interface
+
+    def getsize(self, part):
+        '''Return the recorded size of the placed part, or None.'''
+        if part in self.stages:
+            return self.stages[part].length
+        if self.bases[part] is None:
+            return None
+        return Journal.offset(self.journal.parts.get(str(part)))
+
+    def open(self, part, mode, offset, size):
+        with self.lock:
+            if self.bases[part] is not None:
+                if 0 <= size != self.sizes[part]:
+                    raise IOError('part %d: size has been changed, %d != %d'
+                                  % (part, size, self.sizes[part]))
+                return _RegionFile(self, part, offset)
+            self.sizes[part] = size if size >= 0 else None
+            flush = self._place()
+            if self.bases[part] is None:
+                self.staging.add(part)
+                tfp = _StageFile(self, part, size)
+            else:
+                tfp = _RegionFile(self, part)
+        for stage in flush:
+            region = _RegionFile(self, stage.part)
+            self._flush_stage(stage, region)
+            region.close()
+        return tfp
+
+    def read(self, part):
+        if part in self.stages:
+            return open(self.spill_path(part), 'rb')
+        return _RegionReader(self, part)
+
+    def remove(self, part):
+        with self.lock:
+            stage = self.stages.pop(part, None)
+            if stage:
+                self.staging.discard(part)
+        if stage:
+            stage.discard()
+
+    # the journal interface, defer the records of the staged parts
+
+    def get(self, part, url):
+        return self.journal.get(part, url)
+
+    def update(self, part, *args, **kwargs):
+        with self.lock:
+            if part in self.staging:
+                self.records[part] = (part,) + args, kwargs
+                return
+        self.journal.update(part, *args, **kwargs)
+
+    def discard(self, part):
+        with self.lock:
+            if part in self.staging:
+                self.records[part] = None
+                return
+        self.journal.discard(part)
+
+    def close(self, done=False):
+        '''Close the container, produce the output if all parts are done.'''
+        with self.lock:
+            stages = list(self.stages.values())
+            self.stages.clear()
+            records = [self.records.pop(stage.part, None) for stage in stages]
+        for stage, record in zip(stages, records):
+            if done or not record or not record[0][5:6] or not record[0][5]:
+                stage.discard()
+                continue
+            # keep the done stage, it is restored next time
+            stage.persist()
+            args, kwargs = record
+            kwargs['stage'] = True
+            self.journal.update(*args, **kwargs)
+        if done and self.placed == self.count:
+            self.fp.truncate(self._next_base())
+            self.fp.close()
+            os.replace(self.path, self.output)
+            self.journal.remove()
+        else:
+            self.fp.close()
+            self.journal.save()
@@ -4,7 +4,7 @@
 
     0. download init         (['init'])
 
-      1. download start      (['start', single, status])
+      1. download start      (['start', single, status, estimator])
 
         2. part start        (['part'], part=part)
 
@@ -16,36 +16,42 @@
 '''
 
 import os
-import sys
 import time
+import zlib
+import queue
 import socket
 import threading
 from logging import getLogger
-from shutil import get_terminal_size
+from functools import partial
 from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from urllib.request import Request, urlopen
 from http.client import IncompleteRead
 
 from .http import hit_conn_cache, clear_conn_cache, fake_headers
 from .human import *
-from .log import IS_ANSI_TERMINAL
+from .progress import Progress, get_renderer
+from .journal import Journal
+from .scheduler import scheduler
+from .checksum import Hasher, expected_checksums, etag_checksums
+from .writer import writer
+from .container import PartFiles, Container
+from .expiry import Refresher, is_expired_error
 
 
 logger = getLogger(__name__)
 
-print_lock = threading.Lock()
-_max_columns = get_terminal_size().columns - 1
-_clear_enter = '\r' + ' ' * _max_columns + '\r'
-_progress_bar_len = _max_columns - 30
-if IS_ANSI_TERMINAL:
-    _progress_bar_fg = ' '
-    _progress_bar_bg = ' '
-    _progress_bar_fmt = ' \33[47m%s\33[100m%s\33[0m'
-else:
-    _progress_bar_fg = '#'
-    _progress_bar_bg = '|'
-    _progress_bar_fmt = ' %s%s'
-
+_buffers = threading.local()
+_block_size_min = 1024 * 64    # 64KB
+_block_size_max = 1024 * 1024  # 1MB
+# switch to next mirror if slower than 64KB/s, or 1/4 of the peak speed
+_mirror_min_speed = 1024 * 64
+_mirror_slow_ratio = 0.25
+_mirror_check_interval = 3
+_mirror_min_left = 1024 * 1024  # do not switch at the end of part
+
+progress = Progress()
+renderer = get_renderer()
 def set_rcvbuf(response):
     try:
         response.fp.raw._sock.setsockopt(
@@ -53,230 +59,466 @@ def set_rcvbuf(response):
     except Exception as e:
         logger.debug('error occurred during set_rcvbuf: %s', e)
 
-def get_progress_bar(percent):
-    bar_fg = _progress_bar_fg * int(_progress_bar_len * percent / 100)
-    bar_bg = _progress_bar_bg * (_progress_bar_len - len(bar_fg))
-    return _progress_bar_fmt % (bar_fg, bar_bg)
-
 def multi_hook(action, size=None, total=None, part=None):
-    global _processing, _processes, _processes_single, _progress, _progress_bar
-    global _processes_start, _processes_last_refresh, _processes_downloaded
-
-    def print_processes(force_refresh=True):
-        global _processes_last_refresh
-        with print_lock:
-            if not force_refresh and ct - _processes_last_refresh < 0.1:
-                return
-            _processes_last_refresh = ct
-            sys.stdout.write(_clear_enter)
-            if _processes_single:
-                if '%' in _progress:
-                    Processes = _progress_bar + get_processes_suffix()
-                else:
-                    Processes = get_processes_suffix()
-            else:
-                Processes = get_processes_prefix()
-                Processes += ' '.join(['P%d-%s' % p for p in _processes.items()])
-                if len(Processes) > _max_columns:
-                    Processes = Processes[:_max_columns - 3] + '...'
-            sys.stdout.write(Processes)
-            sys.stdout.write('\r')
-            sys.stdout.flush()
-
-    def processes_deamon():
-        nonlocal ct
-        while _processing:
-            print_processes(False)
-            time.sleep(0.8)
-            ct = time.monotonic()
-
-    def update_processes_suffix():
-        global _processes_suffix
-        status = action_args[0]
-        _processes_suffix = '  %%s [%d/%d] [%%s]' % (sum(status), len(status))
-
-    def get_processes_suffix():
-        return _processes_suffix % (_progress, human_time(ct - _processes_start))
-
-    def update_processes_prefix():
-        global _processes_prefix
-        status = action_args[0]
-        _processes_prefix = 'Processes[%d/%d][%%s]: ' % (sum(status), len(status))
-
-    def get_processes_prefix():
-        return _processes_prefix % human_time(ct - _processes_start)
-
-    ct = time.monotonic()
     action, *action_args = action
-    force_refresh = True
 
     if action == 'part':
-        if _processes_single:
-            last_progress = _progress
-            if size is None:
-                _progress = 'N/A'
-                _progress_bar = get_progress_bar(0)
-            elif total > 0:
-                percent = min(int(size * 100 / total), 100)
-                _progress = '%d%%' % percent
-                _progress_bar = get_progress_bar(percent)
-            else:
-                _progress = human_size(size)
-            force_refresh = _progress != last_progress
-        else:
-            if size is None:
-                _processes[part] = 'N/A'
-            elif total > 0:
-                percent = min(int(size * 100 / total), 100)
-                _processes[part] = '%d%%' % percent
-                force_refresh = percent == 100
-            else:
-                _processes[part] = human_size(size)
-                force_refresh = False
+        progress.update(part, size, total)
+        if size is None:
+            renderer.event(action, part)
 
     elif action == 'part end':
-        if _processes_single:
-            update_processes_suffix()
-        else:
-            update_processes_prefix()
-            _processes.pop(part, None)
-        downloaded = action_args[1]
-        try:
-            d, s, t = _processes_downloaded[part]
-            downloaded += d
-            if total < 0:
-                total = t
-        except KeyError:
-            pass
-        _processes_downloaded[part] = downloaded, size, total
+        progress.finish(part, action_args[1], size, total)
+        renderer.event(action, part, size, total, *action_args)
 
     elif action == 'print':
         args, kwargs = action_args
-        with print_lock:
-            sys.stdout.write(_clear_enter)
-            print(*args, **kwargs)
+        renderer.print(*args, **kwargs)
 
     elif action == 'init':
-        _processes_downloaded = {}
-        return
+        progress.init()
 
     elif action == 'start':
-        _processes_single, *action_args = action_args
-        if _processes_single:
-            _progress = 'N/A'
-            update_processes_suffix()
-        else:
-            _processes = {}
-            update_processes_prefix()
-        _processes_start = ct
-        _processes_last_refresh = 0
-        _processing = True
-        threading._start_new_thread(processes_deamon, ())
+        progress.start(*action_args)
+        renderer.start(progress)
 
     elif action == 'end':
-        _processing = False
-        downloaded, size, total = map(sum, zip(*_processes_downloaded.values()))
-        _processes_downloaded.update({k: (0, v[1], v[2])
-                                     for k, v in _processes_downloaded.items()})
-        cost = ct - _processes_start
-        return downloaded, size, total, cost
-
-    print_processes(force_refresh)
-
-def _save_url(url, name, ext, status, part=None, reporthook=multi_hook):
+        renderer.stop()
+        return progress.end()
+
+def quiet_hook():
+    '''Return a reporthook which counts the progress of a download without
+    rendering, for the downloads which run beside the rendered one.
+    '''
+    progress = Progress()
+
+    def reporthook(action, size=None, total=None, part=None):
+        action, *action_args = action
+        if action == 'part':
+            progress.update(part, size, total)
+        elif action == 'part end':
+            progress.finish(part, action_args[1], size, total)
+        elif action == 'print':
+            args, kwargs = action_args
+            renderer.print(*args, **kwargs)
+        elif action == 'init':
+            progress.init()
+        elif action == 'start':
+            progress.start(*action_args)
+        elif action == 'end':
+            return progress.end()
+
+    return reporthook
+
+def _get_buffer():
+    '''Return a reusable receive buffer of current thread.'''
+    try:
+        return _buffers.buffer
+    except AttributeError:
+        buffer = _buffers.buffer = memoryview(bytearray(_block_size_max))
+        return buffer
+
+def _adapt_block_size(bs, n, cost):
+    '''Adapt the block size to throughput, one block per 0.05~0.2s.'''
+    if n == bs and cost < 0.05 and bs < _block_size_max:
+        return bs << 1
+    if cost > 0.2 and bs > _block_size_min:
+        return bs >> 1
+    return bs
+
+def _race(open_url, urls, delay=0, allow=None):
+    '''Request the urls one by one every `delay` seconds until one has
+    responded, returns (index, response) of the first responded, the others
+    are closed in background. The request which is not the first is sent
+    only if `allow()` returns True.
+    '''
+    results = queue.Queue()
+
+    def fetch(i, url):
+        try:
+            results.put((i, open_url(url), None))
+        except Exception as e:
+            results.put((i, None, e))
+
+    def close_rest(n):
+        for _ in range(n):
+            _, response, _ = results.get()
+            if response:
+                response.close()
+
+    started = pending = 0
+    while True:
+        if started < len(urls):
+            if started and allow is not None and not allow():
+                started = len(urls)  # wait the started
+                if not pending:
+                    raise error
+            else:
+                threading.Thread(target=fetch, args=(started, urls[started]),
+                                 daemon=True).start()
+                started += 1
+                pending += 1
+                if not delay and started < len(urls):
+                    continue
+        try:
+            i, response, error = results.get(
+                    timeout=delay if started < len(urls) else None)
+        except queue.Empty:
+            continue
+        pending -= 1
+        if response:
+            threading.Thread(target=close_rest, args=(pending,),
+                             daemon=True).start()
+            return i, response
+        if not pending and started == len(urls):
+            raise error
+
+def _save_url(url, name, ext, status, part=None, reporthook=multi_hook,
+              journal=None, job=None, mirrors=None, checksums=None,
+              store=None):
 
     def print(*args, **kwargs):
         reporthook(['print', args, kwargs])
 
-    def get_response(req):
-        response = urlopen(req, timeout=timeout_q)
+    def open_url(url, start=None):
+        req = Request(url, headers=fake_headers)
+        req.remove_header('Accept-encoding')
+        if start is not None:
+            req.add_header('Range', 'bytes=%d-' % start)
+        t = time.monotonic()
+        try:
+            response = urlopen(req, timeout=timeout_q)
+        except IOError as e:
+            if job is not None:
+                job.estimator.error(urlsplit(url).hostname, e)
+            raise
+        if job is not None:
+            job.estimator.latency(urlsplit(url).hostname,
+                                  time.monotonic() - t)
         try:
             response.fp.raw._sock.settimeout(timeout_r)
         except Exception as e:
             logger.debug('error occurred during settimeout: %s', e)
+        set_rcvbuf(response)
         return response
 
+    def use_mirror(i):
+        nonlocal mirror, host
+        if job is not None and hosts[i] != host:
+            job.release(host)
+            job.acquire(hosts[i])
+        mirror = i
+        host = hosts[i]
+
+    def open_mirrors(start=None):
+        # try the mirrors in order, the first two race when start a new part,
+        # or hedge the request with a duplicate if its time to response is
+        # past the observed p95
+        nonlocal mirror, host
+        first = mirror
+        if start is None and mirror == 0 and (len(mirrors) > 1 or
+                                              job is not None):
+            if len(mirrors) > 1:
+                urls, _hosts, delay = mirrors[:2], hosts[:2], 0
+            else:
+                urls, _hosts = mirrors * 2, hosts * 2
+                delay = job.estimator.hedge_delay(host)
+            raced = []
+
+            def allow():
+                if delay and not job.estimator.try_hedge():
+                    return False
+                if job is None or job.try_acquire(_hosts[1]):
+                    raced.append(True)
+                    return True
+                return False
+
+            if delay is not None:
+                try:
+                    i, response = _race(open_url, urls, delay, allow)
+                except Exception as e:
+                    logger.debug('part %d: mirrors race failed: %r', part, e)
+                    if raced and job is not None:
+                        job.release(_hosts[1])
+                    if len(mirrors) <= 2:
+                        raise
+                    first = 2
+                else:
+                    if raced and job is not None:
+                        job.release(_hosts[1 - i])
+                    if len(mirrors) > 1:
+                        mirror = i
+                        host = hosts[i]
+                        logger.debug('part %d: mirror %d won the race',
+                                     part, i)
+                    elif i:
+                        logger.debug('part %d: hedged request won', part)
+                    return mirror, response
+        error = None
+        for i in range(first, len(mirrors)):
+            use_mirror(i)
+            try:
+                return i, open_url(mirrors[i], start)
+            except IOError as e:
+                logger.debug('part %d: mirror %d failed: %r', part, i, e)
+                error = e
+        raise error
+
+    def switch(reason):
+        # continue the part from another mirror at current offset
+        nonlocal response, switches
+        if len(mirrors) < 2 or size < 0 or switches >= len(mirrors) * 2:
+            return False
+        switches += 1
+        current = mirror
+        for _ in range(len(mirrors) - 1):
+            use_mirror((mirror + 1) % len(mirrors))
+            try:
+                _response = open_url(mirrors[mirror], filesize)
+            except IOError as e:
+                logger.debug('part %d: mirror %d failed: %r', part, mirror, e)
+                continue
+            if _response.status == 206 and size == int(
+                    _response.headers['Content-Range'].split('/')[-1]):
+                response.close()
+                response = _response
+                logger.debug('part %d: %s, switch to mirror %d at %d',
+                             part, reason, mirror, filesize)
+                return True
+            _response.close()
+        use_mirror(current)
+        return False
+
+    def skip(n):
+        while n > 0:
+            m = response.readinto(buffer[:min(n, bs)])
+            if not m:
+                return False
+            n -= m
+        return True
+
+    def checksum(n):
+        # compute the checksums of existing data, it is the only case that
+        # reads the data again
+        crc = 0
+        with store.read(part) as fp:
+            while n > 0:
+                m = fp.readinto(buffer[:min(n, _block_size_max)])
+                if not m:
+                    break
+                crc = zlib.crc32(buffer[:m], crc)
+                hasher.update(buffer[:m])
+                n -= m
+        return crc
+
+    def expect(response):
+        # the checksums which are provided by extractor have high priority
+        etag.update(etag_checksums(response.headers))
+        expected.update(expected_checksums(response.headers,
+                                           response.status == 200))
+        expected.update(checksums or {})
+        for algorithm in list(expected) + list(etag):
+            hasher.add(algorithm)
+
+    def verify():
+        mismatched = hasher.verify(expected)
+        if mismatched:
+            logger.error('file part %d is corrupted, mismatched %s',
+                         part, ', '.join(mismatched))
+        elif hasher.verify(etag):
+            logger.warning('file part %d does not match the ETag', part)
+        return not mismatched
+
+    def record(done=False, **kwargs):
+        if journal is not None:
+            journal.update(part, url, size, filesize, crc, done, **kwargs)
+
+    def recorder():
+        # record current state after the block has been written
+        if journal is not None:
+            return partial(journal.update, part, url, size, filesize, crc)
+
+    if store is None:
+        store = PartFiles(name, ext, part is None)
     if part is None:
-        name = name + '.' + ext
         part = 0
-    else:
-        name = '%s_%d.%s' % (name, part, ext)
-    bs = 8192
+    bs = _block_size_min
+    buffer = _get_buffer()
     size = -1
     filesize = 0
     downloaded = 0
+    crc = 0
+    hasher = Hasher()
+    expected = {}
+    etag = {}
     open_mode = 'wb'
     response = None
+    state = journal and journal.get(part, url)
     timeout_q = min(socket.getdefaulttimeout() or 30, 30)
     timeout_r = max(socket.getdefaulttimeout() or 0, 60)
-    req = Request(url, headers=fake_headers)
-    req.remove_header('Accept-encoding')
+    mirrors = [url] + [m for m in mirrors or () if m != url]
+    hosts = [urlsplit(m).hostname for m in mirrors]
+    mirror = 0
+    switches = 0
+    host = hosts[0]
+    if job is not None:
+        job.acquire(host)
+    start_time = time.monotonic()
     try:
         reporthook(['part'], part=part)
-        if os.path.exists(name):
-            filesize = os.path.getsize(name)
-            if filesize:
-                req.add_header('Range', 'bytes=%d-' % (filesize-1))  # get +1, avoid 416
-                response = get_response(req)
-                set_rcvbuf(response)
+        existing = store.getsize(part)
+        if existing is not None:
+            filesize = existing
+            offset = Journal.offset(state)
+            if state and state['done'] and filesize == state['size']:
+                size = filesize
+                print('Skipped: file part %d has already been downloaded'
+                      % part)
+                status[part] = 1
+                return True
+            if 0 < offset <= filesize:
+                # resume from the recorded offset, verify it later
+                filesize = offset
+                start = offset
+            elif filesize:
+                start = filesize - 1  # get +1, avoid 416
+            else:
+                start = None
+            if start is not None:
+                _, response = open_mirrors(start)
                 if response.status == 206:
                     size = int(response.headers['Content-Range'].split('/')[-1])
-                    needless_size = 1
+                    needless_size = filesize - start
                 elif response.status == 200:
                     size = int(response.headers.get('Content-Length', -1))
                     needless_size = filesize
-                if filesize == size:
-                    print('Skipped: file part %d has already been downloaded'
-                          % part)
-                    status[part] = 1
-                    return True
-                if filesize < size:
-                    percent = int(filesize * 100 / size)
-                    open_mode = 'ab'
-                    print('Restored: file part %d is incomplete at %d%%'
-                          % (part, percent))
-                    reporthook(['part'], filesize, size, part)
-                    fd = response.fileno()
-                    while needless_size > 0:
-                        if needless_size > bs:
-                            block = response.read(bs)
-                        else:
-                            block = response.read(needless_size)
-                        if not block:
+                expect(response)
+                if state and size != state['size']:
+                    # the source has been changed, download again
+                    response.close()
+                    response = None
+                elif filesize == size:
+                    crc = checksum(filesize) if hasher else None
+                    if verify():
+                        print('Skipped: file part %d has already been '
+                              'downloaded' % part)
+                        status[part] = 1
+                        record(True, hashes=hasher.hexdigests())
+                        return True
+                    response.close()
+                    response = None
+                elif filesize < size:
+                    crc = checksum(filesize)
+                    if state and crc != state['crc32']:
+                        logger.warning('file part %d: partial data is '
+                                       'corrupted, download again', part)
+                        response.close()
+                        response = None
+                    else:
+                        percent = int(filesize * 100 / size)
+                        open_mode = 'r+b'
+                        print('Restored: file part %d is incomplete at %d%%'
+                              % (part, percent))
+                        reporthook(['part'], filesize, size, part)
+                        if not skip(needless_size):
                             return
-                        needless_size -= len(block)
+        if open_mode == 'wb':
+            filesize = 0
+            crc = 0
+            hasher = Hasher(hasher.hashes)
         if response is None:
-            response = get_response(req)
-            set_rcvbuf(response)
-            fd = response.fileno()
+            _, response = open_mirrors()
+            size = -1
+            expect(response)
         if size < 0:
             size = int(response.headers.get('Content-Length', -1))
-        with open(name, open_mode) as tfp:
-            while size < 0 or filesize < size:
-                block = response.read(bs)
-                if not block:
-                    break
-                n = tfp.write(block)
-                downloaded += n
-                filesize += n
-                reporthook(['part'], filesize, size, part)
-        if os.path.exists(name):
-            filesize = os.path.getsize(name)
-            if filesize and (size < 0 or filesize == size):
-                status[part] = 1
-                return True
+        with store.open(part, open_mode, filesize, size) as tfp:
+            try:
+                window_start = time.monotonic()
+                window_size = 0
+                peak_speed = 0
+                while size < 0 or filesize < size:
+                    if size > 0:
+                        bs = min(bs, size - filesize)
+                    t = time.monotonic()
+                    block = writer.get_buffer()
+                    try:
+                        n = response.readinto(block[:bs])
+                    except (IOError, IncompleteRead) as e:
+                        if switch(repr(e)):
+                            continue
+                        raise
+                    if not n:
+                        if 0 < size and switch('early EOF'):
+                            continue
+                        break
+                    crc = zlib.crc32(block[:n], crc)
+                    if hasher:
+                        hasher.update(block[:n])
+                    downloaded += n
+                    filesize += n
+                    # hand over to the writer, do not wait the disk
+                    tfp.write(block[:n], recorder(), block)
+                    reporthook(['part'], filesize, size, part)
+                    bs = _adapt_block_size(bs, n, time.monotonic() - t)
+                    if job is not None:
+                        delay = job.reserve(n, part, host)
+                        if delay > 0:
+                            time.sleep(delay)
+                            window_start += delay  # limited by scheduler
+                    window_size += n
+                    t = time.monotonic()
+                    if t - window_start > _mirror_check_interval:
+                        speed = window_size / (t - window_start)
+                        if speed < max(_mirror_min_speed,
+                                       peak_speed * _mirror_slow_ratio) \
+                                and size - filesize > _mirror_min_left:
+                            switch('too slow')
+                        peak_speed = max(peak_speed, speed)
+                        window_start = t
+                        window_size = 0
+            finally:
+                # drop the unused space, keep file size as progress
+                tfp.truncate(filesize)
+        if filesize and (size < 0 or filesize == size):
+            if not verify():
+                # download again
+                store.remove(part)
+                if journal is not None:
+                    journal.discard(part)
+                return
+            status[part] = 1
+            record(True, hashes=hasher.hexdigests())
+            return True
     finally:
-        time.sleep(1)
+        if job is not None:
+            job.release(host)
+            job.estimator.finish_part(part, downloaded and filesize == size
+                                            and time.monotonic() - start_time)
         reporthook(['part end', status, downloaded], filesize, size, part)
 
-def save_url(*args, tries=3, **kwargs):
-    '''There are two retries for every failed downloading'''
+def save_url(url, *args, tries=3, refresher=None, **kwargs):
+    '''There are two retries for every failed downloading.
+
+    `refresher`, optional, a ykdl.util.expiry.Refresher, the url is refreshed
+                 before it expires, or it gets 403/410, does not count as
+                 a retry.
+    '''
+    part = kwargs.get('part') or 0
     while tries:
         tries -= 1
+        if refresher is not None:
+            if refresher.expiring(part):
+                refresher.refresh(part, refresher.get(part)[0])
+            url, kwargs['mirrors'] = refresher.get(part)
         try:
-            if _save_url(*args, **kwargs):
+            if _save_url(url, *args, **kwargs):
                 break
         except IOError as e:
+            if refresher is not None and is_expired_error(e) and \
+                    refresher.refresh(part, url):
+                tries += 1
+                continue
             if not tries or getattr(e, 'code', 0) >= 400:
                 raise e
         except IncompleteRead:
@@ -286,26 +528,49 @@ def save_url(*args, tries=3, **kwargs):
             raise
 
 def save_urls(urls, name, ext, jobs=1, fail_confirm=True,
-              fail_retry_eta=3600, reporthook=multi_hook):
+              fail_retry_eta=3600, reporthook=multi_hook, engine='thread',
+              weight=1, mirrors=None, checksums=None, assemble=False,
+              executor=None, refresh=None, expires=None):
+    '''Download the urls as the parts of one file, the transfers are
+    scheduled by the global scheduler as a job with `weight`.
+
+    `fail_confirm`, whether ask to continue after failed, or the function
+                    which asks instead of input(), e.g. TaskGraph.input.
+    `mirrors`, optional, a list of alternate urls per part, in order.
+    `checksums`, optional, a list of expected checksums per part, e.g.
+                 {'md5': hex digest}, see ykdl.util.checksum.
+    `assemble`, store the parts in one container file instead of the part
+                files, the output is their concatenation, it is produced
+                when all parts are done, see ykdl.util.container.
+    `executor`, optional, a shared ThreadPoolExecutor which runs the parts,
+                so the concurrent downloads share its workers, `jobs` still
+                limits the parts of this download.
+    `refresh`, optional, a function returns the fresh (urls, mirrors,
+               expires) of the same stream, it is called when the urls
+               expire or get 403/410, see ykdl.util.expiry.
+    `expires`, optional, the expiry (unix time) of the urls, default is
+               parsed from the urls.
+    '''
 
     if not hit_conn_cache(urls[0]):
         clear_conn_cache()  # clear useless caches
 
-    def run(*args, **kwargs):
-        fn, *args = args
-        futures = []
-        for no, url in enumerate(urls):
-            if status[no] == 1:
-                continue
-            futures.append(
-                fn(*args, url, name, ext, status,
-                   part=no, reporthook=reporthook, **kwargs))
-            time.sleep(0.1)
-        futures.reverse()
-        return futures
+    def run(no, submit=None, **kwargs):
+        args = urls[no], name, ext, status
+        kwargs.update(part=no, reporthook=reporthook,
+                      journal=store or journal, job=job, store=store,
+                      mirrors=mirrors and mirrors[no],
+                      checksums=checksums and checksums[no],
+                      refresher=refresher)
+        if submit:
+            return submit(save_url, *args, **kwargs)
+        return save_url(*args, **kwargs)
 
     count = len(urls)
     status = [0] * count
+    journal = Journal(name, ext)
+    store = None
+    succeed = False
     cost = 0
     tries = 1
     multi = False
@@ -316,66 +581,104 @@ def save_urls(urls, name, ext, jobs=1, fail_confirm=True,
             tries = 3
     print('Start downloading: ' + name)
     reporthook(['init'])
-    while tries:
+    job = scheduler.register(name, weight)
+    refresher = refresh and Refresher(refresh, urls, mirrors, expires)
+    ask = fail_confirm if callable(fail_confirm) else input
+    try:
         if count > 1 and os.path.exists(name + '.' + ext):
             print('Skipped: files has already been downloaded')
             return True
-        tries -= 1
-        reporthook(['start', not multi, status])
-        if count == 1:
-            save_url(urls[0], name, ext, status, reporthook=reporthook)
-        elif jobs > 1:
-            if min(count - sum(status), jobs) > 12:
-                logger.warning('number of active download processes is too big to works well!!')
-            worker = ThreadPoolExecutor(max_workers=jobs)
-            # does not call Thread.join(), catch KeyboardInterrupt in main thread
-            try:
-                futures = run(worker.submit, save_url)
-                downloading = True
-                while downloading:
-                    time.sleep(0.1)
-                    for future in futures:
-                        downloading = not future.done()
-                        if downloading:
-                            break
-            except KeyboardInterrupt:
-                from concurrent.futures.thread import _threads_queues
-                from threading import _shutdown_locks
-                _threads_queues.clear()
-                _shutdown_locks.clear()
-                print()
-                raise
-        else:
-            run(save_url, tries=1)
-        downloaded, size, total, _cost = reporthook(['end'])
-        cost += _cost
-        print('\nCurrent downloaded %s, cost %s.'
-              '\nTotal downloaded %s of %s, cost %s'
-              % (human_size(downloaded), human_time(_cost),
-                 human_size(size), human_size(total), human_time(cost)))
-        succeed = 0 not in status
-        if not succeed:
+        if assemble and count > 1:
+            store = Container(name, ext, count, journal)
+        while tries:
+            tries -= 1
+            reporthook(['start', not multi, status, job.estimator])
             if count == 1:
-                logger.error('donwload failed')
+                save_url(urls[0], name, ext, status, reporthook=reporthook,
+                         journal=journal, job=job,
+                         mirrors=mirrors and mirrors[0],
+                         checksums=checksums and checksums[0],
+                         refresher=refresher)
+            elif engine == 'asyncio':
+                from .aiodownload import save_parts
+                save_parts(urls, name, ext, status, jobs=jobs,
+                           reporthook=reporthook, journal=store or journal,
+                           job=job, mirrors=mirrors, checksums=checksums,
+                           store=store, refresher=refresher)
+            elif jobs > 1:
+                if min(count - sum(status), jobs) > 12:
+                    logger.warning('number of active download processes is too big to works well!!')
+                worker = executor or ThreadPoolExecutor(max_workers=jobs)
+                # does not call Thread.join(), catch KeyboardInterrupt in main thread
+                try:
+                    # the concurrency is raised while it raises throughput
+                    parts = [no for no in range(count) if status[no] != 1]
+                    parts.reverse()
+                    futures = []
+                    while parts or futures:
+                        futures = [f for f in futures if not f.done()]
+                        while parts and len(futures) < \
+                                job.estimator.concurrency(jobs):
+                            futures.append(run(parts.pop(), worker.submit))
+                        time.sleep(0.1)
+                except KeyboardInterrupt:
+                    from concurrent.futures.thread import _threads_queues
+                    from threading import _shutdown_locks
+                    _threads_queues.clear()
+                    _shutdown_locks.clear()
+                    print()
+                    raise
             else:
-                logger.error('download failed at parts: ' + 
-                             ', '.join([str(no)
-                                        for no, s in enumerate(status)
-                                        if s == 0]))
+                for no in range(count):
+                    if status[no] != 1:
+                        run(no, tries=1)
+            journal.save()
+            downloaded, size, total, _cost = reporthook(['end'])
+            cost += _cost
+            print('\nCurrent downloaded %s, cost %s.'
+                  '\nTotal downloaded %s of %s, cost %s'
+                  % (human_size(downloaded), human_time(_cost),
+                     human_size(size), human_size(total), human_time(cost)))
+            succeed = 0 not in status
+            if not succeed:
+                if count == 1:
+                    logger.error('donwload failed')
+                else:
+                    logger.error('download failed at parts: ' + 
+                                 ', '.join([str(no)
+                                            for no, s in enumerate(status)
+                                            if s == 0]))
+                if not tries:
+                    # increase retry automatically, if the pessimistic ETA
+                    # which is estimated by recent throughput is acceptable
+                    eta, _, eta_high = job.estimator.eta(total - size,
+                                                         idle=False)
+                    if eta_high > 0:
+                        if eta_high < fail_retry_eta:
+                            tries += 1
+                    else:
+                        # not confident, speed 16KBps and ETA 3600s
+                        speed = downloaded / _cost or 1
+                        eta = (total - size) / speed
+                        if speed > 16384 and 0 < eta < fail_retry_eta:
+                            tries += 1
+            if succeed or not tries and (
+                    not fail_confirm or
+                    ask('The estimated ETA is %s, '
+                        'do you want to continue downloading? [Y] '
+                        % human_time(eta)
+                    ).upper() != 'Y'):
+                break
             if not tries:
-                # increase retry automatically, speed 16KBps and ETA 3600s
-                speed = downloaded / _cost or 1
-                eta = (total - size) / speed
-                if speed > 16384 and 0 < eta < fail_retry_eta:
-                    tries += 1
-        if succeed or not tries and (
-                not fail_confirm or
-                input('The estimated ETA is %s, '
-                      'do you want to continue downloading? [Y] '
-                      % human_time(eta)
-                ).upper() != 'Y'):
-            break
-        if not tries:
-            tries += 1
-        print('Restart downloading: ' + name)
+                tries += 1
+            print('Restart downloading: ' + name)
+    finally:
+        if store is not None:
+            store.close(succeed)
+        job.close()
+        logger.debug('job %r transferred %s, throughput %s/s',
+                     name, human_size(job.transferred),
+                     human_size(int(job.throughput)))
+    if succeed and count == 1:
+        journal.remove()
     return succeed
@@ -0,0 +1,243 @@
+'''Throughput and ETA estimator of downloads.
+
+One Estimator belongs to one job (see ykdl.util.scheduler.Job), it keeps
+the EWMA throughput of every active part and of the job, the hosts are
+shared by all jobs and also keep the latency (time to response) samples.
+
+The estimator drives:
+
+  - the ETA and its confidence bounds, which decide the automatic retries;
+  - the concurrency of parts, it is raised while it raises the throughput,
+    if `adaptive_concurrency` is enabled;
+  - the hedged requests, see `Estimator.hedge_delay()`;
+  - the speed and ETA of the progress display.
+'''
+
+import math
+import time
+import threading
+from collections import deque
+
+
+__all__ = ['EWMA', 'Samples', 'Estimator', 'host_stats']
+
+_sample_interval = 0.5
+_halflife = 3
+_z = 1.645  # 90% two-sided confidence
+_concurrency_interval = 1.5
+_concurrency_gain = 1.05
+_hedge_min_samples = 20
+_hedge_min_delay = 1
+_hedge_ratio = 0.05  # at most 5% requests are hedged
+
+adaptive_concurrency = False
+
+
+class EWMA:
+    '''Time-weighted EWMA of a rate, with its variance.
+
+    The counts are accumulated, and become a sample at most every 0.5s.
+    '''
+
+    def __init__(self, halflife=_halflife):
+        self.halflife = halflife
+        self.value = 0.0
+        self.var = 0.0
+        self.total = 0
+        self.samples = 0
+        self.pending = 0
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _sample(self, now):
+        dt = now - self.last_time
+        rate = self.pending / dt
+        if not self.samples:
+            return rate, 0.0
+        alpha = 1 - 2 ** (-dt / self.halflife)
+        delta = rate - self.value
+        return (self.value + alpha * delta,
+                (1 - alpha) * (self.var + alpha * delta * delta))
+
+    def add(self, n, now=None):
+        now = now or time.monotonic()
+        with self.lock:
+            self.total += n
+            self.pending += n
+            if now - self.last_time >= _sample_interval:
+                self.value, self.var = self._sample(now)
+                self.samples += 1
+                self.pending = 0
+                self.last_time = now
+
+    def rate(self, now=None):
+        '''The rate as of now, an idle time counts as a zero sample.'''
+        now = now or time.monotonic()
+        with self.lock:
+            if now - self.last_time >= _sample_interval:
+                return self._sample(now)[0]
+            return self.value
+
+    def std(self):
+        return math.sqrt(self.var)
+
+
+class Samples:
+    '''The latest samples, for percentiles.'''
+
+    def __init__(self, maxlen=256):
+        self.samples = deque(maxlen=maxlen)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p):
+        '''Return the p-th percentile (0~100), or None without samples.'''
+        samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+class HostStats:
+    def __init__(self):
+        self.throughput = EWMA()
+        self.latency = Samples()
+        self.errors = 0
+
+# host: HostStats, shared by all jobs
+host_stats = {}
+_host_lock = threading.Lock()
+
+def get_host_stats(host):
+    try:
+        return host_stats[host]
+    except KeyError:
+        with _host_lock:
+            return host_stats.setdefault(host, HostStats())
+
+
+class Estimator:
+
+    def __init__(self):
+        self.job = EWMA()
+        self.parts = {}  # active part: EWMA
+        self.level = None
+        self.last_level_time = 0
+        self.last_level_rate = 0
+        self.durations = Samples()  # of the completed parts
+        self.requests = 0
+        self.hedges = 0
+        self.hosts = {}  # part: the last host
+        self.errors = deque(maxlen=100)  # (count, host, error)
+        self.error_count = 0
+
+    def start_part(self, part):
+        self.parts[part] = EWMA()
+
+    def finish_part(self, part, seconds=None):
+        '''The part has been stopped, `seconds` is the duration of a completed
+        transfer.
+        '''
+        self.parts.pop(part, None)
+        if seconds:
+            self.durations.add(seconds)
+
+    def update(self, part, n, host=None):
+        '''Account n bytes of part which are received from host.'''
+        now = time.monotonic()
+        self.job.add(n, now)
+        try:
+            self.parts[part].add(n, now)
+        except KeyError:
+            self.start_part(part)
+            self.parts[part].add(n, now)
+        if host:
+            self.hosts[part] = host
+            get_host_stats(host).throughput.add(n, now)
+
+    def latency(self, host, seconds):
+        '''Record the time to response of a request.'''
+        self.requests += 1
+        get_host_stats(host).latency.add(seconds)
+
+    def error(self, host, error=None):
+        '''Record a failed request, keep the recent errors.'''
+        get_host_stats(host).errors += 1
+        self.error_count += 1
+        self.errors.append((self.error_count, host, error))
+
+    def throughput(self, part=None, host=None):
+        '''The throughput of the part, or the host, or the job.'''
+        if part is not None:
+            ewma = self.parts.get(part)
+            return ewma.rate() if ewma else 0.0
+        if host is not None:
+            return get_host_stats(host).throughput.rate()
+        return self.job.rate()
+
+    def latency_percentile(self, host, p=95):
+        return get_host_stats(host).latency.percentile(p)
+
+    def hedge_delay(self, host=None):
+        '''Return the seconds after which a request should be hedged, the p95
+        of the time to response of host, or the p95 of the part durations if
+        host is None. Returns None without enough samples.
+        '''
+        samples = self.durations if host is None else \
+                  get_host_stats(host).latency
+        if len(samples) < _hedge_min_samples:
+            return None
+        return max(samples.percentile(95), _hedge_min_delay)
+
+    def try_hedge(self):
+        '''Take a hedge from the budget, returns False if the cap is hit.'''
+        if self.hedges >= 1 + self.requests * _hedge_ratio:
+            return False
+        self.hedges += 1
+        return True
+
+    def eta(self, remaining, part=None, idle=True):
+        '''Return (eta, low, high) seconds of the remaining bytes, the bounds
+        are the 90% confidence of the throughput, -1 means unknown.
+
+        `idle`, whether count the idle time since last transfer, use False
+                after the transfers have been stopped.
+        '''
+        ewma = self.job if part is None else self.parts.get(part)
+        if remaining < 0 or not ewma:
+            return -1, -1, -1
+        rate = ewma.rate() if idle or not ewma.samples else ewma.value
+        if rate <= 0:
+            return -1, -1, -1
+        margin = _z * ewma.std()
+        low = remaining / (rate + margin)
+        high = remaining / (rate - margin) if rate > margin else -1
+        return remaining / rate, low, high
+
+    def concurrency(self, limit):
+        '''Return the number of parts which should be downloaded at the same
+        time, it starts from half of the limit, raises by one while it raises
+        the throughput more than 5%, and falls back if the throughput drops.
+        The limit is returned if `adaptive_concurrency` is disabled.
+        '''
+        if not adaptive_concurrency:
+            return limit
+        now = time.monotonic()
+        if self.level is None:
+            self.level = min(max(2, limit // 2), limit)
+            self.last_level_time = now
+        elif now - self.last_level_time >= _concurrency_interval:
+            rate = self.job.rate(now)
+            if rate > self.last_level_rate * _concurrency_gain:
+                self.level += 1
+            elif self.level > 1 and \
+                    rate * _concurrency_gain < self.last_level_rate:
+                self.level -= 1
+            self.last_level_rate = rate
+            self.last_level_time = now
+        self.level = max(1, min(self.level, limit))
+        return self.level
@@ -0,0 +1,113 @@
+'''Refresh the signed URLs which expire during a long download.
+
+The expiry of an URL is given by the extractor (the stream key 'expires',
+unix time), or parsed from the well-known query parameters of the CDNs.
+When a part hits the expiry, or gets 403/410, the refresh function re-runs
+the extractor for the same stream, the fresh URLs are swapped in for the
+remaining parts. The parts are resumed, the journal identifies a part by the
+path of its URL, without the query (see ykdl.util.journal).
+'''
+
+import time
+import threading
+from logging import getLogger
+from urllib.parse import urlsplit, parse_qs
+
+
+__all__ = ['url_expires', 'Refresher']
+
+logger = getLogger(__name__)
+
+# query parameter: base of the unix time
+_expiry_params = {
+    'deadline': 10,   # bilibili upos, qiniu
+    'expires': 10,
+    'Expires': 10,    # CloudFront, OSS
+    'x-expires': 10,
+    'wsTime': 16,     # ChinaNetCenter, huya
+    'txTime': 16,     # Tencent Cloud
+}
+_expired_codes = 403, 410
+_margin = 60        # seconds, refresh before the URLs expire
+_min_interval = 10  # seconds, between two refreshes
+_max_refreshes = 10
+
+
+def url_expires(url):
+    '''Return the expiry (unix time) which is parsed from giving URL, or
+    None if it is unknown.
+    '''
+    query = parse_qs(urlsplit(url).query)
+    for param, base in _expiry_params.items():
+        if param in query:
+            try:
+                return int(query[param][0], base)
+            except ValueError:
+                pass
+
+def is_expired_error(e):
+    return getattr(e, 'code', None) in _expired_codes
+
+
+class Refresher:
+    '''Keep the current URLs of the parts of a download.
+
+    `refresh`, a function returns the fresh (urls, mirrors, expires) of the
+               same stream, `mirrors` and `expires` can be None.
+    '''
+
+    def __init__(self, refresh, urls, mirrors=None, expires=None):
+        self.func = refresh
+        self.urls = list(urls)
+        self.mirrors = mirrors and list(mirrors)
+        self.expires = expires
+        self.refreshes = 0
+        self.last = 0
+        self.lock = threading.Lock()          # the urls
+        self.refresh_lock = threading.Lock()  # one refresh at a time
+
+    def get(self, part):
+        '''Return the current url and mirrors of part.'''
+        with self.lock:
+            return self.urls[part], self.mirrors and self.mirrors[part]
+
+    def expiry(self, part):
+        with self.lock:
+            return self.expires or url_expires(self.urls[part])
+
+    def expiring(self, part):
+        '''Whether the url of part expires soon.'''
+        expires = self.expiry(part)
+        return expires is not None and expires - _margin < time.time()
+
+    def refresh(self, part, url):
+        '''Refresh the urls because the url of part has been expired,
+        returns whether there is a fresh one. The concurrent calls of the
+        same url only refresh once, the other parts keep reading the current
+        urls while refreshing.
+        '''
+        with self.refresh_lock:
+            if self.get(part)[0] != url:
+                return True  # refreshed by the other parts
+            if self.refreshes >= _max_refreshes or \
+                    time.monotonic() - self.last < _min_interval:
+                return False
+            self.refreshes += 1
+            self.last = time.monotonic()
+            try:
+                urls, mirrors, expires = self.func()
+            except Exception as e:
+                logger.warning('refresh urls failed: %r', e)
+                return False
+            if len(urls) != len(self.urls):
+                logger.warning('refresh urls failed: the number of parts '
+                               'has been changed, %d => %d',
+                               len(self.urls), len(urls))
+                return False
+            with self.lock:
+                self.urls = list(urls)
+                self.mirrors = mirrors and list(mirrors)
+                self.expires = expires
+            logger.debug('part %d: urls have been refreshed, expires at %s',
+                         part, self.expiry(part))
+            return self.get(part)[0] != url
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import time
+import threading
+import unittest
+from urllib.error import HTTPError
+
+from ykdl.util import expiry
+from ykdl.util.expiry import url_expires, is_expired_error, Refresher
+
+
+class ExpiryTests(unittest.TestCase):
+
+    def test_url_expires(self):
+        self.assertEqual(url_expires('http://x/a.flv?deadline=123'), 123)
+        self.assertEqual(url_expires('http://x/a.m3u8?Expires=456&sign=1'),
+                         456)
+        self.assertEqual(url_expires('http://x/a.flv?wsTime=5f5e1000'),
+                         0x5f5e1000)
+        self.assertIsNone(url_expires('http://x/a.flv?vkey=abc'))
+        self.assertIsNone(url_expires('http://x/a.flv?expires=soon'))
+
+    def test_is_expired_error(self):
+        for code, expired in ((403, True), (410, True), (404, False)):
+            e = HTTPError('http://x/', code, '', {}, None)
+            self.assertEqual(is_expired_error(e), expired)
+        self.assertFalse(is_expired_error(IOError('timed out')))
+
+
+class RefresherTests(unittest.TestCase):
+
+    def setUp(self):
+        self._min_interval = expiry._min_interval
+        expiry._min_interval = 0
+        self.calls = 0
+        self.count = 3
+
+    def tearDown(self):
+        expiry._min_interval = self._min_interval
+
+    def urls(self, n=None):
+        return ['http://x/%d.ts?t=%d' % (i, self.calls)
+                for i in range(n or self.count)]
+
+    def refresh(self):
+        self.calls += 1
+        return self.urls(), None, time.time() + 3600
+
+    def test_refresh(self):
+        refresher = Refresher(self.refresh, self.urls())
+        url = refresher.get(1)[0]
+        self.assertTrue(refresher.refresh(1, url))
+        self.assertEqual(refresher.get(1), ('http://x/1.ts?t=1', None))
+        # refreshed by the other part
+        self.assertTrue(refresher.refresh(2, 'http://x/2.ts?t=0'))
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent(self):
+        self.count = 8
+        urls = self.urls()
+        refresher = Refresher(self.refresh, urls)
+        results = []
+        def refresh(part):
+            # all parts have got 403 by the expired urls
+            results.append(refresher.refresh(part, urls[part]))
+        threads = [threading.Thread(target=refresh, args=(part,))
+                   for part in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(self.calls, 1)
+
+    def test_expiring(self):
+        refresher = Refresher(self.refresh, self.urls(), expires=time.time())
+        self.assertTrue(refresher.expiring(0))
+        refresher.refresh(0, refresher.get(0)[0])
+        self.assertFalse(refresher.expiring(0))
+        # unknown expiry
+        refresher = Refresher(self.refresh, ['http://x/0.ts?vkey=1'])
+        self.assertFalse(refresher.expiring(0))
+
+    def test_limits(self):
+        refresher = Refresher(self.refresh, self.urls())
+        for _ in range(expiry._max_refreshes):
+            self.assertTrue(refresher.refresh(0, refresher.get(0)[0]))
+        self.assertFalse(refresher.refresh(0, refresher.get(0)[0]))
+
+    def test_failures(self):
+        def fail():
+            raise IOError('parse failed')
+        refresher = Refresher(fail, self.urls())
+        with self.assertLogs('ykdl.util.expiry', 'WARNING'):
+            self.assertFalse(refresher.refresh(0, refresher.get(0)[0]))
+        # the number of parts has been changed
+        refresher = Refresher(lambda: (self.urls(2), None, None), self.urls())
+        with self.assertLogs('ykdl.util.expiry', 'WARNING'):
+            self.assertFalse(refresher.refresh(0, refresher.get(0)[0]))
+        self.assertEqual(len(refresher.urls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
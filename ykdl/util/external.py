@@ -1,11 +1,13 @@
 import os
 import sys
 import shlex
+import threading
 import subprocess
 from logging import getLogger
 from tempfile import NamedTemporaryFile
 
 from .http import fake_headers
+from .fs import copy_fd, concat_files
 
 logger = getLogger(__name__)
 
@@ -158,17 +160,16 @@ def launch_ffmpeg(basename, ext, lenth):
                 '-i', '-',
                 '-c', 'copy',
                 outputfile ]
-        pipe_input = subprocess.Popen(cmd, stdin=subprocess.PIPE).stdin
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=0)
 
-        # use pipe pass data does not need to wait subprocess
-        bufsize = 1024 * 64
+        # use pipe pass data does not need to wait subprocess, the data is
+        # copied into the pipe by the kernel
         for i in range(lenth):
             inputfile = '%s_%d.%s' % (basename, i, ext)
             with open(inputfile, 'rb') as fp:
-                data = fp.read(bufsize)
-                while data:
-                    pipe_input.write(data)
-                    data = fp.read(bufsize)
+                copy_fd(fp.fileno(), process.stdin.fileno())
+        process.stdin.close()
+        process.wait()
     else:
         # build input file
         inputfile = NamedTemporaryFile(mode='w+t', suffix='.txt', dir='.',
@@ -188,9 +189,242 @@ def launch_ffmpeg(basename, ext, lenth):
             cmd[-1:-1] = ['-bsf:a', 'aac_adtstoasc']
         subprocess.call(cmd)
 
-def launch_ffmpeg_download(url, name):
+class StreamMerger:
+    '''Merge parts with FFmpeg (or natively) while downloading.
+
+    Parts are fed into FFmpeg's stdin strictly in order, as soon as the next
+    contiguous part has been finished, then they will be deleted at once.
+    Only works with the formats which can be concatenated as bytes.
+    '''
+
+    exts = 'ts', 'mpg', 'mpeg'
+
+    def __init__(self, basename, ext, lenth, native=False, drop_psi=False):
+        assert ext in self.exts, 'can not merge %r as stream' % ext
+        assert not native or ext == 'ts', 'can not merge %r natively' % ext
+        self.basename = basename
+        self.ext = ext
+        self.lenth = lenth
+        self.native = native
+        self.drop_psi = drop_psi
+        if native:
+            # a complete 'name.ts' means that downloading has been done
+            self.outputfile = basename + '.merging.ts'
+        else:
+            self.outputfile = basename + (ext == 'ts' and '.mp4' or '.' + ext)
+        self.process = None
+        self.concatenator = None
+        self.ready = set()
+        self.aborted = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='StreamMerger')
+        self.thread.start()
+
+    def reporthook(self, reporthook):
+        '''Wrap the reporthook, get notified when a part has been finished.'''
+        def hook(action, size=None, total=None, part=None):
+            result = reporthook(action, size, total, part)
+            if action[0] == 'part end' and action[1][part]:
+                self.part_done(part)
+            return result
+        return hook
+
+    def part_done(self, part):
+        with self.cond:
+            if isinstance(part, int):
+                self.ready.add(part)
+            else:
+                self.ready.update(part)
+            self.cond.notify()
+
+    def _open(self):
+        if self.native:
+            from .mpegts import TSConcatenator
+            print('Merging video %s (stream):' % self.basename)
+            self.concatenator = TSConcatenator(open(self.outputfile, 'wb'),
+                                               self.drop_psi)
+        else:
+            print('Merging video %s using FFmpeg (stream):' % self.basename)
+            cmd = [ 'ffmpeg',
+                    '-y', '-hide_banner', '-loglevel', 'error',
+                    '-i', '-',
+                    '-c', 'copy',
+                    self.outputfile ]
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                            bufsize=0)
+
+    def _feed(self, inputfile):
+        if self.concatenator:
+            self.concatenator.append(inputfile)
+            return
+        with open(inputfile, 'rb') as fp:
+            copy_fd(fp.fileno(), self.process.stdin.fileno())
+
+    def _run(self):
+        for i in range(self.lenth):
+            with self.cond:
+                while i not in self.ready and not self.aborted:
+                    self.cond.wait()
+                if self.aborted:
+                    return
+                self.ready.discard(i)
+            inputfile = '%s_%d.%s' % (self.basename, i, self.ext)
+            if not os.path.exists(inputfile):
+                logger.warning('stream merge: lost part %d', i)
+                continue
+            if self.process is None and self.concatenator is None:
+                self._open()
+            self._feed(inputfile)
+            os.remove(inputfile)
+
+    def _close(self):
+        if self.concatenator:
+            self.concatenator.fp.close()
+            return True
+        if self.process:
+            self.process.stdin.close()
+            return self.process.wait() == 0
+        return False
+
+    def close(self):
+        '''Wait all parts have been fed, then wait FFmpeg exit.
+
+        Returns whether the output file has been finished.
+        '''
+        self.part_done(range(self.lenth))
+        self.thread.join()
+        succeed = self._close()
+        if succeed and self.native:
+            os.replace(self.outputfile, self.basename + '.ts')
+        return succeed
+
+    def abort(self):
+        '''Stop feeding, the merged parts have been lost, remove the output.'''
+        with self.cond:
+            self.aborted = True
+            self.cond.notify()
+        self.thread.join()
+        self._close()
+        try:
+            os.remove(self.outputfile)
+        except OSError:
+            pass
+
+# the formats which can be concatenated as bytes and fed into a pipe
+mux_pipe_exts = 'ts', 'mpg', 'mpeg', 'aac', 'mp3'
+_adts_exts = 'ts', 'aac'  # AAC in ADTS, which is converted for MP4
+
+def _feed_parts(parts, fd):
+    try:
+        for inputfile in parts:
+            with open(inputfile, 'rb') as fp:
+                copy_fd(fp.fileno(), fd)
+    except BrokenPipeError:
+        logger.debug('FFmpeg has closed its input')
+    finally:
+        os.close(fd)
+
+def launch_ffmpeg_mux(outputfile, video, audio, pipe_video=True,
+                      pipe_audio=True, audio_ext=None):
+    '''Mux the video parts and the audio parts into `outputfile` with
+    FFmpeg in one pass, there are no merged files of the tracks.
+
+    The parts of a track which can be concatenated as bytes (`pipe_*`,
+    e.g. MPEG-TS, ADTS) are fed into a pipe of FFmpeg, stdin for video and
+    an extra pipe for audio (POSIX only), the others are read by the concat
+    demuxer. `audio_ext` decides whether the ADTS headers are converted.
+    Returns whether the output has been finished.
+    '''
+    print('Muxing video %s using FFmpeg:' % outputfile)
+    cmd = [ 'ffmpeg',
+            '-y', '-hide_banner' ]
+    feeds = []  # (read fd of FFmpeg, write fd, parts)
+    lists = []
+    for parts, pipe in ((video, pipe_video), (audio, pipe_audio and posix)):
+        if pipe and not feeds:
+            feeds.append((0, None, parts))
+            cmd += ['-i', 'pipe:0']
+        elif pipe:
+            r, w = os.pipe()
+            feeds.append((r, w, parts))
+            cmd += ['-i', 'pipe:%d' % r]
+        else:
+            inputfile = NamedTemporaryFile(mode='w+t', suffix='.txt',
+                                           dir='.', encoding='utf-8')
+            for part in parts:
+                inputfile.write("file '%s'\n" % part)
+            inputfile.flush()
+            lists.append(inputfile)
+            cmd += ['-safe', '-1', '-f', 'concat', '-i', inputfile.name]
+    cmd += [ '-map', '0:v', '-map', '1:a',
+             '-c', 'copy' ]
+    if audio_ext in _adts_exts:
+        cmd += [ '-bsf:a', 'aac_adtstoasc' ]
+    cmd.append(outputfile)
+    try:
+        process = subprocess.Popen(cmd,
+                stdin=feeds and feeds[0][0] == 0 and subprocess.PIPE or None,
+                pass_fds=[r for r, w, _ in feeds if w is not None])
+        threads = []
+        for r, w, parts in feeds:
+            if w is None:
+                w = os.dup(process.stdin.fileno())
+                process.stdin.close()
+            else:
+                os.close(r)
+            # the tracks are fed concurrently, FFmpeg reads them interleaved
+            thread = threading.Thread(target=_feed_parts, args=(parts, w),
+                                      daemon=True, name='MuxFeeder')
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return process.wait() == 0
+    finally:
+        for inputfile in lists:
+            inputfile.close()
+
+native_merge_exts = 'ts', 'flv', 'mpg', 'mpeg', 'aac', 'mp3'
+_concat_exts = 'mpg', 'mpeg', 'aac', 'mp3'  # the bytes are concatenable
+
+def launch_native_merge(basename, ext, lenth, drop_psi=False):
+    '''Merge parts in process, supports MPEG-TS, FLV, and the formats which
+    are concatenated as bytes (MPEG-PS, ADTS, MP3), output is not remuxed.
+    '''
+    print('Merging video %s:' % basename)
+    inputs = ['%s_%d.%s' % (basename, i, ext) for i in range(lenth)]
+    outputfile = basename + '.merging.' + ext
+    if ext == 'ts':
+        from .mpegts import concat_ts
+        concat_ts(inputs, outputfile, drop_psi)
+    elif ext == 'flv':
+        from .flv import concat_flv
+        concat_flv(inputs, outputfile)
+    elif ext in _concat_exts:
+        concat_files(inputs, outputfile)
+    else:
+        raise ValueError('can not merge %r natively' % ext)
+    os.replace(outputfile, basename + '.' + ext)
+
+# the formats which can be written into a pipe
+_pipe_formats = {
+    'flv': ['-f', 'flv'],
+    'mp4': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov'],
+    'ts': ['-f', 'mpegts'],
+}
+
+def launch_ffmpeg_download(url, name, stdout=None, start=None, end=None):
+    '''Download with FFmpeg into the file `name`, or the binary file object
+    `stdout`, the format is decided by the ext of `name`.
+
+    `start`, `end`, only download the time range in seconds, FFmpeg reads
+    the index (e.g. moov) then seeks by HTTP Range, the other bytes are
+    not downloaded.
+    '''
     print('Now downloading: %s' % name)
-    logger.warning('''
+    if stdout is None:
+        logger.warning('''
 =================================
   stop downloading by press 'q'
 =================================
@@ -203,7 +437,17 @@ def launch_ffmpeg_download(url, name):
             '-c', 'copy',
             '-bsf:a', 'aac_adtstoasc',
             name ]
+    if end is not None:
+        cmd[-1:-1] = ['-t', '%.3f' % (end - (start or 0))]
+    if start:
+        i = cmd.index('-i')
+        cmd[i:i] = ['-ss', '%.3f' % start]
     if os.path.isfile(url):
        cmd[2:2] = ['-protocol_whitelist', 'file,http,https,tls,rtp,tcp,udp,crypto,httpproxy']
+    if stdout is not None:
+        ext = name.rpartition('.')[2]
+        cmd[-1:] = _pipe_formats.get(ext, _pipe_formats['ts']) + ['pipe:1']
+        cmd[1:1] = ['-nostdin', '-loglevel', 'error']
+        return subprocess.call(cmd, stdout=stdout)
 
-    subprocess.call(cmd)
+    return subprocess.call(cmd)
@@ -0,0 +1,262 @@
+'''Concatenate FLV parts without FFmpeg.
+
+The parts are read as tags in a stream, and at part boundaries:
+
+  - audio/video timestamps are shifted to continue the previous part;
+  - the repeated AVC/AAC sequence headers are dropped if nothing changed;
+  - script tags are dropped, one merged onMetaData is written at the head,
+    with the total duration, file size and the keyframes index.
+
+It needs two passes, first scans the tag headers (seek over the data), then
+copies the tags into output.
+'''
+
+import struct
+from logging import getLogger
+
+
+__all__ = ['amf0_decode', 'amf0_encode', 'read_tags', 'concat_flv']
+
+logger = getLogger(__name__)
+
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+TAG_HEADER_SIZE = 11
+FLV_HEADER = b'FLV\x01'
+
+
+# AMF0
+
+def amf0_decode(data, pos=0):
+    '''Decode one AMF0 value, returns value and new position.'''
+    marker = data[pos]
+    pos += 1
+    if marker == 0:  # number
+        return struct.unpack_from('>d', data, pos)[0], pos + 8
+    if marker == 1:  # boolean
+        return bool(data[pos]), pos + 1
+    if marker == 2:  # string
+        n, = struct.unpack_from('>H', data, pos)
+        pos += 2
+        return data[pos:pos + n].decode('utf-8', 'replace'), pos + n
+    if marker == 12:  # long string
+        n, = struct.unpack_from('>I', data, pos)
+        pos += 4
+        return data[pos:pos + n].decode('utf-8', 'replace'), pos + n
+    if marker in (3, 8):  # object, ECMA array
+        if marker == 8:
+            pos += 4  # approximate count, ignore
+        obj = {}
+        while pos + 3 <= len(data):
+            n, = struct.unpack_from('>H', data, pos)
+            pos += 2
+            if n == 0 and data[pos] == 9:  # object end
+                return obj, pos + 1
+            key = data[pos:pos + n].decode('utf-8', 'replace')
+            obj[key], pos = amf0_decode(data, pos + n)
+        return obj, pos
+    if marker == 10:  # strict array
+        n, = struct.unpack_from('>I', data, pos)
+        pos += 4
+        array = []
+        for _ in range(n):
+            value, pos = amf0_decode(data, pos)
+            array.append(value)
+        return array, pos
+    if marker == 11:  # date, ignore time zone
+        return struct.unpack_from('>d', data, pos)[0], pos + 10
+    if marker in (5, 6):  # null, undefined
+        return None, pos
+    raise ValueError('unsupported AMF0 marker: %d' % marker)
+
+def _amf0_encode_string(s):
+    s = s.encode('utf-8')
+    return struct.pack('>H', len(s)) + s
+
+def amf0_encode(value, ecma=False):
+    '''Encode one AMF0 value, dict is encoded as ECMA array if `ecma` is True,
+    otherwise as object.
+    '''
+    if isinstance(value, bool):
+        return b'\x01' + bytes([value])
+    if isinstance(value, (int, float)):
+        return b'\x00' + struct.pack('>d', value)
+    if isinstance(value, str):
+        s = value.encode('utf-8')
+        if len(s) > 0xffff:
+            return b'\x0c' + struct.pack('>I', len(s)) + s
+        return b'\x02' + struct.pack('>H', len(s)) + s
+    if isinstance(value, dict):
+        if ecma:
+            data = [b'\x08', struct.pack('>I', len(value))]
+        else:
+            data = [b'\x03']
+        for k, v in value.items():
+            data.append(_amf0_encode_string(k))
+            data.append(amf0_encode(v))
+        data.append(b'\x00\x00\x09')
+        return b''.join(data)
+    if isinstance(value, (list, tuple)):
+        return b''.join([b'\x0a', struct.pack('>I', len(value))] +
+                        [amf0_encode(v) for v in value])
+    if value is None:
+        return b'\x05'
+    raise TypeError('unsupported AMF0 type: %r' % type(value))
+
+
+# Tags
+
+def read_header(fp):
+    '''Read the FLV header, returns the flags, and seek to the first tag.'''
+    header = fp.read(9)
+    if len(header) < 9 or header[:4] != FLV_HEADER:
+        raise ValueError('not a FLV file')
+    flags = header[4]
+    offset, = struct.unpack_from('>I', header, 5)
+    fp.seek(offset + 4)  # skip PreviousTagSize0
+    return flags
+
+def read_tag_headers(fp):
+    '''Iterate the tag headers, yields (offset, type, size, timestamp).
+
+    The data of tags are skipped by seeking, if the data has been read, the
+    file position MUST be restored at the end of the tag.
+    '''
+    while True:
+        offset = fp.tell()
+        header = fp.read(TAG_HEADER_SIZE)
+        if len(header) < TAG_HEADER_SIZE:
+            if header:
+                logger.warning('drop incomplete tag at offset %d', offset)
+            return
+        tag_type = header[0] & 0x1f
+        size = int.from_bytes(header[1:4], 'big')
+        timestamp = int.from_bytes(header[4:7], 'big') | header[7] << 24
+        end = offset + TAG_HEADER_SIZE + size + 4
+        yield offset, tag_type, size, timestamp
+        fp.seek(end)
+
+def read_tags(fp):
+    '''Iterate the tags, yields (type, timestamp, data).'''
+    read_header(fp)
+    for offset, tag_type, size, timestamp in read_tag_headers(fp):
+        data = fp.read(size)
+        if len(data) < size:
+            logger.warning('drop incomplete tag at offset %d', offset)
+            return
+        yield tag_type, timestamp, data
+
+def pack_tag(tag_type, timestamp, data):
+    size = len(data)
+    return b''.join([bytes([tag_type]), size.to_bytes(3, 'big'),
+                     (timestamp & 0xffffff).to_bytes(3, 'big'),
+                     bytes([timestamp >> 24 & 0xff]), b'\x00\x00\x00',
+                     data, struct.pack('>I', size + TAG_HEADER_SIZE)])
+
+def _is_sequence_header(tag_type, head):
+    if tag_type == TAG_VIDEO:
+        # AVC/HEVC and AVCPacketType 0
+        return len(head) > 1 and head[0] & 0x0f in (7, 12) and head[1] == 0
+    if tag_type == TAG_AUDIO:
+        # AAC and AACPacketType 0
+        return len(head) > 1 and head[0] >> 4 == 10 and head[1] == 0
+    return False
+
+
+def _scan(fp, part, plan, state):
+    '''Scan one part, append the kept tags into plan.'''
+    flags = read_header(fp)
+    base = None
+    last_ts = {}
+    interval = {}
+    for offset, tag_type, size, timestamp in read_tag_headers(fp):
+        if tag_type == TAG_SCRIPT:
+            if state['metadata'] is None:
+                data = fp.read(size)
+                name, pos = amf0_decode(data)
+                if name == 'onMetaData':
+                    state['metadata'], _ = amf0_decode(data, pos)
+            continue
+        if tag_type not in (TAG_AUDIO, TAG_VIDEO):
+            continue
+        head = fp.read(min(size, 2))
+        keyframe = tag_type == TAG_VIDEO and bool(head) and head[0] >> 4 == 1
+        if _is_sequence_header(tag_type, head):
+            keyframe = False
+            data = head + fp.read(size - len(head))
+            if state['sequence_headers'].get(tag_type) == data:
+                continue
+            state['sequence_headers'][tag_type] = data
+        if base is None:
+            base = timestamp
+        new_ts = max(timestamp - base, 0) + state['offset']
+        if tag_type in last_ts and new_ts > last_ts[tag_type]:
+            interval[tag_type] = new_ts - last_ts[tag_type]
+        last_ts[tag_type] = new_ts
+        plan.append((part, offset, size, new_ts, keyframe))
+    if last_ts:
+        end = max(last_ts.values())
+        state['offset'] = end + (interval.get(TAG_VIDEO) or
+                                 interval.get(TAG_AUDIO) or 0)
+    return flags
+
+def concat_flv(inputs, output):
+    '''Concatenate FLV files into output.
+
+    Params:
+        `inputs`, a list of filenames.
+        `output`, filename.
+    '''
+    plan = []
+    state = {'metadata': None, 'sequence_headers': {}, 'offset': 0}
+    flags = 0
+    for part, inputfile in enumerate(inputs):
+        with open(inputfile, 'rb') as fp:
+            flags |= _scan(fp, part, plan, state)
+
+    # layout, AMF0 numbers are fixed size, so the metadata size can be got
+    # before positions are computed
+    metadata = state['metadata'] or {}
+    for key in ('keyframes', 'filepositions', 'times', 'lasttimestamp',
+                'lastkeyframetimestamp', 'lastkeyframelocation'):
+        metadata.pop(key, None)
+    keyframes = [p for p in plan if p[4]]
+    metadata['duration'] = state['offset'] / 1000
+    metadata['filesize'] = 0.0
+    metadata['keyframes'] = {
+        'filepositions': [0.0] * len(keyframes),
+        'times': [p[3] / 1000 for p in keyframes]
+    }
+    script_data = amf0_encode('onMetaData') + amf0_encode(metadata, True)
+    position = 13 + TAG_HEADER_SIZE + len(script_data) + 4
+    filepositions = metadata['keyframes']['filepositions']
+    k = 0
+    for p in plan:
+        if p[4]:
+            filepositions[k] = float(position)
+            k += 1
+        position += TAG_HEADER_SIZE + p[2] + 4
+    metadata['filesize'] = float(position)
+    script_data = amf0_encode('onMetaData') + amf0_encode(metadata, True)
+
+    with open(output, 'wb') as out:
+        out.write(FLV_HEADER + bytes([flags & 0x05]) + struct.pack('>I', 9))
+        out.write(b'\x00\x00\x00\x00')
+        out.write(pack_tag(TAG_SCRIPT, 0, script_data))
+        fp = None
+        current = None
+        for part, offset, size, timestamp, _ in plan:
+            if part != current:
+                if fp:
+                    fp.close()
+                fp = open(inputs[part], 'rb')
+                current = part
+            fp.seek(offset)
+            header = bytearray(fp.read(TAG_HEADER_SIZE))
+            header[4:7] = (timestamp & 0xffffff).to_bytes(3, 'big')
+            header[7] = timestamp >> 24 & 0xff
+            out.write(header)
+            out.write(fp.read(size + 4))
+        if fp:
+            fp.close()
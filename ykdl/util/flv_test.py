@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import os
+import struct
+import tempfile
+import unittest
+
+from ykdl.util.flv import amf0_decode, amf0_encode, read_tags, concat_flv, \
+                          pack_tag, TAG_AUDIO, TAG_VIDEO, TAG_SCRIPT
+
+
+AVC_HEADER = b'\x17\x00avcC'
+AAC_HEADER = b'\xaf\x00\x12\x10'
+
+def keyframe(n):
+    return b'\x17\x01' + bytes([n])
+
+def frame(n):
+    return b'\x27\x01' + bytes([n])
+
+def audio(n):
+    return b'\xaf\x01' + bytes([n])
+
+def flv(tags, metadata=None):
+    data = [b'FLV\x01\x05' + struct.pack('>I', 9), b'\x00\x00\x00\x00']
+    if metadata is not None:
+        data.append(pack_tag(TAG_SCRIPT, 0, amf0_encode('onMetaData') +
+                                            amf0_encode(metadata, True)))
+    data += [pack_tag(*tag) for tag in tags]
+    return b''.join(data)
+
+def part(start, metadata=None):
+    # 3 video frames of 40ms, 2 audio frames, with the sequence headers
+    return flv([(TAG_VIDEO, start, AVC_HEADER),
+                (TAG_AUDIO, start, AAC_HEADER),
+                (TAG_VIDEO, start, keyframe(0)),
+                (TAG_AUDIO, start, audio(0)),
+                (TAG_VIDEO, start + 40, frame(1)),
+                (TAG_AUDIO, start + 60, audio(1)),
+                (TAG_VIDEO, start + 80, frame(2))], metadata)
+
+
+class AMF0Tests(unittest.TestCase):
+
+    def test_round_trip(self):
+        value = {'duration': 1.5, 'title': 'ykdl', 'stereo': True,
+                 'none': None, 'times': [0.0, 2.0], 'obj': {'a': 1.0}}
+        for ecma in (False, True):
+            decoded, pos = amf0_decode(amf0_encode(value, ecma))
+            self.assertEqual(decoded, value)
+
+    def test_long_string(self):
+        s = 'x' * 0x10000
+        data = amf0_encode(s)
+        self.assertEqual(data[0], 12)
+        self.assertEqual(amf0_decode(data), (s, len(data)))
+
+
+class ConcatFLVTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def concat(self, *parts):
+        inputs = []
+        for i, data in enumerate(parts):
+            path = os.path.join(self.dir.name, '%d.flv' % i)
+            with open(path, 'wb') as fp:
+                fp.write(data)
+            inputs.append(path)
+        output = os.path.join(self.dir.name, 'out.flv')
+        concat_flv(inputs, output)
+        return output
+
+    def test_timestamps(self):
+        # the second part restarts at 5000ms
+        output = self.concat(part(0, {'width': 640.0}), part(5000))
+        with open(output, 'rb') as fp:
+            tags = list(read_tags(fp))
+        self.assertEqual(tags[0][0], TAG_SCRIPT)
+        video = [(ts, data) for t, ts, data in tags if t == TAG_VIDEO]
+        # the repeated sequence header is dropped
+        self.assertEqual([data for ts, data in video].count(AVC_HEADER), 1)
+        self.assertEqual([ts for ts, data in video],
+                         [0, 0, 40, 80, 120, 160, 200])
+        audio = [ts for t, ts, data in tags if t == TAG_AUDIO]
+        self.assertEqual(audio, [0, 0, 60, 120, 180])
+
+    def test_metadata(self):
+        output = self.concat(part(0, {'width': 640.0}), part(0))
+        with open(output, 'rb') as fp:
+            data = fp.read()
+            fp.seek(0)
+            script = next(read_tags(fp))[2]
+        name, pos = amf0_decode(script)
+        metadata, _ = amf0_decode(script, pos)
+        self.assertEqual(name, 'onMetaData')
+        self.assertEqual(metadata['width'], 640.0)
+        self.assertEqual(metadata['filesize'], len(data))
+        # the end of the last frame
+        self.assertEqual(metadata['duration'], 0.24)
+        keyframes = metadata['keyframes']
+        self.assertEqual(keyframes['times'], [0.0, 0.12])
+        for position in keyframes['filepositions']:
+            position = int(position)
+            self.assertEqual(data[position], TAG_VIDEO)
+            self.assertEqual(data[position + 11] >> 4, 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
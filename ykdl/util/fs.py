@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import stat
+import errno
 import platform
 
 
@@ -62,3 +65,68 @@ def legitimize(text, compress='. -_', strip='. -_', trim=82):
 
     # Trim to specifying Unicode characters length, default target is 82
     return text[:trim]
+
+_copy_count = 1 << 30             # 1GB per system call
+_copy_bufsize = 1024 * 1024 * 4   # 4MB
+
+# the errors of unsupported copy, which falls back to the next method
+_copy_errnos = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF,
+                errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK}
+
+def _copy_file_range(src, dst):
+    return os.copy_file_range(src, dst, _copy_count)
+
+def _sendfile(src, dst):
+    return os.sendfile(dst, src, None, _copy_count)
+
+def _splice(src, dst):
+    return os.splice(src, dst, _copy_count)
+
+def copy_fd(src, dst):
+    '''Copy the rest of file descriptor `src` into `dst` from their current
+    offsets, returns the copied bytes.
+
+    The data is copied by the kernel without passing through user space if
+    it is supported: copy_file_range() into a regular file, sendfile() or
+    splice() into a pipe or socket, otherwise with a large buffer.
+    '''
+    methods = []
+    if stat.S_ISREG(os.fstat(dst).st_mode):
+        if hasattr(os, 'copy_file_range'):
+            methods.append(_copy_file_range)
+    elif hasattr(os, 'sendfile'):
+        methods.append(_sendfile)
+    if hasattr(os, 'splice') and stat.S_ISFIFO(os.fstat(dst).st_mode):
+        methods.append(_splice)
+
+    copied = 0
+    for method in methods:
+        try:
+            while True:
+                n = method(src, dst)
+                if not n:
+                    return copied
+                copied += n
+        except OSError as e:
+            # the offsets have been advanced by the copied data, go on
+            if e.errno not in _copy_errnos:
+                raise
+    buffer = memoryview(bytearray(_copy_bufsize))
+    with open(src, 'rb', buffering=0, closefd=False) as fp:
+        while True:
+            n = fp.readinto(buffer)
+            if not n:
+                return copied
+            view = buffer[:n]
+            while view:
+                view = view[os.write(dst, view):]
+            copied += n
+
+def concat_files(inputs, output):
+    '''Concatenate the files into output, the bytes are copied by the
+    kernel (copy_file_range) if it is supported, see copy_fd().
+    '''
+    with open(output, 'wb') as out:
+        for inputfile in inputs:
+            with open(inputfile, 'rb') as fp:
+                copy_fd(fp.fileno(), out.fileno())
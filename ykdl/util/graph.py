@@ -0,0 +1,119 @@
+'''Run the steps of a download as a graph of tasks.
+
+A task starts once all the tasks which it depends on have succeeded, so the
+independent tasks run concurrently, e.g. the video, audio and subtitles of
+a video, and the merge of a track starts as soon as its track has been
+downloaded. A task succeeds if it returns a true value, the tasks which
+depend on a failed task are skipped, the tasks which only run `after` it
+are not. The first exception of the tasks is raised by `run()` after all
+tasks have been done, and the tasks ask the user on the thread which runs
+the graph (see `input()`).
+'''
+
+import threading
+from logging import getLogger
+
+
+__all__ = ['TaskGraph']
+
+logger = getLogger(__name__)
+
+
+class TaskGraph:
+
+    def __init__(self):
+        self.tasks = {}    # name: (func, args, kwargs, deps, after)
+        self.results = {}  # name: result, None if it has been skipped
+        self.error = None  # the first exception of the tasks
+        self.prompts = []  # (prompt, answer, event) from the tasks
+        self.thread = None
+        self.cond = threading.Condition()
+
+    def add(self, name, func, *args, deps=(), after=(), **kwargs):
+        '''Add a task which runs func(*args, **kwargs) after the tasks of
+        `deps` have succeeded, and the tasks of `after` have been done,
+        whatever the results (see `results`). The tasks must have been
+        added, so there are no cycles, and the names are unique.
+        '''
+        assert name not in self.tasks, 'duplicate task %r' % name
+        for dep in tuple(deps) + tuple(after):
+            assert dep in self.tasks, 'unknown task %r' % dep
+        self.tasks[name] = func, args, kwargs, tuple(deps), tuple(after)
+        return name
+
+    def _run_task(self, name):
+        func, args, kwargs, _, _ = self.tasks[name]
+        error = None
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            logger.error('task %r failed: %r', name, e)
+            result = False
+            error = e
+        with self.cond:
+            if self.error is None:
+                self.error = error
+            self.results[name] = result
+            self.cond.notify_all()
+
+    def input(self, prompt=''):
+        '''Same as input(), but it is asked on the thread which runs the
+        graph, and waits the answer.
+        '''
+        if self.thread in (None, threading.current_thread()):
+            return input(prompt)
+        answer = []
+        event = threading.Event()
+        with self.cond:
+            self.prompts.append((prompt, answer, event))
+            self.cond.notify_all()
+        event.wait()
+        return answer[0]
+
+    def _ask(self):
+        # call with self.cond, it is released while asking
+        prompt, answer, event = self.prompts.pop(0)
+        self.cond.release()
+        try:
+            answer.append(input(prompt))
+        except EOFError:
+            pass
+        finally:
+            if not answer:
+                answer.append('')
+            event.set()
+            self.cond.acquire()
+
+    def run(self):
+        '''Run the tasks, returns {name: result} after all have been done,
+        or raises the first exception of the tasks.
+        '''
+        started = set()
+        self.thread = threading.current_thread()
+        with self.cond:
+            while True:
+                changed = False
+                while self.prompts:
+                    self._ask()
+                for name, (_, _, _, deps, after) in self.tasks.items():
+                    if name in started:
+                        continue
+                    if any(dep in self.results and not self.results[dep]
+                           for dep in deps):
+                        logger.debug('task %r is skipped', name)
+                        started.add(name)
+                        self.results[name] = None
+                        changed = True
+                    elif all(self.results.get(dep) for dep in deps) and \
+                            all(dep in self.results for dep in after):
+                        started.add(name)
+                        threading.Thread(target=self._run_task, args=(name,),
+                                         daemon=True,
+                                         name='Task-%s' % name).start()
+                if len(self.results) == len(self.tasks):
+                    if self.error is not None:
+                        raise self.error
+                    return dict(self.results)
+                if not changed:
+                    # a timeout, so the main thread can be interrupted
+                    self.cond.wait(1)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import time
+import builtins
+import threading
+import unittest
+
+from ykdl.util.graph import TaskGraph
+
+
+class TaskGraphTests(unittest.TestCase):
+
+    def test_order(self):
+        events = []
+        lock = threading.Lock()
+        def task(name, delay=0):
+            time.sleep(delay)
+            with lock:
+                events.append(name)
+            return True
+        graph = TaskGraph()
+        graph.add('video', task, 'video', 0.1)
+        graph.add('audio', task, 'audio')
+        graph.add('merge', task, 'merge', deps=['video', 'audio'])
+        results = graph.run()
+        self.assertEqual(events, ['audio', 'video', 'merge'])
+        self.assertEqual(results, {'video': True, 'audio': True,
+                                   'merge': True})
+
+    def test_skip(self):
+        graph = TaskGraph()
+        graph.add('video', lambda: False)
+        graph.add('audio', lambda: True)
+        graph.add('merge', lambda: True, deps=['video'], after=['audio'])
+        graph.add('after', lambda: True, after=['video'])
+        results = graph.run()
+        self.assertIsNone(results['merge'])
+        self.assertTrue(results['after'])
+
+    def test_error(self):
+        graph = TaskGraph()
+        def fail():
+            raise ValueError('failed')
+        graph.add('video', fail)
+        graph.add('audio', lambda: True)
+        graph.add('merge', lambda: True, deps=['video'])
+        with self.assertRaises(ValueError):
+            graph.run()
+        self.assertTrue(graph.results['audio'])
+        self.assertIsNone(graph.results['merge'])
+
+    def test_add(self):
+        graph = TaskGraph()
+        graph.add('video', lambda: True)
+        with self.assertRaises(AssertionError):
+            graph.add('video', lambda: True)
+        with self.assertRaises(AssertionError):
+            graph.add('merge', lambda: True, deps=['audio'])
+
+    def test_input(self):
+        # the prompts of tasks are asked on the thread which runs the graph
+        threads = []
+        def input(prompt=''):
+            threads.append(threading.current_thread())
+            return 'y'
+        graph = TaskGraph()
+        graph.add('ask', lambda: graph.input('continue?') == 'y')
+        _input = builtins.input
+        builtins.input = input
+        try:
+            results = graph.run()
+        finally:
+            builtins.input = _input
+        self.assertTrue(results['ask'])
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -71,14 +71,17 @@ def _do_open(self, http_class, req, **http_conn_args):
     except Empty:
         h = http_class(host, timeout=timeout, **http_conn_args)
     else:
-        h.sock.setblocking(False)
-        try:
-            h.sock.recv(1)
-            h.close()  # drop legacy and disconnection
-        except:
-            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
-                timeout = socket.getdefaulttimeout()
-            h.sock.settimeout(timeout)
+        if h.sock is None:  # has been closed, it will reconnect
+            pass
+        else:
+            h.sock.setblocking(False)
+            try:
+                h.sock.recv(1)
+                h.close()  # drop legacy and disconnection
+            except:
+                if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                    timeout = socket.getdefaulttimeout()
+                h.sock.settimeout(timeout)
 
     h.set_debuglevel(self._debuglevel)
 
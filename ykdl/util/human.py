@@ -1,7 +1,8 @@
 from .match import match, match1
 
 
-__all__ = ['human_size', 'human_time', 'format_vps']
+__all__ = ['human_size', 'parse_size', 'human_time', 'parse_time',
+           'format_vps']
 
 def _format_str(s):
     if isinstance(s, bytes):
@@ -20,15 +21,13 @@ _size_units = {
      't': 1 << 40
 }
 
-def human_size(n, unit=None):
-    '''Convert giving number to a hunman read size with unit.
+def parse_size(n):
+    '''Convert giving size string to integer number of bytes.
 
     Params:
-        `n`, integer,
-             integer and scientific notation string with or without a unit,
+        `n`, integer and scientific notation string with or without a unit,
              float string with a unit,
              hex string without a unit.
-        `unit`, specify the unit, base unit "Bytes" is not optional.
     '''
     if isinstance(n, (str, bytes)):
         n = _format_str(n)
@@ -47,10 +46,10 @@ def human_size(n, unit=None):
                                  (?![\.\de])   # bad scientific notation
                              )
                              \s*
-                             (?:([kmgt])i?b)?  # unit
+                             (?:([kmgt])(?:i?b)?)?  # unit
                              ''')
         except TypeError:
-            raise ValueError('invalid literal for human_size(): %r' % n)
+            raise ValueError('invalid literal for parse_size(): %r' % n)
         f = float(n)
         if not nu and f % 1:
             raise ValueError(
@@ -62,6 +61,16 @@ def human_size(n, unit=None):
     elif not isinstance(n, int):
         raise TypeError('argument must be a string, a bytes object '
                         'or a integer number, not %r' % type(n))
+    return n
+
+def human_size(n, unit=None):
+    '''Convert giving number to a hunman read size with unit.
+
+    Params:
+        `n`, integer or size string which is accepted by parse_size().
+        `unit`, specify the unit, base unit "Bytes" is not optional.
+    '''
+    n = parse_size(n)
     if n < 0:
         return 'N/A'
     n = float(n)
@@ -125,6 +134,19 @@ def human_time(t, days=False):
         return '{}d {:02d}:{:02d}:{:02d}'.format(days, pt0, *pt[1:])
     return ':'.join('%02d' % t for t in pt)
 
+def parse_time(t):
+    '''Convert giving time string "[[HH:]MM:]SS[.ms]" to float seconds.'''
+    if isinstance(t, (int, float)):
+        return float(t)
+    parts = t.strip().split(':')
+    if len(parts) > 3 or not all(match(n, '^(\d+(?:\.\d+)?)$')
+                                 for n in parts):
+        raise ValueError('invalid literal for parse_time(): %r' % t)
+    seconds = 0.0
+    for n in parts:
+        seconds = seconds * 60 + float(n)
+    return seconds
+
 def format_vps(*wh):
     '''Convert giving width and height to stream ID and progressive scan marking.
 
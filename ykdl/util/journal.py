@@ -0,0 +1,158 @@
+'''Resume journal of downloads.
+
+The journal is a JSON file next to the output, it records the state of
+every part:
+
+    {
+        "version": 1,
+        "parts": {
+            "0": {
+                "url": "/path/of/part.ts",  # URL identity, without host and query
+                "size": 1048576,            # expected size, -1 is unknown
+                "ranges": [[0, 1048576]],   # completed byte ranges
+                "crc32": 123456789,         # checksum of the completed ranges
+                "done": true,
+                "hashes": {"md5": "..."}    # checksums of the done part
+            },
+            ...
+        },
+        "index": {                          # only for the container
+            "0": [0, 1048576],              # offset and size of the part
+            ...
+        }
+    }
+
+The file is replaced atomically, writes are throttled to one per second.
+It is also the manifest of integrity, the partial data is verified with
+"crc32" before resuming.
+'''
+
+import os
+import json
+import time
+import threading
+from logging import getLogger
+from urllib.parse import urlsplit
+
+
+__all__ = ['Journal', 'url_identity']
+
+logger = getLogger(__name__)
+
+def url_identity(url):
+    '''Return the identity of the URL, which does not change with signed
+    parameters or CDN hosts.
+    '''
+    return urlsplit(url).path
+
+class Journal:
+
+    version = 1
+    interval = 1
+
+    def __init__(self, name, ext):
+        self.path = '%s.%s.journal' % (name, ext)
+        self.parts = {}
+        self.index = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # held until the file is replaced
+        self.last_save = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            assert data['version'] == self.version, 'version mismatch'
+            self.parts = data['parts']
+            self.index = data.get('index', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning('drop broken journal %r: %s', self.path, e)
+
+    def save(self, force=True):
+        # the snapshots are written in order, a throttled save is skipped
+        # if the other one is writing, it will be saved next time
+        if not self.write_lock.acquire(force):
+            return
+        try:
+            with self.lock:
+                now = time.monotonic()
+                if not self.dirty or not force and \
+                        now - self.last_save < self.interval:
+                    return
+                data = {'version': self.version, 'parts': self.parts}
+                if self.index:
+                    data['index'] = self.index
+                data = json.dumps(data, separators=(',', ':'))
+                self.last_save = now
+                self.dirty = False
+            tmp_path = '%s.%d.tmp' % (self.path, threading.get_ident())
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as fp:
+                    fp.write(data)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning('error occurred during save journal: %s', e)
+        finally:
+            self.write_lock.release()
+
+    def remove(self):
+        with self.write_lock:
+            with self.lock:
+                self.parts.clear()
+                self.index.clear()
+                self.dirty = False
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, part, url):
+        '''Return the recorded state of the part, or None if the part has not
+        been recorded or its URL identity does not match.
+        '''
+        state = self.parts.get(str(part))
+        if state and state['url'] == url_identity(url):
+            return state
+
+    @staticmethod
+    def offset(state):
+        '''Return the end of the first completed range which starts at 0.'''
+        if state:
+            for start, end in state['ranges']:
+                if start == 0:
+                    return end
+        return 0
+
+    def update(self, part, url, size, offset, crc32=None, done=False, **kwargs):
+        '''Record the state of the part, the data MUST be written into the
+        file before calling.
+        '''
+        state = {
+            'url': url_identity(url),
+            'size': size,
+            'ranges': [[0, offset]] if offset else [],
+            'crc32': crc32,
+            'done': done
+        }
+        state.update(kwargs)
+        with self.lock:
+            self.parts[str(part)] = state
+            self.dirty = True
+        self.save(force=False)
+
+    def discard(self, part):
+        with self.lock:
+            if self.parts.pop(str(part), None):
+                self.dirty = True
+
+    def place(self, part, offset, size):
+        '''Record the region of the part in the container.'''
+        with self.lock:
+            self.index[str(part)] = [offset, size]
+            self.dirty = True
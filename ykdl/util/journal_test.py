@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import os
+import json
+import tempfile
+import threading
+import unittest
+
+from ykdl.util.journal import Journal, url_identity
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.dir.name, 'video')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_url_identity(self):
+        self.assertEqual(url_identity('https://cdn1.com/a/1.ts?sign=1'),
+                         url_identity('http://cdn2.com/a/1.ts?sign=2'))
+        self.assertNotEqual(url_identity('https://cdn.com/a/1.ts'),
+                            url_identity('https://cdn.com/a/2.ts'))
+
+    def test_round_trip(self):
+        journal = Journal(self.name, 'ts')
+        journal.update(0, 'https://cdn.com/0.ts?t=1', 100, 100, 123, True,
+                       hashes={'md5': 'abc'})
+        journal.update(1, 'https://cdn.com/1.ts?t=1', -1, 50, 456)
+        journal.place(0, 0, 100)
+        journal.save()
+        journal = Journal(self.name, 'ts')
+        state = journal.get(0, 'https://mirror.com/0.ts?t=2')
+        self.assertTrue(state['done'])
+        self.assertEqual(state['crc32'], 123)
+        self.assertEqual(state['hashes'], {'md5': 'abc'})
+        self.assertEqual(Journal.offset(state), 100)
+        state = journal.get(1, 'https://cdn.com/1.ts?t=2')
+        self.assertFalse(state['done'])
+        self.assertEqual(Journal.offset(state), 50)
+        self.assertIsNone(journal.get(1, 'https://cdn.com/other.ts'))
+        self.assertEqual(journal.index, {'0': [0, 100]})
+
+    def test_discard_remove(self):
+        journal = Journal(self.name, 'ts')
+        journal.update(0, 'https://cdn.com/0.ts', 100, 100, 1, True)
+        journal.discard(0)
+        journal.save()
+        self.assertIsNone(Journal(self.name, 'ts').get(0, 'https://cdn.com/0.ts'))
+        journal.remove()
+        self.assertFalse(os.path.exists(journal.path))
+
+    def test_broken(self):
+        with open(self.name + '.ts.journal', 'w') as fp:
+            fp.write('{"version": 1, "parts": ')
+        with self.assertLogs('ykdl.util.journal', 'WARNING'):
+            journal = Journal(self.name, 'ts')
+        self.assertEqual(journal.parts, {})
+
+    def test_version(self):
+        with open(self.name + '.ts.journal', 'w') as fp:
+            json.dump({'version': 0, 'parts': {'0': {}}}, fp)
+        with self.assertLogs('ykdl.util.journal', 'WARNING'):
+            journal = Journal(self.name, 'ts')
+        self.assertEqual(journal.parts, {})
+
+    def test_concurrent(self):
+        journal = Journal(self.name, 'ts')
+        journal.interval = 0
+        def update(t):
+            for i in range(100):
+                part = t * 100 + i
+                journal.update(part, 'https://cdn.com/%d.ts' % part, 10, 10,
+                               part, True)
+        threads = [threading.Thread(target=update, args=(t,))
+                   for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        journal.save()
+        self.assertEqual(len(Journal(self.name, 'ts').parts), 800)
+        self.assertEqual([f for f in os.listdir(self.dir.name)
+                          if f.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
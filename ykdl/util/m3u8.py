@@ -6,7 +6,8 @@ from .human import format_vps
 logger = getLogger(__name__)
 
 
-__all__ = ['live_m3u8', 'load_m3u8_playlist', 'load_m3u8']
+__all__ = ['live_m3u8', 'load_m3u8_playlist', 'load_m3u8',
+           'load_m3u8_mirrors']
 
 def no_m3u8_warning():
     logger.warning('No python-m3u8 found, use stub m3u8!!! '
@@ -43,10 +44,14 @@ except:
         }
         return stream_types, streams
 
-    def load_m3u8(url):
+    def load_m3u8(url, start=None, end=None, audio_only=False):
         no_m3u8_warning()
         return [url], [], []
 
+    def load_m3u8_mirrors(urls, start=None, end=None, audio_only=False):
+        no_m3u8_warning()
+        return [urls[0]], [], [], None
+
 else:
     import urllib.parse
     from functools import lru_cache
@@ -109,9 +114,17 @@ else:
                                getattr(l, 'iframe_stream_info', None)),
                        name)
 
+    _audio_codecs = {'mp4a', 'ac-3', 'ec-3', 'opus', 'flac', 'alac'}
+
+    def _is_audio_only(l):
+        codecs = _get_stream_info(l, 'codecs')
+        return bool(codecs) and not _get_stream_info(l, 'resolution') and \
+               all(c.strip().split('.')[0].lower() in _audio_codecs
+                   for c in codecs.split(','))
+
     def load_m3u8_playlist(url):
 
-        def append_stream(stype, profile, urls):
+        def append_stream(stype, profile, urls, audio_only=False):
             stream_types.append(stype)
             streams[stype] = {
                 'container': 'm3u8',
@@ -119,6 +132,8 @@ else:
                 'src' : urls,
                 'size': 0
             }
+            if audio_only:
+                streams[stype]['audio_only'] = True
 
         stream_types = []
         streams = {}
@@ -131,19 +146,50 @@ else:
                     append_stream(*format_vps(*resolution), [l.absolute_uri])
                 else:
                     bandwidth = str(_get_stream_info(l, 'bandwidth'))
-                    append_stream(bandwidth, bandwidth, [l.absolute_uri])
+                    append_stream(bandwidth, bandwidth, [l.absolute_uri],
+                                  _is_audio_only(l))
         else:
             append_stream('current','current', [url])
         return stream_types, streams
 
-    def load_m3u8(url):
+    def _select_media(l, type):
+        # the rendition of DEFAULT=YES, then AUTOSELECT=YES, then the first
+        renditions = [e for e in getattr(l, 'media', []) if e.type == type]
+        for attr in ('default', 'autoselect'):
+            for e in renditions:
+                if (getattr(e, attr, None) or '').upper() == 'YES':
+                    return e
+        return renditions and renditions[0] or None
+
+    def clip_segments(segments, start=None, end=None):
+        '''Select the segments which cover the time range [start, end) by
+        their EXTINF durations, in seconds.
+        '''
+        t = 0
+        for seg in segments:
+            if end is not None and t >= end:
+                break
+            duration = seg.duration or 0
+            if not start or t + duration > start:
+                yield seg
+            t += duration
+
+    def load_m3u8(url, start=None, end=None, audio_only=False):
+        '''Returns the segment urls of video, audio, and subtitle, only the
+        segments which cover the time range [start, end) are loaded.
+
+        `audio_only`, returns the segment urls of the AUDIO rendition of
+                      the highest variant which has one, or the best
+                      audio-only variant, or the lowest variant, as the
+                      video, without audio and subtitle.
+        '''
 
         def load_media(l=None, m=None):
             urls = []
             if l:
                 m = _load(l.absolute_uri)
             if m:
-                for seg in m.segments:
+                for seg in clip_segments(m.segments, start, end):
                     urls.append(seg.absolute_uri)
             return urls
 
@@ -153,8 +199,18 @@ else:
         ll = m.playlists or m.iframe_playlists
         if ll:
             ll.sort(key=lambda l: _get_stream_info(l, 'bandwidth'))
+            if audio_only:
+                # the video segments are not loaded, the groups differ by
+                # the variants, so select from the group of the highest
+                for l in reversed(ll):
+                    audio = _select_media(l, 'AUDIO')
+                    if audio and audio.uri:
+                        return load_media(audio), [], []
+                audios = [l for l in ll if _is_audio_only(l)]
+                return load_media(l=audios and audios[-1] or ll[0]), [], []
             l = ll[-1]
-            media = {e.type: e for e in getattr(l, 'media', [])}
+            media = {type: _select_media(l, type)
+                     for type in ('AUDIO', 'SUBTITLES')}
             urls = load_media(l=l)
         else:
             media = {}
@@ -164,3 +220,33 @@ else:
         if audio and urls[0] == audio[0]:
             audio.clear()
         return urls, audio, subtitle
+
+    def load_m3u8_mirrors(urls, start=None, end=None, audio_only=False):
+        '''Load the playlists of mirrors, returns the result of first loaded
+        playlist, and the segment mirrors which are paired from the other
+        playlists with same segments count.
+        '''
+        results = []
+        error = None
+        for url in urls:
+            try:
+                results.append(load_m3u8(url, start, end, audio_only))
+            except NotImplementedError:
+                raise
+            except Exception as e:
+                logger.warning('load m3u8 mirror failed: %s, %r', url, e)
+                error = e
+        if not results:
+            raise error
+        urls, audio, subtitle = results[0]
+        mirrors = [[url] for url in urls]
+        for _urls, _, _ in results[1:]:
+            if len(_urls) != len(urls):
+                logger.debug('m3u8 mirror has different segments, ignore')
+                continue
+            for m, url in zip(mirrors, _urls):
+                if url not in m:
+                    m.append(url)
+        if all(len(m) == 1 for m in mirrors):
+            mirrors = None
+        return urls, audio, subtitle, mirrors
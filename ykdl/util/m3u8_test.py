@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import unittest
+from types import SimpleNamespace
+
+from ykdl.util.m3u8 import clip_segments
+
+
+def segments(*durations):
+    return [SimpleNamespace(uri='%d.ts' % i, duration=d)
+            for i, d in enumerate(durations)]
+
+def clip(segs, start=None, end=None):
+    return [seg.uri for seg in clip_segments(segs, start, end)]
+
+
+class ClipSegmentsTests(unittest.TestCase):
+
+    def test_all(self):
+        segs = segments(10, 10, 10)
+        self.assertEqual(clip(segs), ['0.ts', '1.ts', '2.ts'])
+        self.assertEqual(clip(segs, 0, 30), ['0.ts', '1.ts', '2.ts'])
+
+    def test_cover(self):
+        # the segments which cover the range, [5, 15) is in 0 and 1
+        segs = segments(10, 10, 10)
+        self.assertEqual(clip(segs, 5, 15), ['0.ts', '1.ts'])
+        self.assertEqual(clip(segs, 10, 20), ['1.ts'])
+        self.assertEqual(clip(segs, 10.5), ['1.ts', '2.ts'])
+        self.assertEqual(clip(segs, end=10.5), ['0.ts', '1.ts'])
+
+    def test_out_of_range(self):
+        segs = segments(10, 10)
+        self.assertEqual(clip(segs, 20), [])
+        self.assertEqual(clip(segs, 100, 200), [])
+        self.assertEqual(clip(segs, end=0), [])
+
+    def test_no_duration(self):
+        segs = segments(10, None, 10)
+        self.assertEqual(clip(segs, 10), ['2.ts'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,187 @@
+'''Concatenate MPEG-TS parts without FFmpeg.
+
+The parts are streamed into one output file, and at part boundaries:
+
+  - packets are realigned to the 188 bytes sync, junk bytes are dropped;
+  - continuity counters are shifted to continue the previous part;
+  - a jumping PCR is marked with the discontinuity indicator;
+  - optionally, the repeated PAT/PMT at the head of a part are dropped.
+'''
+
+import os
+from logging import getLogger
+
+
+__all__ = ['TSConcatenator', 'concat_ts']
+
+logger = getLogger(__name__)
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1fff
+PCR_JUMP = 90000 * 300  # 1s in 27MHz
+
+
+class TSConcatenator:
+
+    bufsize = PACKET_SIZE * 1024 * 4  # about 752KB
+
+    def __init__(self, fp, drop_psi=False):
+        self.fp = fp
+        self.drop_psi = drop_psi
+        self.cc = {}          # PID: last continuity counter which is written
+        self.psi = {}         # PID: last PAT/PMT payload which is written
+        self.pmt_pids = set()
+        self.last_pcr = None
+        self.parts = 0
+
+    def _sync(self, buf, pos):
+        '''Return the offset of the next aligned packet at or after pos.'''
+        end = len(buf) - PACKET_SIZE * 2
+        while pos < end:
+            pos = buf.find(SYNC_BYTE, pos)
+            if pos < 0 or pos >= end:
+                break
+            if buf[pos + PACKET_SIZE] == SYNC_BYTE and \
+                    buf[pos + PACKET_SIZE * 2] == SYNC_BYTE:
+                return pos
+            pos += 1
+        return -1
+
+    def _parse_pat(self, packet):
+        if not packet[1] & 0x40:  # payload_unit_start_indicator
+            return
+        af = packet[3] >> 4 & 0x3
+        p = 4
+        if af & 0x2:
+            p += 1 + packet[4]
+        p += 1 + packet[p]  # pointer_field
+        section_length = (packet[p + 1] & 0x0f) << 8 | packet[p + 2]
+        end = min(p + 3 + section_length - 4, PACKET_SIZE)
+        p += 8
+        while p + 4 <= end:
+            program_number = packet[p] << 8 | packet[p + 1]
+            if program_number:
+                self.pmt_pids.add((packet[p + 2] & 0x1f) << 8 | packet[p + 3])
+            p += 4
+
+    def _check_pcr(self, chunk, p, head):
+        # adaptation_field_length > 0 and PCR_flag
+        if chunk[p + 4] == 0 or not chunk[p + 5] & 0x10:
+            return
+        b = chunk[p + 6:p + 12]
+        pcr_base = b[0] << 25 | b[1] << 17 | b[2] << 9 | b[3] << 1 | b[4] >> 7
+        pcr = pcr_base * 300 + ((b[4] & 0x1) << 8 | b[5])
+        if head and self.last_pcr is not None and \
+                not 0 <= pcr - self.last_pcr < PCR_JUMP:
+            chunk[p + 5] |= 0x80  # discontinuity_indicator
+        self.last_pcr = pcr
+        return True
+
+    def append(self, part):
+        '''Append a part, which is a filename or a readable binary file.'''
+        if isinstance(part, (str, bytes, os.PathLike)):
+            with open(part, 'rb') as fp:
+                return self.append(fp)
+
+        delta = {}       # PID: continuity counter shift of this part
+        pcr_head = self.parts > 0
+        psi_head = self.drop_psi and self.parts > 0
+        self.parts += 1
+        write = self.fp.write
+        buf = bytearray()
+        pos = 0
+        offset = 0
+        while True:
+            data = part.read(self.bufsize)
+            if data:
+                buf += data
+            elif len(buf) - pos < PACKET_SIZE:
+                break
+            if buf[pos] != SYNC_BYTE or len(buf) - pos > PACKET_SIZE * 2 and \
+                    buf[pos + PACKET_SIZE] != SYNC_BYTE:
+                new_pos = self._sync(buf, pos)
+                if new_pos < 0:
+                    if not data:
+                        break
+                    # keep the tail, it may be the head of next packet
+                    new_pos = max(len(buf) - PACKET_SIZE * 2, pos)
+                logger.warning('drop %d bytes junk data at offset %d',
+                               new_pos - pos, offset + pos)
+                pos = new_pos
+            n = (len(buf) - pos) // PACKET_SIZE
+            if data:
+                n -= 2  # keep tail for sync check
+            if n <= 0:
+                continue
+            end = pos + n * PACKET_SIZE
+            syncs = buf[pos:end:PACKET_SIZE]
+            if syncs.count(SYNC_BYTE) != n:
+                # cut off at the broken packet, resync at next loop
+                n = next(i for i, b in enumerate(syncs) if b != SYNC_BYTE)
+                end = pos + n * PACKET_SIZE
+            chunk = buf[pos:end]
+            pcr_head, psi_head = self._process(chunk, delta, pcr_head,
+                                               psi_head)
+            write(chunk)
+            offset += end
+            del buf[:end]
+            pos = 0
+        if buf:
+            logger.warning('drop %d bytes incomplete packet at end of part %d',
+                           len(buf), self.parts - 1)
+
+    def _process(self, chunk, delta, pcr_head, psi_head):
+        cc = self.cc
+        dropped = []
+        for i, (h, l, f) in enumerate(zip(chunk[1::PACKET_SIZE],
+                                          chunk[2::PACKET_SIZE],
+                                          chunk[3::PACKET_SIZE])):
+            pid = (h & 0x1f) << 8 | l
+            if pid == NULL_PID:
+                continue
+            has_payload = f & 0x10
+            d = delta.get(pid)
+            p = i * PACKET_SIZE
+            if pid == PAT_PID or pid in self.pmt_pids:
+                packet = chunk[p:p + PACKET_SIZE]
+                if pid == PAT_PID:
+                    self._parse_pat(packet)
+                if psi_head and self.psi.get(pid) == packet[4:]:
+                    dropped.append(p)
+                    continue
+                self.psi[pid] = packet[4:]
+            elif psi_head:
+                psi_head = False
+            if f & 0x20 and self._check_pcr(chunk, p, pcr_head):
+                pcr_head = False
+            if d is None and has_payload:
+                d = delta[pid] = pid in cc and (cc[pid] + 1 - f) & 0x0f or 0
+            if d:
+                f = f & 0xf0 | (f + d) & 0x0f
+                chunk[p + 3] = f
+            if has_payload:
+                cc[pid] = f & 0x0f
+        for p in reversed(dropped):
+            del chunk[p:p + PACKET_SIZE]
+        return pcr_head, psi_head
+
+
+def concat_ts(inputs, output, drop_psi=False, remove=False):
+    '''Concatenate MPEG-TS files into output.
+
+    Params:
+        `inputs`, a list of filenames.
+        `output`, filename or writable binary file.
+        `drop_psi`, drop the repeated PAT/PMT at the head of the parts.
+        `remove`, remove the input file once it has been concatenated.
+    '''
+    if isinstance(output, (str, bytes, os.PathLike)):
+        with open(output, 'wb') as fp:
+            return concat_ts(inputs, fp, drop_psi, remove)
+    concatenator = TSConcatenator(output, drop_psi)
+    for inputfile in inputs:
+        concatenator.append(inputfile)
+        if remove:
+            os.remove(inputfile)
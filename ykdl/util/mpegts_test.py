@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import io
+import unittest
+
+from ykdl.util.mpegts import TSConcatenator, PACKET_SIZE, SYNC_BYTE
+
+
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+
+def packet(pid, cc, payload=b'', start=False, pcr=None):
+    head = bytearray([SYNC_BYTE, (start and 0x40) | pid >> 8, pid & 0xff])
+    if pcr is None:
+        head.append(0x10 | cc)
+    else:
+        base, ext = divmod(pcr, 300)
+        head.append(0x30 | cc)
+        head += bytes([7, 0x10, base >> 25 & 0xff, base >> 17 & 0xff,
+                       base >> 9 & 0xff, base >> 1 & 0xff,
+                       (base & 1) << 7 | 0x7e | ext >> 8, ext & 0xff])
+    head += payload
+    return bytes(head + b'\xff' * (PACKET_SIZE - len(head)))
+
+def pat(cc=0):
+    # pointer_field, table_id, section_length, ts_id, version, sections,
+    # program 1 => PMT_PID, CRC32 (not checked)
+    section = bytes([0, 0x00, 0xb0, 13, 0, 1, 0xc1, 0, 0,
+                     0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff,
+                     0, 0, 0, 0])
+    return packet(0, cc, section, start=True)
+
+def pmt(cc=0):
+    return packet(PMT_PID, cc, b'\x00\x02pmt', start=True)
+
+def packets(data):
+    return [data[i:i + PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+
+def concat(*parts, drop_psi=False):
+    fp = io.BytesIO()
+    concatenator = TSConcatenator(fp, drop_psi)
+    for part in parts:
+        concatenator.append(io.BytesIO(part))
+    return fp.getvalue()
+
+
+class TSConcatenatorTests(unittest.TestCase):
+
+    def test_continuity_counter(self):
+        a = b''.join(packet(VIDEO_PID, cc) for cc in range(5))
+        b = b''.join(packet(VIDEO_PID, cc) for cc in range(3))
+        out = packets(concat(a, b))
+        self.assertEqual([p[3] & 0x0f for p in out], [0, 1, 2, 3, 4, 5, 6, 7])
+
+    def test_continuity_counter_wraps(self):
+        a = b''.join(packet(VIDEO_PID, cc) for cc in range(14))
+        b = b''.join(packet(VIDEO_PID, cc) for cc in range(4))
+        out = packets(concat(a, b))
+        self.assertEqual([p[3] & 0x0f for p in out[14:]], [14, 15, 0, 1])
+
+    def test_junk(self):
+        a = b'junk' + b''.join(packet(VIDEO_PID, cc) for cc in range(4))
+        b = b''.join(packet(VIDEO_PID, cc) for cc in range(4)) + b'tail'
+        out = concat(a, b)
+        self.assertEqual(len(out), PACKET_SIZE * 8)
+        self.assertTrue(all(p[0] == SYNC_BYTE for p in packets(out)))
+
+    def test_pcr_discontinuity(self):
+        a = packet(VIDEO_PID, 0, pcr=0) + packet(VIDEO_PID, 1)
+        b = packet(VIDEO_PID, 0, pcr=27000000 * 100) + packet(VIDEO_PID, 1)
+        out = packets(concat(a, b))
+        self.assertFalse(out[0][5] & 0x80)
+        self.assertTrue(out[2][5] & 0x80)
+
+    def test_pcr_continuous(self):
+        a = packet(VIDEO_PID, 0, pcr=0) + packet(VIDEO_PID, 1)
+        b = packet(VIDEO_PID, 0, pcr=27000000 // 10) + packet(VIDEO_PID, 1)
+        out = packets(concat(a, b))
+        self.assertFalse(out[2][5] & 0x80)
+
+    def test_drop_psi(self):
+        a = pat() + pmt() + packet(VIDEO_PID, 0)
+        b = pat() + pmt() + packet(VIDEO_PID, 0)
+        out = packets(concat(a, b, drop_psi=True))
+        self.assertEqual(len(out), 4)
+        self.assertEqual([p[3] & 0x0f for p in out], [0, 0, 0, 1])
+        # kept by default, the counters continue
+        out = packets(concat(a, b))
+        self.assertEqual(len(out), 6)
+        self.assertEqual([p[3] & 0x0f for p in out], [0, 0, 0, 1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,294 @@
+'''Download into a stream (stdout or a pipe), without temporary files.
+
+The parts are split into chunks which are fetched by parallel workers with
+Range requests, the data is written strictly in order through a reorder
+buffer, its memory is bounded:
+
+  - a worker blocks when the buffer is full, unless its data is the next to
+    be written, so fetching never runs away from writing (backpressure);
+  - the chunks are dispatched in order, then the next data to be written is
+    always in the hands of a worker which is not blocked.
+
+The first chunk of a part probes its size, the following chunks are
+dispatched after its response. A part without Range support is streamed
+by one worker. The parts are concatenated as bytes.
+
+The reporthook events are the same as ykdl.util.download, they are sent
+by the writer, the progress is the written data.
+'''
+
+import time
+import socket
+import threading
+from logging import getLogger
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+from http.client import IncompleteRead
+
+from .http import fake_headers
+from .human import human_size, human_time
+from .download import multi_hook, set_rcvbuf, _get_buffer, _block_size_min
+from .scheduler import scheduler
+
+
+__all__ = ['ReorderBuffer', 'pipe_urls']
+
+logger = getLogger(__name__)
+
+_chunk_size = 1024 * 1024 * 4     # 4MB
+_buffer_size = 1024 * 1024 * 64   # 64MB
+
+
+class PipeAborted(Exception):
+    pass
+
+
+class ReorderBuffer:
+    '''Write the blocks of parts in order, `limit` bytes can be buffered.'''
+
+    def __init__(self, fp, limit=_buffer_size, reporthook=None):
+        self.fp = fp
+        self.limit = limit
+        self.reporthook = reporthook
+        self.cond = threading.Condition()
+        self.blocks = {}  # (part, offset): data
+        self.ends = {}    # part: size
+        self.size = 0
+        self.part = 0
+        self.offset = 0
+        self.error = None
+
+    def put(self, part, offset, data):
+        '''Buffer the data, block while the buffer is full.'''
+        key = part, offset
+        with self.cond:
+            while not self.error and self.size >= self.limit and \
+                    key != (self.part, self.offset):
+                self.cond.wait()
+            if self.error:
+                raise PipeAborted(self.error)
+            self.blocks[key] = data
+            self.size += len(data)
+            self.cond.notify_all()
+
+    def end(self, part, size):
+        '''The part has `size` bytes.'''
+        with self.cond:
+            self.ends[part] = size
+            self.cond.notify_all()
+
+    def abort(self, error):
+        with self.cond:
+            if not self.error:
+                self.error = error
+            self.cond.notify_all()
+
+    def write(self, count, status):
+        '''Write `count` parts in current thread, returns after all have been
+        written, raises if it has been aborted.
+        '''
+        reporthook = self.reporthook
+        while self.part < count:
+            with self.cond:
+                key = self.part, self.offset
+                while key not in self.blocks and \
+                        self.ends.get(self.part) != self.offset and \
+                        not self.error:
+                    self.cond.wait()
+                if self.error:
+                    raise PipeAborted(self.error)
+                data = self.blocks.pop(key, None)
+            if data is None:
+                # part end
+                status[self.part] = 1
+                if reporthook:
+                    reporthook(['part end', status, self.offset],
+                               self.offset, self.offset, self.part)
+                with self.cond:
+                    self.part += 1
+                    self.offset = 0
+                if reporthook and self.part < count:
+                    reporthook(['part'], part=self.part)
+                continue
+            try:
+                self.fp.write(data)
+            except (OSError, ValueError) as e:
+                self.abort(e)
+                raise
+            with self.cond:
+                self.offset += len(data)
+                self.size -= len(data)
+                self.cond.notify_all()
+            if reporthook:
+                reporthook(['part'], self.offset,
+                           self.ends.get(self.part, -1), self.part)
+        self.fp.flush()
+
+
+def pipe_urls(urls, name, fp, jobs=1, reporthook=multi_hook, weight=1,
+              mirrors=None, buffer_size=_buffer_size, chunk_size=_chunk_size,
+              tries=3):
+    '''Download the urls as the parts of one stream, write them into the
+    binary file object `fp` in order, returns whether it has been done.
+    The messages are printed into sys.stdout, redirect it if `fp` is it.
+
+    `mirrors`, optional, a list of alternate urls per part, in order.
+    `buffer_size`, the memory limit of the data which is waiting for write.
+    `chunk_size`, the size of the Range requests.
+    '''
+
+    timeout_q = min(socket.getdefaulttimeout() or 30, 30)
+    timeout_r = max(socket.getdefaulttimeout() or 0, 60)
+    count = len(urls)
+    status = [0] * count
+    sizes = [None] * count  # -1 is unknown, or no Range support
+    lengths = [-1] * count  # Content-Length of the streamed parts
+    sized = [threading.Event() for _ in range(count)]
+    buffer = ReorderBuffer(fp, buffer_size, reporthook)
+    lock = threading.Lock()
+
+    def plan():
+        for no in range(count):
+            yield no, 0, chunk_size
+            sized[no].wait()
+            size = sizes[no]
+            if size is None:  # failed
+                return
+            for start in range(chunk_size, size, chunk_size):
+                yield no, start, min(start + chunk_size, size)
+
+    units = plan()
+
+    def next_unit():
+        with lock:
+            if buffer.error:
+                return
+            return next(units, None)
+
+    def open_url(url, start, end):
+        req = Request(url, headers=fake_headers)
+        req.remove_header('Accept-encoding')
+        if start or end:
+            req.add_header('Range', 'bytes=%d-%s' % (start, end and end - 1 or ''))
+        t = time.monotonic()
+        response = urlopen(req, timeout=timeout_q)
+        job.estimator.latency(urlsplit(url).hostname, time.monotonic() - t)
+        try:
+            response.fp.raw._sock.settimeout(timeout_r)
+        except Exception as e:
+            logger.debug('error occurred during settimeout: %s', e)
+        set_rcvbuf(response)
+        return response
+
+    def fetch(part, end, url, pos, buf):
+        # pos[0] is the offset, it is kept when fails
+        host = urlsplit(url).hostname
+        offset = pos[0]
+        if sizes[part] is not None:
+            # a retry, request the rest of what has been delivered
+            end = None if sizes[part] < 0 else min(end, sizes[part])
+            if end is not None and offset >= end:
+                return
+        job.acquire(host)
+        try:
+            response = open_url(url, offset, end)
+            try:
+                if sizes[part] is None:
+                    # the probe
+                    if response.status == 206:
+                        sizes[part] = int(response.headers['Content-Range']
+                                          .split('/')[-1])
+                    else:
+                        sizes[part] = int(response.headers.get(
+                                                'Content-Length', -1))
+                        if sizes[part] > chunk_size:
+                            # no Range support, stream it
+                            lengths[part] = sizes[part]
+                            sizes[part] = -1
+                    if sizes[part] >= 0:
+                        buffer.end(part, sizes[part])
+                    sized[part].set()
+                elif response.status == 200 and offset:
+                    # Range is ignored, skip the received data
+                    needless = offset
+                    while needless > 0:
+                        n = response.readinto(buf[:min(needless, bs)])
+                        if not n:
+                            raise IncompleteRead(b'')
+                        needless -= n
+                if sizes[part] < 0:
+                    end = None
+                else:
+                    end = min(end, sizes[part])
+                while end is None or offset < end:
+                    n = bs if end is None else min(bs, end - offset)
+                    n = response.readinto(buf[:n])
+                    if not n:
+                        if end is None and lengths[part] <= offset:
+                            buffer.end(part, offset)
+                            return
+                        raise IncompleteRead(b'', (end or lengths[part])
+                                                  - offset)
+                    buffer.put(part, offset, bytes(buf[:n]))
+                    offset = pos[0] = offset + n
+                    delay = job.reserve(n, part, host)
+                    if delay > 0:
+                        time.sleep(delay)
+            finally:
+                response.close()
+        finally:
+            job.release(host)
+
+    def worker():
+        buf = _get_buffer()
+        while True:
+            unit = next_unit()
+            if unit is None:
+                return
+            part, start, end = unit
+            part_urls = [urls[part]] + [m for m in mirrors and mirrors[part]
+                                        or () if m != urls[part]]
+            pos = [start]
+            for i in range(tries + len(part_urls) - 1):
+                try:
+                    fetch(part, end, part_urls[i % len(part_urls)], pos, buf)
+                    break
+                except PipeAborted:
+                    return
+                except (IOError, IncompleteRead) as e:
+                    logger.debug('part %d failed at %d: %r', part, pos[0], e)
+                    error = e
+            else:
+                sized[part].set()
+                buffer.abort(error)
+                return
+
+    bs = _block_size_min * 4
+    job = scheduler.register(name, weight)
+    print('Start downloading: ' + name)
+    reporthook(['init'])
+    reporthook(['start', True, status, job.estimator])
+    reporthook(['part'], part=0)
+    workers = [threading.Thread(target=worker, daemon=True,
+                                name='PipeWorker-%d' % i)
+               for i in range(max(1, jobs))]
+    for w in workers:
+        w.start()
+    try:
+        buffer.write(count, status)
+    except PipeAborted as e:
+        logger.error('pipe download failed: %r', e.args[0])
+    except (OSError, ValueError) as e:
+        logger.error('pipe has been closed: %r', e)
+    except KeyboardInterrupt:
+        buffer.abort(KeyboardInterrupt())
+        raise
+    finally:
+        buffer.abort(PipeAborted('done'))
+        for s in sized:
+            s.set()
+        job.close()
+        downloaded, size, total, cost = reporthook(['end'])
+        print('\nTotal downloaded %s, cost %s'
+              % (human_size(job.transferred), human_time(cost)))
+    return 0 not in status
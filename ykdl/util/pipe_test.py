@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#-*- coding: UTF-8 -*-
+
+import io
+import random
+import threading
+import unittest
+
+from ykdl.util.pipe import ReorderBuffer, PipeAborted
+
+
+class ReorderBufferTests(unittest.TestCase):
+
+    def run_writer(self, buffer, count, status):
+        errors = []
+        def write():
+            try:
+                buffer.write(count, status)
+            except Exception as e:
+                errors.append(e)
+        t = threading.Thread(target=write, daemon=True)
+        t.start()
+        return t, errors
+
+    def test_out_of_order(self):
+        fp = io.BytesIO()
+        buffer = ReorderBuffer(fp)
+        status = [0, 0]
+        blocks = [(0, 0, b'ab'), (0, 2, b'cd'), (1, 0, b'ef'), (1, 2, b'g')]
+        random.Random(1).shuffle(blocks)
+        for part, offset, data in blocks:
+            buffer.put(part, offset, data)
+        buffer.end(1, 3)
+        buffer.end(0, 4)
+        buffer.write(2, status)
+        self.assertEqual(fp.getvalue(), b'abcdefg')
+        self.assertEqual(status, [1, 1])
+
+    def test_backpressure(self):
+        # the buffer is full, but the next block to be written is accepted
+        fp = io.BytesIO()
+        buffer = ReorderBuffer(fp, limit=4)
+        status = [0]
+        buffer.put(0, 4, b'efgh')
+        put = threading.Thread(target=buffer.put, args=(0, 8, b'ij'),
+                               daemon=True)
+        put.start()
+        put.join(0.2)
+        self.assertTrue(put.is_alive())
+        buffer.put(0, 0, b'abcd')
+        buffer.end(0, 10)
+        t, errors = self.run_writer(buffer, 1, status)
+        put.join(5)
+        t.join(5)
+        self.assertFalse(errors)
+        self.assertEqual(fp.getvalue(), b'abcdefghij')
+        self.assertEqual(status, [1])
+
+    def test_empty_part(self):
+        fp = io.BytesIO()
+        buffer = ReorderBuffer(fp)
+        status = [0, 0, 0]
+        buffer.put(0, 0, b'a')
+        buffer.end(0, 1)
+        buffer.end(1, 0)
+        buffer.put(2, 0, b'b')
+        buffer.end(2, 1)
+        buffer.write(3, status)
+        self.assertEqual(fp.getvalue(), b'ab')
+        self.assertEqual(status, [1, 1, 1])
+
+    def test_abort(self):
+        fp = io.BytesIO()
+        buffer = ReorderBuffer(fp, limit=1)
+        status = [0, 0]
+        buffer.put(0, 0, b'a')
+        buffer.end(0, 1)
+        t, errors = self.run_writer(buffer, 2, status)
+        buffer.abort(IOError('part 1 failed'))
+        t.join(5)
+        self.assertIsInstance(errors[0], PipeAborted)
+        with self.assertRaises(PipeAborted):
+            buffer.put(1, 0, b'b')
+
+    def test_reporthook(self):
+        events = []
+        def reporthook(action, *args, **kwargs):
+            events.append(action[0])
+        fp = io.BytesIO()
+        buffer = ReorderBuffer(fp, reporthook=reporthook)
+        buffer.put(0, 0, b'ab')
+        buffer.end(0, 2)
+        buffer.put(1, 0, b'c')
+        buffer.end(1, 1)
+        buffer.write(2, [0, 0])
+        self.assertEqual(events.count('part end'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
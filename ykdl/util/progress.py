@@ -0,0 +1,368 @@
+'''Progress aggregation and rendering of downloads.
+
+Download workers only bump the counters of their parts, they never format
+strings, take locks or touch the terminal. A single renderer samples those
+counters at a fixed frame rate, the speed and ETA are sampled from the
+estimator of the job (see ykdl.util.estimator).
+
+JSONLinesRenderer is for machines, it writes the events and the sampled
+progress as JSON objects, one per line, e.g.
+
+    {"event": "start", "time": 1700000000.0, "parts": [0, 3]}
+    {"event": "part", "time": ..., "part": 0}
+    {"event": "progress", "time": ..., "part": 0, "bytes": 524288,
+     "total": 1048576, "parts": [0, 3], "speed": 262144.0,
+     "part_speed": 131072.0, "eta": 2.1, "host": "example.com"}
+    {"event": "error", "time": ..., "host": "example.com",
+     "error": "HTTPError 503: 'Service Unavailable'"}
+    {"event": "part end", "time": ..., "part": 0, "bytes": 1048576,
+     "total": 1048576, "downloaded": 1048576, "ok": true, "parts": [1, 3]}
+    {"event": "message", "time": ..., "text": "Start downloading: name"}
+    {"event": "log", "time": ..., "level": "ERROR", "text": "..."}
+    {"event": "end", "time": ..., "bytes": 3145728, "total": 3145728,
+     "parts": [3, 3], "cost": 2.5}
+'''
+
+import sys
+import json
+import time
+import logging
+import threading
+from shutil import get_terminal_size
+
+from .human import human_size, human_time
+from .log import IS_ANSI_TERMINAL
+
+
+__all__ = ['Progress', 'NullRenderer', 'TerminalRenderer',
+           'JSONLinesRenderer', 'get_renderer']
+
+print_lock = threading.Lock()
+_max_columns = get_terminal_size().columns - 1
+_clear_enter = '\r' + ' ' * _max_columns + '\r'
+_progress_bar_len = max(_max_columns - 54, 10)
+if IS_ANSI_TERMINAL:
+    _progress_bar_fg = ' '
+    _progress_bar_bg = ' '
+    _progress_bar_fmt = ' \33[47m%s\33[100m%s\33[0m'
+else:
+    _progress_bar_fg = '#'
+    _progress_bar_bg = '|'
+    _progress_bar_fmt = ' %s%s'
+
+def get_progress_bar(percent):
+    bar_fg = _progress_bar_fg * int(_progress_bar_len * percent / 100)
+    bar_bg = _progress_bar_bg * (_progress_bar_len - len(bar_fg))
+    return _progress_bar_fmt % (bar_fg, bar_bg)
+
+def format_part_progress(size, total):
+    if size is None:
+        return 'N/A', None
+    if total > 0:
+        percent = min(int(size * 100 / total), 100)
+        return '%d%%' % percent, percent
+    return human_size(size), None
+
+
+class Progress:
+    '''Per-part counters of one download.
+
+    Every part is only updated by the worker which downloading it, plain
+    assignments are atomic, so there are no locks.
+    '''
+
+    def __init__(self):
+        self.init()
+
+    def init(self):
+        self.downloaded = {}  # part: (downloaded, filesize, totalsize)
+        self.parts = {}       # active part: (filesize, totalsize)
+        self.status = []
+        self.single = True
+        self.current = None
+        self.estimator = None
+        self.start_time = self.end_time = time.monotonic()
+
+    def start(self, single, status, estimator=None):
+        self.single = single
+        self.status = status
+        self.estimator = estimator
+        self.parts = {}
+        self.current = None
+        self.start_time = time.monotonic()
+        self.end_time = None
+
+    def update(self, part, size=None, total=None):
+        self.parts[part] = self.current = size, total
+
+    def finish(self, part, downloaded, size, total):
+        self.parts.pop(part, None)
+        try:
+            d, s, t = self.downloaded[part]
+            downloaded += d
+            if total < 0:
+                total = t
+        except KeyError:
+            pass
+        self.downloaded[part] = downloaded, size, total
+
+    def end(self):
+        self.end_time = time.monotonic()
+        if self.downloaded:
+            downloaded, size, total = map(sum, zip(*self.downloaded.values()))
+        else:
+            downloaded = size = total = 0
+        self.downloaded.update({k: (0, v[1], v[2])
+                                for k, v in self.downloaded.items()})
+        return downloaded, size, total, self.cost
+
+    @property
+    def cost(self):
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def speed(self):
+        '''Return (speed, ETA of current part), speed is None without estimator.'''
+        estimator = self.estimator
+        if estimator is None:
+            return None, -1
+        eta = -1
+        if self.single and self.current:
+            size, total = self.current
+            if size is not None and total > 0:
+                eta = estimator.eta(total - size)[0]
+        return estimator.throughput(), eta
+
+
+class NullRenderer:
+    '''Renders nothing but messages, is used by non-TTY outputs.'''
+
+    def start(self, progress):
+        pass
+
+    def stop(self):
+        pass
+
+    def event(self, action, part, size=None, total=None, *args):
+        '''Part start and end, size and total are None when start, the args
+        are (status, downloaded) when end.
+        '''
+        pass
+
+    def print(self, *args, **kwargs):
+        with print_lock:
+            print(*args, **kwargs)
+
+
+class TerminalRenderer(NullRenderer):
+    '''Render progress into one terminal line at a fixed frame rate.'''
+
+    fps = 10
+
+    def __init__(self):
+        self.progress = None
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self, progress):
+        self.progress = progress
+        self._running.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='ProgressRenderer')
+            self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self.render()
+
+    def print(self, *args, **kwargs):
+        with print_lock:
+            sys.stdout.write(_clear_enter)
+            print(*args, **kwargs)
+
+    def _run(self):
+        interval = 1 / self.fps
+        while True:
+            self._running.wait()
+            self.render()
+            time.sleep(interval)
+
+    def format(self):
+        progress = self.progress
+        status = progress.status
+        elapsed = human_time(progress.cost)
+        speed, eta = progress.speed()
+        if progress.single:
+            _progress, percent = format_part_progress(
+                    *(progress.current or (None, None)))
+            line = '  %s [%d/%d] [%s]' % (_progress, sum(status), len(status),
+                                         elapsed)
+            if speed is not None:
+                line += ' %s/s' % human_size(int(speed))
+                if eta >= 0:
+                    line += ' ETA %s' % human_time(eta)
+            if percent is not None:
+                line = get_progress_bar(percent) + line
+        else:
+            line = 'Processes[%d/%d][%s]' % (sum(status), len(status), elapsed)
+            if speed is not None:
+                line += '[%s/s]' % human_size(int(speed))
+            line += ': '
+            line += ' '.join(['P%d-%s' % (part, format_part_progress(*p)[0])
+                              for part, p in sorted(progress.parts.copy().items())])
+            if len(line) > _max_columns:
+                line = line[:_max_columns - 3] + '...'
+        return line
+
+    def render(self):
+        if self.progress is None:
+            return
+        line = self.format()
+        with print_lock:
+            sys.stdout.write(_clear_enter)
+            sys.stdout.write(line)
+            sys.stdout.write('\r')
+            sys.stdout.flush()
+
+
+class _LogHandler(logging.Handler):
+
+    def __init__(self, renderer):
+        super().__init__(logging.WARNING)
+        self.renderer = renderer
+
+    def emit(self, record):
+        try:
+            self.renderer.emit('log', level=record.levelname,
+                               text=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+class JSONLinesRenderer(NullRenderer):
+    '''Write JSON lines into the stream, see the module. The events are
+    written at once, the progress of parts is sampled at a fixed rate, only
+    the changed is written. The messages are also printed as usual.
+    '''
+
+    fps = 2
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.progress = None
+        self._running = threading.Event()
+        self._thread = None
+        self._sent = {}  # part: sent size
+        self._errors = 0
+        logging.getLogger().addHandler(_LogHandler(self))
+
+    def emit(self, event, **fields):
+        obj = {'event': event, 'time': round(time.time(), 3)}
+        obj.update(fields)
+        line = json.dumps(obj, ensure_ascii=False)
+        with print_lock:
+            try:
+                self.stream.write(line + '\n')
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _parts(self):
+        status = self.progress.status
+        return [sum(status), len(status)]
+
+    def start(self, progress):
+        self.progress = progress
+        self._sent = {}
+        if progress.estimator:
+            self._errors = progress.estimator.error_count
+        self.emit('start', parts=self._parts())
+        self._running.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='ProgressRenderer')
+            self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self.render()
+        progress = self.progress
+        if progress is None:
+            return
+        size = total = 0
+        for _, s, t in progress.downloaded.values():
+            size += s or 0
+            total += t if t and t > 0 else s or 0
+        self.emit('end', bytes=size, total=total, parts=self._parts(),
+                  cost=round(progress.cost, 3))
+
+    def event(self, action, part, size=None, total=None, *args):
+        if self.progress is None:
+            return
+        if action == 'part':
+            self.emit('part', part=part)
+            return
+        status, downloaded = args
+        estimator = self.progress.estimator
+        self._sent.pop(part, None)
+        self.emit_errors()
+        self.emit('part end', part=part, bytes=size, total=total,
+                  downloaded=downloaded, ok=bool(status[part]),
+                  parts=self._parts(),
+                  host=estimator and estimator.hosts.get(part))
+
+    def print(self, *args, **kwargs):
+        super().print(*args, **kwargs)
+        text = kwargs.get('sep', ' ').join(map(str, args)).strip()
+        if text:
+            self.emit('message', text=text)
+
+    def _run(self):
+        interval = 1 / self.fps
+        while True:
+            self._running.wait()
+            self.render()
+            time.sleep(interval)
+
+    def emit_errors(self):
+        estimator = self.progress.estimator
+        if estimator is None:
+            return
+        for count, host, error in list(estimator.errors):
+            if count > self._errors:
+                self._errors = count
+                self.emit('error', host=host, error=repr(error))
+
+    def render(self):
+        progress = self.progress
+        if progress is None:
+            return
+        estimator = progress.estimator
+        self.emit_errors()
+        speed, _ = progress.speed()
+        if speed is not None:
+            speed = int(speed)
+        for part, (size, total) in sorted(progress.parts.copy().items()):
+            if size is None or self._sent.get(part) == size:
+                continue
+            self._sent[part] = size
+            fields = {'part': part, 'bytes': size, 'total': total,
+                      'parts': self._parts(), 'speed': speed}
+            if estimator:
+                fields['part_speed'] = int(estimator.throughput(part))
+                fields['host'] = estimator.hosts.get(part)
+                if total and total > 0:
+                    eta = estimator.eta(total - size, part)[0]
+                    fields['eta'] = round(eta, 1) if eta >= 0 else None
+            self.emit('progress', **fields)
+
+
+def get_renderer(stream=sys.stdout):
+    '''Return a progress renderer which is suitable for the output stream.'''
+    try:
+        isatty = stream.isatty()
+    except (AttributeError, ValueError):
+        isatty = False
+    if isatty:
+        return TerminalRenderer()
+    return NullRenderer()
@@ -0,0 +1,173 @@
+'''Process-wide transfer scheduler.
+
+All downloads register a job with the scheduler, which enforces:
+
+  - a global bandwidth cap, shared by the active jobs by their weights;
+  - a global connection budget and a per-host connection quota, shared by
+    the waiting jobs by their weights.
+
+Limits of 0 mean unlimited. Every job has an estimator (see
+ykdl.util.estimator) which is fed by `Job.reserve()`, the throughput is
+exposed by `Job.throughput` and `TransferScheduler.stats()`.
+
+Thread workers block in `Job.acquire()` and sleep the delays which are
+returned by `Job.reserve()`, the asyncio workers use `Job.try_acquire()`
+and sleep the delays with `asyncio.sleep()`.
+'''
+
+import time
+import threading
+from collections import defaultdict
+
+from .estimator import Estimator
+
+
+__all__ = ['TransferScheduler', 'Job', 'scheduler']
+
+_burst = 0.2      # seconds of data which can be sent without delay
+_active = 1       # a job is active if it has transfered data in seconds
+
+
+class Job:
+    def __init__(self, scheduler, name, weight=1):
+        self.scheduler = scheduler
+        self.name = name
+        self.weight = weight
+        self.connections = 0
+        self.waiting = 0
+        self.transferred = 0
+        self.next_time = 0.0
+        self.last_active = 0.0
+        self.estimator = Estimator()
+
+    def __repr__(self):
+        return '<Job %r weight=%s connections=%d throughput=%d>' % (
+                self.name, self.weight, self.connections, self.throughput)
+
+    def acquire(self, host, timeout=None):
+        '''Acquire a connection slot to host, block until it is available.'''
+        return self.scheduler.acquire(self, host, timeout)
+
+    def try_acquire(self, host):
+        '''Acquire a connection slot to host without blocking.'''
+        return self.scheduler.acquire(self, host, 0)
+
+    def release(self, host):
+        self.scheduler.release(self, host)
+
+    @property
+    def throughput(self):
+        return self.estimator.throughput()
+
+    def reserve(self, n, part=None, host=None):
+        '''Account n bytes of part transferred from host, returns the seconds
+        which MUST be waited to keep the bandwidth limit.
+        '''
+        now = time.monotonic()
+        self.transferred += n
+        self.last_active = now
+        self.estimator.update(part, n, host)
+        if self.scheduler.rate:
+            return self.scheduler.pace(self, n, now)
+        return 0
+
+    def close(self):
+        self.scheduler.unregister(self)
+
+
+class TransferScheduler:
+
+    def __init__(self, rate=0, max_connections=0, max_host_connections=0):
+        self.cond = threading.Condition()
+        self.jobs = []
+        self.connections = 0
+        self.host_connections = defaultdict(int)
+        self.next_time = 0.0
+        self.configure(rate, max_connections, max_host_connections)
+
+    def configure(self, rate=None, max_connections=None,
+                  max_host_connections=None):
+        '''Set the limits, bytes per second and connections.'''
+        with self.cond:
+            if rate is not None:
+                self.rate = rate
+            if max_connections is not None:
+                self.max_connections = max_connections
+            if max_host_connections is not None:
+                self.max_host_connections = max_host_connections
+            self.cond.notify_all()
+
+    def register(self, name, weight=1):
+        job = Job(self, name, weight)
+        with self.cond:
+            self.jobs.append(job)
+        return job
+
+    def unregister(self, job):
+        with self.cond:
+            if job in self.jobs:
+                self.jobs.remove(job)
+            self.cond.notify_all()
+
+    def stats(self):
+        '''Returns a list of (name, weight, connections, throughput).'''
+        with self.cond:
+            return [(job.name, job.weight, job.connections, job.throughput)
+                    for job in self.jobs]
+
+    def _share(self, job, total, active):
+        weights = sum(j.weight for j in self.jobs if active(j)) or job.weight
+        return total * job.weight / weights
+
+    def _can_acquire(self, job, host):
+        if self.max_host_connections and \
+                self.host_connections[host] >= self.max_host_connections:
+            return False
+        if self.max_connections and \
+                self.connections >= self.max_connections:
+            return False
+        budget = [n for n in (self.max_connections,
+                              self.max_host_connections) if n]
+        # other jobs are waiting, do not exceed the fair share
+        if budget and any(j.waiting for j in self.jobs if j is not job):
+            share = self._share(job, min(budget),
+                                lambda j: j.waiting or j.connections)
+            return job.connections < max(share, 1)
+        return True
+
+    def acquire(self, job, host, timeout=None):
+        with self.cond:
+            job.waiting += 1
+            try:
+                if not self.cond.wait_for(
+                        lambda: self._can_acquire(job, host), timeout):
+                    return False
+                self.connections += 1
+                self.host_connections[host] += 1
+                job.connections += 1
+                return True
+            finally:
+                job.waiting -= 1
+
+    def release(self, job, host):
+        with self.cond:
+            self.connections -= 1
+            self.host_connections[host] -= 1
+            if not self.host_connections[host]:
+                del self.host_connections[host]
+            job.connections -= 1
+            self.cond.notify_all()
+
+    def pace(self, job, n, now):
+        with self.cond:
+            rate = self.rate
+            if not rate:
+                return 0
+            share = self._share(job, rate,
+                                lambda j: now - j.last_active < _active)
+            self.next_time = max(self.next_time, now - _burst) + n / rate
+            job.next_time = max(job.next_time, now - _burst) + n / share
+            return max(self.next_time, job.next_time) - now
+
+
+scheduler = TransferScheduler()
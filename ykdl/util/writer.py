@@ -0,0 +1,263 @@
+'''The writer stage of downloads.
+
+Download workers do not write files, they hand the received blocks to one
+writer thread over a bounded queue, then go back to network at once:
+
+  - the blocks which are continuous in a file are coalesced into one large
+    sequential write (`os.pwritev` if it is available);
+  - the queue is bounded by bytes, a worker blocks when it is full, so a
+    disk stall slows down the network reads instead of using up memory;
+  - the receive buffers come from a pool, they are recycled after written,
+    the data is never copied;
+  - the callback of a block is called after it has been written, e.g.
+    update the journal.
+
+`fsync_policy` is 'none' (default), 'close' (when the file is closed), or
+'interval' (every second and when the file is closed).
+'''
+
+import os
+import time
+import threading
+from collections import deque
+from logging import getLogger
+
+
+__all__ = ['Writer', 'WriterFile', 'writer', 'fsync_policies', 'preallocate']
+
+logger = getLogger(__name__)
+
+_queue_size = 1024 * 1024 * 32     # 32MB
+_coalesce_size = 1024 * 1024 * 8   # 8MB
+_buffer_size = 1024 * 1024         # 1MB
+_fsync_interval = 1
+
+fsync_policies = 'none', 'close', 'interval'
+fsync_policy = 'none'
+
+_pwritev = getattr(os, 'pwritev', None)
+
+
+_fallocate = None
+FALLOC_FL_KEEP_SIZE = 1
+
+def _load_fallocate():
+    global _fallocate
+    if _fallocate is None:
+        _fallocate = False
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            func = getattr(libc, 'fallocate64', None) or libc.fallocate
+        except (OSError, AttributeError) as e:
+            logger.debug('fallocate is unavailable: %s', e)
+        else:
+            func.argtypes = (ctypes.c_int, ctypes.c_int,
+                             ctypes.c_int64, ctypes.c_int64)
+            func.restype = ctypes.c_int
+            _fallocate = func
+    return _fallocate
+
+def preallocate(fp, size):
+    '''Preallocate disk space for the file, only works on Linux.
+
+    The file size is not changed (FALLOC_FL_KEEP_SIZE), so the size of an
+    interrupted part is still its progress, never the full length.
+    '''
+    fallocate = _load_fallocate()
+    if not fallocate:
+        return False
+    if fallocate(fp.fileno(), FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+        import ctypes
+        logger.debug('error occurred during preallocate: %s',
+                     os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+def _write_all(fd, views, offset):
+    # write the continuous views at offset
+    if _pwritev is None:
+        data = views[0] if len(views) == 1 else b''.join(views)
+        views = [memoryview(data)]
+    views = [view for view in views if len(view)]
+    while views:
+        if _pwritev:
+            n = _pwritev(fd, views, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, views[0])
+        offset += n
+        while n:
+            if n >= len(views[0]):
+                n -= len(views.pop(0))
+            else:
+                views[0] = views[0][n:]
+                n = 0
+
+
+class WriterFile:
+    '''A file which is written by the writer thread.'''
+
+    base = 0  # the offsets are relative to it
+
+    def __init__(self, writer, path, mode='wb'):
+        self.writer = writer
+        self.path = path
+        self.fp = open(path, mode, buffering=0)
+        self.fd = self.fp.fileno()
+        self.offset = 0
+        self.pending = 0
+        self.error = None
+        self.last_sync = time.monotonic()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def tell(self):
+        return self.offset
+
+    def write(self, data, callback=None, buffer=None):
+        '''Queue the data at current offset, `buffer` is the pool buffer
+        which holds the data, it is recycled after written.
+        '''
+        if self.error:
+            raise self.error
+        n = len(data)
+        self.writer.submit(self, self.base + self.offset, data, callback,
+                           buffer)
+        self.offset += n
+        return n
+
+    def flush(self):
+        '''Wait all queued data of the file have been written.'''
+        self.writer.wait(self)
+        if self.error:
+            raise self.error
+
+    def truncate(self, size):
+        self.writer.wait(self)
+        self.fp.truncate(size)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+            if fsync_policy != 'none':
+                os.fsync(self.fd)
+        finally:
+            self._release()
+
+    def _release(self):
+        self.fp.close()
+
+
+class Writer:
+
+    def __init__(self, limit=_queue_size):
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.queued = 0
+        self.buffers = []
+        self.thread = None
+
+    def open(self, path, mode='wb'):
+        return WriterFile(self, path, mode)
+
+    def get_buffer(self):
+        '''Return a receive buffer from the pool.'''
+        try:
+            return self.buffers.pop()
+        except IndexError:
+            return memoryview(bytearray(_buffer_size))
+
+    def recycle(self, buffer):
+        '''Return the buffer which is not handed over into the pool.'''
+        with self.cond:
+            self.buffers.append(buffer)
+
+    def submit(self, wfile, offset, data, callback=None, buffer=None):
+        size = len(data) if buffer is None else len(buffer)
+        with self.cond:
+            # the data is always accepted if the queue is empty
+            while self.queued and self.queued + size > self.limit:
+                self.cond.wait()
+            self.queue.append((wfile, offset, data, callback, buffer, size))
+            self.queued += size
+            wfile.pending += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True,
+                                               name='FileWriter')
+                self.thread.start()
+            self.cond.notify_all()
+
+    def wait(self, wfile):
+        with self.cond:
+            while wfile.pending:
+                self.cond.wait()
+
+    def _take(self):
+        # take a batch of items, at least one
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            batch = [self.queue.popleft()]
+            size = len(batch[0][2])
+            while self.queue and size < _coalesce_size:
+                batch.append(self.queue.popleft())
+                size += len(batch[-1][2])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            i = 0
+            while i < len(batch):
+                # the continuous items of a file
+                wfile, offset, data, _, _, _ = batch[i]
+                end = offset + len(data)
+                j = i + 1
+                while j < len(batch) and batch[j][0] is wfile and \
+                        batch[j][1] == end:
+                    end += len(batch[j][2])
+                    j += 1
+                group = batch[i:j]
+                if not wfile.error:
+                    try:
+                        _write_all(wfile.fd, [memoryview(item[2])
+                                              for item in group], offset)
+                        for item in group:
+                            if item[3]:
+                                item[3]()
+                        now = time.monotonic()
+                        if fsync_policy == 'interval' and \
+                                now - wfile.last_sync >= _fsync_interval:
+                            os.fsync(wfile.fd)
+                            wfile.last_sync = now
+                    except Exception as e:
+                        logger.debug('error occurred during write %r: %r',
+                                     wfile.path, e)
+                        wfile.error = e
+                with self.cond:
+                    for item in group:
+                        if item[4] is not None:
+                            self.buffers.append(item[4])
+                        self.queued -= item[5]
+                        wfile.pending -= 1
+                    self.cond.notify_all()
+                i = j
+
+
+writer = Writer()
@@ -19,6 +19,8 @@ class VideoInfo():
         self.streams = {}  # TODO: more streams
         self.live = live
         self.subtitles = []
+        self.archive_key = None  # (site, vid) in the download archive
+        self.reparse = None      # re-run the extractor, see refresh_stream()
         self.extra = {k: '' for k in ['ua',
                                       'referer',
                                       'header',
@@ -81,6 +83,13 @@ class VideoInfo():
             print('Real url:')
             print(subtitle['src'])
 
+    def refresh_stream(self, stream_id):
+        '''Re-run the extractor, returns the fresh (urls, mirrors, expires)
+        of the stream, it is used to refresh the expired urls.
+        '''
+        stream = self.reparse().streams[stream_id]
+        return stream['src'], stream.get('mirrors'), stream.get('expires')
+
     def jsonlize(self):
         json_dict = { 'site'   : self.site,
                       'title'  : self.title,